@@ -0,0 +1,302 @@
+import asyncio
+import request
+from body_reader import parse_chunk_size
+from request import (
+    cache_key, lookup_cache, build_request, parse_status_line, parse_header_line,
+    response_has_body, keeps_alive, redirect_target, decode_content,
+    finish_response, parse_url, tls_sessions,
+)
+
+
+class ResponseTooLarge(ValueError):
+    """Raised when a body is longer than the fetcher's max_bytes."""
+
+
+class AsyncFetcher:
+    """
+    Fetch URLs concurrently on one event loop.
+
+    Responses go through the same cache, header, redirect, chunked and gzip
+    handling as make_http_request; idle keep-alive streams are reused
+    between requests made with the same fetcher.
+
+    Cache lookups, decompression and decoding run in worker threads, as
+    they touch the disk or take time in proportion to the body, and new
+    connections go through request.transport or the shared resolver.
+    """
+    def __init__(self, concurrency=6, max_bytes=None, min_lifetime=0):
+        """
+        Initialize a fetcher.
+
+        Args:
+            concurrency (int): Maximum number of requests in flight.
+            max_bytes (int): Give up on bodies longer than this, if set.
+            min_lifetime (float): Passed to finish_response for every response.
+        """
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.idle = {}
+        self.max_bytes = max_bytes
+        self.min_lifetime = min_lifetime
+
+    async def fetch(self, url, max_redirects=5):
+        """
+        Fetch an http(s) URL and return its decoded body.
+
+        Args:
+            url (str): The absolute URL to fetch.
+            max_redirects (int): How many redirects to follow.
+
+        Returns:
+            str: The content of the response.
+        """
+        async with self.semaphore:
+            return await self.request(*parse_url(url), max_redirects=max_redirects)
+
+    async def request(self, host, port, path, scheme, max_redirects=5):
+        """The asynchronous counterpart of make_http_request."""
+        key = cache_key(host, port, path, scheme)
+        cached_text, disk_entry = await asyncio.to_thread(lookup_text, key)
+        if cached_text is not None:
+            return cached_text
+
+        connection_key = (host, port, scheme)
+        reader, writer, statusline = await self.send_request(
+            connection_key, build_request(host, path, disk_entry))
+        try:
+            version, status, explanation = parse_status_line(statusline)
+            response_headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                header, value = parse_header_line(line)
+                response_headers[header] = value
+
+            reusable = keeps_alive(version, response_headers)
+            if not response_has_body(status):
+                content = b""
+            elif "content-length" in response_headers:
+                length = int(response_headers["content-length"])
+                if self.max_bytes is not None and length > self.max_bytes:
+                    raise ResponseTooLarge(f"{length} bytes")
+                content = await reader.readexactly(length)
+            elif response_headers.get("transfer-encoding") == "chunked":
+                content = await read_chunked(reader, self.max_bytes)
+            else:
+                content = await read_to_eof(reader, self.max_bytes)
+                reusable = False
+        except BaseException:
+            writer.close()
+            raise
+        self.release(connection_key, reader, writer, reusable)
+
+        new_url = redirect_target(host, port, path, scheme, response_headers)
+        if new_url is not None and max_redirects > 0:
+            return await self.request(*parse_url(new_url), max_redirects=max_redirects - 1)
+
+        text = await asyncio.to_thread(finish_text, key, status, content, response_headers,
+                                       disk_entry, self.min_lifetime)
+        if text is None:
+            return await self.request(host, port, path, scheme, max_redirects)
+        return text
+
+    async def send_request(self, connection_key, request):
+        """
+        Write a request on an idle or new stream and read its status line,
+        retrying once on a fresh stream if a reused one was closed.
+
+        Returns:
+            tuple: (reader, writer, statusline)
+        """
+        reader, writer, reused = await self.open(connection_key)
+        try:
+            statusline = await exchange(reader, writer, request)
+        except OSError:
+            writer.close()
+            if not reused:
+                raise
+            reader, writer, _ = await self.open(connection_key, fresh=True)
+            try:
+                statusline = await exchange(reader, writer, request)
+            except BaseException:
+                writer.close()
+                raise
+        return reader, writer, statusline
+
+    async def open(self, connection_key, fresh=False):
+        idle = self.idle.get(connection_key, [])
+        while idle and not fresh:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+        host, port, scheme = connection_key
+        if request.transport is not None:
+            reader, writer = await request.transport.open_streams(host, port, scheme)
+        else:
+            reader, writer = await open_streams(host, port, scheme)
+        return reader, writer, False
+
+    def release(self, connection_key, reader, writer, reusable):
+        if reusable:
+            self.idle.setdefault(connection_key, []).append((reader, writer))
+        else:
+            writer.close()
+
+    async def close(self):
+        """Close every idle stream."""
+        writers = [writer for streams in self.idle.values() for _, writer in streams]
+        self.idle.clear()
+        for writer in writers:
+            writer.close()
+        for writer in writers:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+
+async def exchange(reader, writer, request):
+    """
+    Write a request and read the status line of its response.
+
+    Returns:
+        bytes: The status line.
+    """
+    writer.write(request)
+    await writer.drain()
+    statusline = await reader.readline()
+    if not statusline:
+        raise ConnectionResetError("Connection closed by server")
+    return statusline
+
+
+async def open_streams(host, port, scheme):
+    """
+    Open a stream pair to a host over the network.
+
+    The TCP connection is made in a worker thread by request.open_tcp, so
+    it shares the DNS cache and Happy Eyeballs with blocking requests.
+    TLS runs on the event loop with the shared context; asyncio cannot
+    offer a saved session.
+
+    Returns:
+        tuple: (reader, writer)
+    """
+    sock = await asyncio.to_thread(request.open_tcp, host, port)
+    try:
+        if scheme == "https":
+            return await asyncio.open_connection(sock=sock, ssl=tls_sessions.context,
+                                                 server_hostname=host)
+        return await asyncio.open_connection(sock=sock)
+    except BaseException:
+        sock.close()
+        raise
+
+
+def lookup_text(key):
+    """lookup_cache, with a cached body decoded to text."""
+    cached_content, disk_entry = lookup_cache(key)
+    if cached_content is not None:
+        return cached_content.decode('utf-8'), None
+    return None, disk_entry
+
+
+def finish_text(key, status, content, response_headers, disk_entry, min_lifetime):
+    """
+    Undo the content encoding of a body, cache it and decode it to text.
+
+    Returns:
+        str: The text, or None if a revalidated body vanished from disk.
+    """
+    content = finish_response(key, status, decode_content(content, response_headers),
+                              response_headers, disk_entry, min_lifetime)
+    if content is None:
+        return None
+    return content.decode('utf-8')
+
+
+async def read_chunked(reader, max_bytes=None):
+    """Read a chunked transfer-encoded body from an asyncio StreamReader."""
+    chunks = []
+    total = 0
+    while True:
+        chunk_size = parse_chunk_size(await reader.readline())
+        if chunk_size == 0:
+            # Skip any trailers up to the terminating blank line
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            break
+        total += chunk_size
+        if max_bytes is not None and total > max_bytes:
+            raise ResponseTooLarge(f"over {max_bytes} bytes")
+        chunks.append(await reader.readexactly(chunk_size))
+        if (await reader.readline()) not in (b"\r\n", b"\n"):
+            raise ValueError("Missing CRLF after chunk data")
+    return b"".join(chunks)
+
+
+async def read_to_eof(reader, max_bytes=None):
+    """Read a body delimited by the connection closing."""
+    if max_bytes is None:
+        return await reader.read()
+    chunks = []
+    total = 0
+    while True:
+        chunk = await reader.read(64 * 1024)
+        if not chunk:
+            return b"".join(chunks)
+        total += len(chunk)
+        if total > max_bytes:
+            raise ResponseTooLarge(f"over {max_bytes} bytes")
+        chunks.append(chunk)
+
+
+async def fetch(url, fetcher=None):
+    """
+    Fetch a single URL asynchronously.
+
+    Args:
+        url (str): The absolute http(s) URL to fetch.
+        fetcher (AsyncFetcher): A fetcher to share streams with, if any.
+
+    Returns:
+        str: The content of the response.
+    """
+    if fetcher is not None:
+        return await fetcher.fetch(url)
+    fetcher = AsyncFetcher()
+    try:
+        return await fetcher.fetch(url)
+    finally:
+        await fetcher.close()
+
+
+async def fetch_many(urls, concurrency=6):
+    """
+    Fetch several URLs concurrently.
+
+    Args:
+        urls (list): The absolute http(s) URLs to fetch.
+        concurrency (int): Maximum number of requests in flight.
+
+    Returns:
+        list: The content of each response, in the order of `urls`. A URL
+              that failed has its exception in its place instead.
+    """
+    fetcher = AsyncFetcher(concurrency)
+    try:
+        return await asyncio.gather(*(fetcher.fetch(url) for url in urls),
+                                    return_exceptions=True)
+    finally:
+        await fetcher.close()
+
+
+def fetch_sync(url):
+    """Run fetch() to completion from synchronous code."""
+    return asyncio.run(fetch(url))
+
+
+def fetch_many_sync(urls, concurrency=6):
+    """Run fetch_many() to completion from synchronous code."""
+    return asyncio.run(fetch_many(urls, concurrency))
@@ -0,0 +1,1002 @@
+"""
+Benchmarks for the browser's network, lexing and layout paths.
+
+Each benchmark starts whatever local server it needs and prints its
+results as JSON, e.g.:
+
+    python bench.py async --pages 20 --delay 0.2
+"""
+import argparse
+import base64
+import contextlib
+import functools
+import gzip
+import json
+import os
+import random
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Benchmarks must never be served from a cache left by an earlier run
+os.environ.setdefault("CREATOR_CACHE_DIR", tempfile.mkdtemp(prefix="creator-bench-"))
+
+import request
+from request import make_http_request, parse_url
+from resolver import DNSCache
+from tls import TLSSessionCache
+from async_request import fetch_many_sync
+from body_reader import BodyReader
+from utils import lex, LexedText
+from url import URL
+from layout import layout, DocumentLayout, VSTEP
+import file_handler
+from file_handler import MappedFile, handle_file_url
+from data_handler import data_cache
+from viewport import CanvasViewport
+from emoji_store import EmojiStore, Emoji, presented_as_emoji, EMOJI_DIR
+from headless import benchmark, run_pipeline
+from prefetch import Prefetcher, extract_links
+from replay import Recorder, ReplayServer
+import parallel
+
+
+class BenchHandler(BaseHTTPRequestHandler):
+    """
+    Serve synthetic pages for the benchmarks.
+
+    /delay/<seconds>/<name> answers after sleeping for <seconds>.
+    /chunked/<megabytes>/<chunk kilobytes> sends a chunked body.
+    /page/<name> sends one of the SUITE_PAGES; /page/<name>/chunked-gzip
+    sends it gzipped with chunked transfer encoding.
+    /links/<count>/<seconds>/<tag> links to <count> /delay/<seconds>
+    pages named <tag><i>, every fourth of them a /nostore/<seconds> page.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts[0] == "delay":
+            time.sleep(float(parts[1]))
+            self.send_body(f"<html><body>{self.path}</body></html>".encode("utf8"))
+        elif parts[0] == "page" and parts[1] in SUITE_PAGES:
+            body = suite_page(parts[1])
+            if parts[2:] == ["chunked-gzip"]:
+                self.send_chunked(gzip.compress(body), 16 * 1024, {"Content-Encoding": "gzip"})
+            else:
+                self.send_body(body)
+        elif parts[0] == "nostore":
+            time.sleep(float(parts[1]))
+            self.send_body(f"<html><body>{self.path}</body></html>".encode("utf8"),
+                           {"Cache-Control": "no-store"})
+        elif parts[0] == "links":
+            links = "".join(
+                f'<li><a href="/{"nostore" if i % 4 == 3 else "delay"}/{parts[2]}/{parts[3]}{i}">page {i}</a></li>\n'
+                for i in range(int(parts[1])))
+            self.send_body(f"<html><body><ul>{links}</ul></body></html>".encode("utf8"))
+        elif parts[0] == "chunked":
+            body = synthetic_bytes(int(float(parts[1]) * 1024 * 1024))
+            self.send_chunked(body, int(float(parts[2]) * 1024))
+        else:
+            self.send_error(404)
+
+    def send_chunked(self, body, chunk_size, headers=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        view = memoryview(body)
+        for start in range(0, len(body), chunk_size):
+            piece = view[start:start + chunk_size]
+            self.wfile.write(b"%x\r\n" % len(piece))
+            self.wfile.write(piece)
+            self.wfile.write(b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def send_body(self, body, headers=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if "Transfer-Encoding" not in (headers or {}):
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class BenchServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops SYNs under concurrent connects
+    request_queue_size = 128
+
+
+def serve(handler=BenchHandler):
+    """
+    Start a threaded HTTP server on a free local port.
+
+    Args:
+        handler (type): The request handler class.
+
+    Returns:
+        ThreadingHTTPServer: The running server; call shutdown() when done.
+    """
+    server = BenchServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_test_ca(directory):
+    """
+    Create a self-signed CA and a localhost certificate it signed, with
+    the openssl command line tool.
+
+    Returns:
+        tuple: The paths of the CA certificate, server certificate and key.
+    """
+    ca_key, ca_cert = os.path.join(directory, "ca.key"), os.path.join(directory, "ca.pem")
+    key, csr, cert = (os.path.join(directory, name) for name in ("server.key", "server.csr", "server.pem"))
+    extensions = os.path.join(directory, "server.ext")
+    with open(extensions, "w") as f:
+        f.write("subjectAltName=DNS:localhost,IP:127.0.0.1\n"
+                "basicConstraints=CA:FALSE\n"
+                "extendedKeyUsage=serverAuth\n")
+    commands = [
+        ["req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", ca_key, "-out", ca_cert,
+         "-days", "2", "-subj", "/CN=Creator Test CA"],
+        ["req", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", csr,
+         "-subj", "/CN=localhost"],
+        ["x509", "-req", "-in", csr, "-CA", ca_cert, "-CAkey", ca_key, "-CAcreateserial",
+         "-out", cert, "-days", "2", "-extfile", extensions],
+    ]
+    for command in commands:
+        subprocess.run(["openssl"] + command, check=True, capture_output=True)
+    return ca_cert, cert, key
+
+
+def serve_tls(certfile, keyfile, handler=BenchHandler):
+    """Start a threaded HTTPS server on a free local port."""
+    server = BenchServer(("127.0.0.1", 0), handler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def tls_fetch(port, wrap):
+    """
+    Fetch one page over a new TLS connection.
+
+    Args:
+        port (int): The local HTTPS server's port.
+        wrap (callable): wrap(sock) returning the socket after the handshake.
+
+    Returns:
+        tuple: The TLS socket, already closed, and the handshake time.
+    """
+    sock = socket.create_connection(("127.0.0.1", port))
+    start = time.perf_counter()
+    s = wrap(sock)
+    seconds = time.perf_counter() - start
+    s.sendall(b"GET /delay/0/tls HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+    while s.recv(65536):
+        pass
+    return s, seconds
+
+
+def synthetic_bytes(size):
+    """Return `size` bytes of repetitive HTML-ish text."""
+    unit = b"<p>The quick brown fox jumps over the lazy dog &amp; friends.</p>\n"
+    return (unit * (size // len(unit) + 1))[:size]
+
+
+def open_raw_response(port, path):
+    """
+    Send a GET on a new socket and read up to the end of the headers.
+
+    Returns:
+        tuple: (socket, buffered reader positioned at the body)
+    """
+    s = socket.create_connection(("127.0.0.1", port))
+    s.sendall(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n".encode("utf8"))
+    reader = s.makefile("rb")
+    while reader.readline() not in (b"\r\n", b""):
+        pass
+    return s, reader
+
+
+def legacy_read_chunked(response):
+    """The chunked body loop make_http_request used before BodyReader."""
+    content = b""
+    while True:
+        chunk_size_line = response.readline().strip()
+        if not chunk_size_line:
+            break
+        chunk_size = int(chunk_size_line, 16)
+        if chunk_size == 0:
+            break
+        content += response.read(chunk_size)
+        response.readline()
+    return content
+
+
+def synthetic_html(size):
+    """
+    Return roughly `size` characters of HTML with tags, entities,
+    comments, scripts and styles mixed into paragraphs of text.
+    """
+    unit = (
+        '<div class="post"><h2 id="t">Title &amp; subtitle</h2>\n'
+        "<p>The quick brown fox jumps over the lazy dog. &lt;tags&gt; &eacute;t&eacute; "
+        "&#169; &#x263A; caf&eacute; na&iuml;ve r&eacute;sum&eacute;.</p>\n"
+        "<!-- a comment with <p>markup</p> inside -->\n"
+        "<script>var x = 1 < 2 && 3 > 2;</script><style>p { color: red; }</style>\n"
+        "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod "
+        "tempor incididunt ut labore et dolore magna aliqua.</p></div>\n"
+    )
+    return (unit * (size // len(unit) + 1))[:size]
+
+
+def legacy_lex(body):
+    """The per-character lexer utils.lex used before the regex scanner."""
+    in_tag = False
+    text = ""
+    entity_buffer = ""
+    for c in body:
+        if c == "<":
+            in_tag = True
+        elif c == ">":
+            in_tag = False
+        elif not in_tag:
+            if c == "&":
+                entity_buffer = "&"
+            elif entity_buffer:
+                entity_buffer += c
+                if entity_buffer == "&lt;":
+                    text += "<"
+                    entity_buffer = ""
+                elif entity_buffer == "&gt;":
+                    text += ">"
+                    entity_buffer = ""
+                elif entity_buffer[-1] == ";":
+                    text += entity_buffer
+                    entity_buffer = ""
+            else:
+                text += str(c)
+        else:
+            entity_buffer = ""
+    return text
+
+
+def timed(function, *args, **kwargs):
+    """Call a function and return (result, seconds elapsed)."""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_async(args):
+    """Compare sequential make_http_request with fetch_many."""
+    server = serve()
+    port = server.server_address[1]
+    try:
+        delays = [args.delay * (i % 5 + 1) / 5 for i in range(args.pages)]
+        paths = [f"/delay/{delay}/{i}" for i, delay in enumerate(delays)]
+        _, sequential = timed(lambda: [make_http_request("127.0.0.1", port, path, "http")
+                                       for path in paths])
+        urls = [f"http://127.0.0.1:{port}{path}" for path in paths]
+        results, concurrent = timed(fetch_many_sync, urls, args.concurrency)
+        errors = [result for result in results if isinstance(result, Exception)]
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {
+        "pages": args.pages,
+        "concurrency": args.concurrency,
+        "slowest_page": max(delays),
+        "sequential": sequential,
+        "concurrent": concurrent,
+        "errors": len(errors),
+    }
+
+
+def bench_chunked(args):
+    """Compare BodyReader with the old concatenating chunked reader."""
+    server = serve()
+    port = server.server_address[1]
+    path = f"/chunked/{args.megabytes}/{args.chunk_kb}"
+    readers = {
+        "legacy": legacy_read_chunked,
+        "body_reader": lambda reader: BodyReader(reader).read_chunked(),
+    }
+    results = {}
+    try:
+        for name, read in readers.items():
+            times = []
+            for _ in range(args.repeat):
+                s, reader = open_raw_response(port, path)
+                with s, reader:
+                    body, seconds = timed(read, reader)
+                times.append(seconds)
+            results[name] = {"best": min(times), "size": len(body)}
+    finally:
+        server.shutdown()
+        server.server_close()
+    results["megabytes"] = args.megabytes
+    results["chunk_kb"] = args.chunk_kb
+    results["speedup"] = results["legacy"]["best"] / results["body_reader"]["best"]
+    return results
+
+
+def bench_lex(args):
+    """Compare utils.lex with the old per-character lexer."""
+    results = []
+    for megabytes in args.megabytes:
+        body = synthetic_html(int(megabytes * 1024 * 1024))
+        row = {"megabytes": megabytes}
+        lexers = {"lex": lex}
+        if not args.skip_legacy:
+            lexers["legacy"] = legacy_lex
+        for name, function in lexers.items():
+            _, seconds = timed(function, body)
+            row[name] = {"seconds": seconds, "mb_per_s": megabytes / seconds}
+        if "legacy" in row:
+            row["speedup"] = row["legacy"]["seconds"] / row["lex"]["seconds"]
+        results.append(row)
+    return results
+
+
+def traced(function, *args):
+    """Call a function and return (result, peak bytes allocated meanwhile)."""
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_display_list(args):
+    """Measure the memory of a laid-out large text file opened via file://."""
+    text_unit = "The quick brown fox jumps over the lazy dog. " * 20 + "\n"
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", encoding="utf8", delete=False) as f:
+        f.write(text_unit * (int(args.megabytes * 1024 * 1024) // len(text_unit)))
+    try:
+        body = URL("file://" + os.path.relpath(f.name)).request()
+    finally:
+        os.remove(f.name)
+    text = lex(body)
+    display_list, display_list_peak = traced(layout, text, args.width, args.height)
+    tuples, tuples_peak = traced(list, display_list)
+    return {
+        "megabytes": args.megabytes,
+        "entries": len(display_list),
+        "display_list_bytes": display_list_peak,
+        "tuple_list_bytes": tuples_peak,
+        "saving": 1 - display_list_peak / tuples_peak,
+    }
+
+
+def legacy_first_screen(path, width, height):
+    """The old file:// load: read and lex the whole file, then lay out a screen."""
+    with open(path, encoding="utf8") as f:
+        body = f.read()
+    return len(DocumentLayout(lex(body), width).ensure(height))
+
+
+def mapped_first_screen(path, width, height):
+    """Map the file and decode and lex only the windows the first screen needs."""
+    mapped = MappedFile(path)
+    try:
+        return len(DocumentLayout(LexedText(mapped), width).ensure(height))
+    finally:
+        mapped.close()
+
+
+def bench_file(args):
+    """Compare reading whole files with memory-mapped, windowed and cached loading."""
+    unit = synthetic_html(64 * 1024)
+    with tempfile.NamedTemporaryFile("w", suffix=".html", encoding="utf8", delete=False) as f:
+        for _ in range(int(args.megabytes * 16)):
+            f.write(unit)
+    path = os.path.relpath(f.name)
+    results = {"megabytes": args.megabytes}
+    try:
+        for name, first_screen in (("read_whole", legacy_first_screen),
+                                   ("mapped", mapped_first_screen)):
+            file_handler.file_cache.clear()
+            _, seconds = timed(first_screen, path, args.width, args.height)
+            entries, peak = traced(first_screen, path, args.width, args.height)
+            results[name] = {"first_screen_seconds": seconds, "first_screen_entries": entries,
+                             "peak_bytes": peak}
+        results["speedup"] = (results["read_whole"]["first_screen_seconds"]
+                              / results["mapped"]["first_screen_seconds"])
+        # Reopening: the whole text is cached until the file changes
+        file_handler.file_cache.clear()
+        _, first = timed(handle_file_url, path)
+        _, again = timed(handle_file_url, path)
+        results["reopen"] = {"first_seconds": first, "cached_seconds": again}
+    finally:
+        os.remove(f.name)
+        file_handler.file_cache.clear()
+    return results
+
+
+def whole_data_url(url):
+    """Decode a base64 data: URL in one go, for comparison."""
+    _, data = url.split(",", 1)
+    return base64.b64decode(data).decode("utf8")
+
+
+def bench_data(args):
+    """Decode multi-megabyte base64 data: URLs, whole vs in chunks, then from the cache."""
+    results = []
+    for megabytes in args.megabytes:
+        payload = synthetic_html(int(megabytes * 1024 * 1024)).encode("utf8")
+        url = "data:text/html;base64," + base64.b64encode(payload).decode("ascii")
+        row = {"megabytes": megabytes, "url_chars": len(url)}
+        _, seconds = timed(whole_data_url, url)
+        _, peak = traced(whole_data_url, url)
+        row["whole"] = {"seconds": seconds, "peak_bytes": peak}
+        data_cache.clear()
+        _, seconds = timed(URL(url).request)
+        data_cache.clear()
+        _, peak = traced(URL(url).request)
+        row["chunked"] = {"seconds": seconds, "peak_bytes": peak}
+        _, row["cached_seconds"] = timed(URL(url).request)
+        results.append(row)
+    data_cache.clear()
+    return results
+
+
+def bench_prefetch(args):
+    """Time following the links of a page with and without prefetching them."""
+    server = serve()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    results = {"links": args.links, "delay": args.delay}
+    try:
+        for mode in ("cold", "prefetched"):
+            # A fresh set of URLs for each mode, so neither sees the other's cache
+            index = f"{base}/links/{args.links}/{args.delay}/{mode}"
+            page = make_http_request(*parse_url(index))
+            links = extract_links(page, index)[:args.follow]
+            prefetcher = Prefetcher(args.prefetch, args.concurrency)
+            if mode == "prefetched":
+                prefetcher.start(index, page)
+                # The user reads the page for a moment before clicking
+                prefetcher.wait()
+            seconds = []
+            for link in links:
+                prefetcher.record_navigation(link)
+                _, elapsed = timed(make_http_request, *parse_url(link))
+                seconds.append(elapsed)
+            results[mode] = {"mean_navigation_ms": sum(seconds) / len(seconds) * 1000,
+                             "prefetch": prefetcher.stats()}
+    finally:
+        server.shutdown()
+        server.server_close()
+    results["speedup"] = (results["cold"]["mean_navigation_ms"]
+                          / results["prefetched"]["mean_navigation_ms"])
+    return results
+
+
+class CommandCounter:
+    """
+    Stand in for a tkinter Canvas on machines without a display, counting
+    the Tk commands a draw would issue instead of running them.
+    """
+    def __init__(self):
+        self.commands = 0
+        self.next_item = 0
+
+    def _command(self, *args, **kwargs):
+        self.commands += 1
+
+    def _create(self, *args, **kwargs):
+        self.commands += 1
+        self.next_item += 1
+        return self.next_item
+
+    delete = move = coords = itemconfigure = _command
+    create_text = create_image = _create
+
+
+def legacy_draw(canvas, display_list, scroll, height):
+    """The old Browser.draw: recreate every visible item from a full walk."""
+    canvas.delete("all")
+    for x, y, c in display_list:
+        if y > scroll + height: continue
+        if y + VSTEP < scroll: continue
+        if isinstance(c, str):
+            canvas.create_text(x, y - scroll, text=c)
+        else:
+            canvas.create_image(x, y - scroll, image=c)
+
+
+def bench_scroll(args):
+    """Measure frame times while scrolling through a large laid-out page."""
+    text_unit = "The quick brown fox jumps over the lazy dog. " * 20 + "\n"
+    text = text_unit * (int(args.megabytes * 1024 * 1024) // len(text_unit))
+    display_list = layout(text, args.width, args.height)
+    window = None
+    if args.count_only:
+        make_canvas = CommandCounter
+    else:
+        import tkinter
+        window = tkinter.Tk()
+        make_canvas = lambda: tkinter.Canvas(window, width=args.width, height=args.height)
+
+    def scroll_through(draw):
+        canvas = make_canvas()
+        if window is not None:
+            canvas.pack()
+        frames = []
+        for frame in range(args.frames):
+            scroll = frame * args.step
+            _, seconds = timed(draw, canvas, scroll)
+            if window is not None:
+                _, update = timed(window.update)
+                seconds += update
+            frames.append(seconds)
+        if window is not None:
+            canvas.destroy()
+        frames.sort()
+        result = {
+            "mean_ms": 1000 * sum(frames) / len(frames),
+            "p95_ms": 1000 * frames[int(len(frames) * 0.95)],
+        }
+        if args.count_only:
+            result["commands_per_frame"] = canvas.commands / len(frames)
+        return result
+
+    viewports = {}
+
+    def viewport_draw(canvas, scroll):
+        viewport = viewports.setdefault(id(canvas), CanvasViewport(canvas))
+        viewport.draw(display_list, scroll, args.height)
+
+    try:
+        results = {
+            "megabytes": args.megabytes,
+            "entries": len(display_list),
+            "frames": args.frames,
+            "viewport": scroll_through(viewport_draw),
+            "legacy": scroll_through(lambda canvas, scroll: legacy_draw(
+                canvas, display_list, scroll, args.height)),
+        }
+    finally:
+        if window is not None:
+            window.destroy()
+    results["speedup"] = results["legacy"]["mean_ms"] / results["viewport"]["mean_ms"]
+    return results
+
+
+def emoji_dense_text(store, size, seed=0):
+    """Build text in which every other word is an emoji sequence."""
+    rng = random.Random(seed)
+    sequences = sorted(filter(presented_as_emoji, store.manifest))
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(sequences) if len(words) % 2 else rng.choice(["lorem", "ipsum", "dolor"])
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)
+
+
+def probe_scan(text, sequences, longest):
+    """The dict-probing alternative to the trie: try every length at each index."""
+    matches = []
+    i = 0
+    while i < len(text):
+        for end in range(min(len(text), i + longest), i, -1):
+            if text[i:end] in sequences:
+                matches.append(sequences[text[i:end]])
+                i = end
+                break
+        else:
+            i += 1
+    return matches
+
+
+def trie_scan(text, trie):
+    """Find the emoji in a text with the same forward pass layout uses."""
+    matches = []
+    i = 0
+    starts = trie.root
+    while i < len(text):
+        match = trie.match(text, i) if text[i] in starts else None
+        if match is None:
+            i += 1
+        else:
+            i, glyph = match
+            matches.append(glyph)
+    return matches
+
+
+def bench_emoji(args):
+    """Time emoji matching and layout on emoji-dense text."""
+    store, index_seconds = timed(EmojiStore, args.directory)
+    text = emoji_dense_text(store, int(args.kilobytes * 1024))
+    sequences = {}
+    for sequence, filename in store.manifest.items():
+        if presented_as_emoji(sequence):
+            sequences[sequence] = Emoji(os.path.splitext(filename)[0])
+    longest = max(map(len, sequences))
+    probed, probe_seconds = timed(probe_scan, text, sequences, longest)
+    matched, trie_seconds = timed(trie_scan, text, store.mapping.trie)
+    display_list, layout_seconds = timed(layout, text, args.width, args.height, store.mapping)
+    return {
+        "characters": len(text),
+        "emoji": len(matched),
+        "same_matches": probed == matched,
+        "index_seconds": index_seconds,
+        "probe_seconds": probe_seconds,
+        "trie_seconds": trie_seconds,
+        "speedup": probe_seconds / trie_seconds,
+        "layout_seconds": layout_seconds,
+        "entries": len(display_list),
+    }
+
+
+# The synthetic pages of the suite: name -> (kind, size in bytes)
+SUITE_PAGES = {
+    "small": ("html", 16 * 1024),
+    "large": ("html", 2 * 1024 * 1024),
+    "emoji": ("emoji", 512 * 1024),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def suite_page(name):
+    """Return the body of a suite page, building it on first use."""
+    kind, size = SUITE_PAGES[name]
+    if kind == "emoji":
+        text = emoji_dense_text(EmojiStore(EMOJI_DIR), size)
+        return f"<html><body><p>{text}</p></body></html>".encode("utf8")
+    return synthetic_html(size).encode("utf8")
+
+
+def bench_suite(args):
+    """Run the headless pipeline over the synthetic pages, served locally."""
+    emoji_mapping = EmojiStore(EMOJI_DIR).mapping
+    server = serve()
+    port = server.server_address[1]
+    paths = [f"/page/{name}" for name in SUITE_PAGES] + ["/page/large/chunked-gzip"]
+    results = []
+    try:
+        for path in paths:
+            suite_page(path.split("/")[2])
+            result = benchmark(f"http://127.0.0.1:{port}{path}", args.width, args.height,
+                               emoji_mapping, args.repeat, trace_memory=not args.no_memory)
+            result["page"] = path
+            results.append(result)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def bench_dns(args):
+    """Compare uncached getaddrinfo with DNSCache for repeated connections."""
+    hosts = args.hosts
+    start = time.perf_counter()
+    for _ in range(args.lookups):
+        for host in hosts:
+            socket.getaddrinfo(host, 80, type=socket.SOCK_STREAM)
+    uncached = time.perf_counter() - start
+    resolver = DNSCache()
+    start = time.perf_counter()
+    for _ in range(args.lookups):
+        for host in hosts:
+            resolver.resolve(host, 80)
+    cached = time.perf_counter() - start
+    return {
+        "hosts": hosts,
+        "lookups": args.lookups * len(hosts),
+        "uncached_seconds": uncached,
+        "cached_seconds": cached,
+        "speedup": uncached / cached,
+        "cache": resolver.stats(),
+    }
+
+
+def bench_tls(args):
+    """Compare a context and full handshake per connection with a shared context and resumption."""
+    with tempfile.TemporaryDirectory(prefix="creator-tls-") as directory:
+        ca_cert, cert, key = make_test_ca(directory)
+        server = serve_tls(cert, key)
+        port = server.server_address[1]
+        try:
+            # The old behaviour: a new default context for every socket
+            before = {"contexts_created": 0, "handshakes": 0, "resumed": 0, "seconds": 0.0,
+                      "handshake_seconds": 0.0}
+            for _ in range(args.connections):
+                start = time.perf_counter()
+                context = ssl.create_default_context()
+                context.load_verify_locations(ca_cert)
+                before["contexts_created"] += 1
+                s, handshake = tls_fetch(port, lambda sock: context.wrap_socket(sock, server_hostname="localhost"))
+                before["seconds"] += time.perf_counter() - start
+                before["handshake_seconds"] += handshake
+                before["handshakes"] += 1
+                before["resumed"] += s.session_reused
+
+            sessions = TLSSessionCache(cafile=ca_cert)
+            after = {"seconds": 0.0, "handshake_seconds": 0.0}
+            for _ in range(args.connections):
+                start = time.perf_counter()
+                s, handshake = tls_fetch(port, lambda sock: sessions.wrap(sock, "localhost", port))
+                sessions.save("localhost", port, s)
+                after["seconds"] += time.perf_counter() - start
+                after["handshake_seconds"] += handshake
+            after.update(sessions.stats())
+        finally:
+            server.shutdown()
+            server.server_close()
+    for result in (before, after):
+        result["ms_per_connection"] = result["seconds"] / args.connections * 1000
+        result["handshake_ms"] = result["handshake_seconds"] / args.connections * 1000
+    return {
+        "connections": args.connections,
+        "per_connection_context": before,
+        "shared_context": after,
+        "speedup": before["seconds"] / after["seconds"],
+    }
+
+
+@contextlib.contextmanager
+def uncached():
+    """Bypass the response caches so that every fetch uses the network."""
+    saved = request.disk_cache
+    request.disk_cache = None
+    request.cache.clear()
+    try:
+        yield
+    finally:
+        request.disk_cache = saved
+        request.cache.clear()
+
+
+def read_url_file(path):
+    """Read URLs one per line, or as JSON lines with a "url" field."""
+    urls = []
+    with open(path, encoding="utf8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            urls.append(json.loads(line)["url"] if line.startswith("{") else line)
+    return urls
+
+
+def bench_record(args):
+    """Record pages and their raw responses to an archive for `replay`."""
+    urls = list(args.urls)
+    if args.url_file:
+        urls += read_url_file(args.url_file)
+    server = None
+    if not urls:
+        # Without URLs, record the suite pages from the local server
+        server = serve()
+        port = server.server_address[1]
+        urls = [f"http://127.0.0.1:{port}/page/{name}" for name in SUITE_PAGES]
+        urls.append(f"http://127.0.0.1:{port}/page/large/chunked-gzip")
+    recorder = Recorder()
+    failed = {}
+    try:
+        with uncached(), recorder:
+            for url in urls:
+                try:
+                    make_http_request(*parse_url(url))
+                except Exception as e:
+                    failed[url] = repr(e)
+                    continue
+                recorder.pages.append(url)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    recorder.save(args.archive)
+    exchanges = recorder.exchanges
+    return {
+        "archive": args.archive,
+        "pages": recorder.pages,
+        "failed": failed,
+        "exchanges": len(exchanges),
+        "response_bytes": sum(len(exchange.response) for exchange in exchanges),
+        "archive_bytes": os.path.getsize(args.archive),
+    }
+
+
+def bench_replay(args):
+    """Run the headless pipeline over recorded pages served from an archive."""
+    bandwidth = args.bandwidth_kbps * 1000 / 8 if args.bandwidth_kbps else None
+    replay = ReplayServer.from_archive(args.archive, latency=args.latency_ms / 1000,
+                                       bandwidth=bandwidth)
+    results = []
+    with replay, uncached():
+        for page in replay.pages:
+            runs = []
+            for _ in range(args.repeat):
+                # Each run opens its connections and fetches afresh
+                request.cache.clear()
+                request.open_connections.close_all()
+                sent = replay.stats()["bytes_sent"]
+                run = run_pipeline(URL(page), args.width, args.height, trace_memory=False)
+                run["wire_bytes"] = replay.stats()["bytes_sent"] - sent
+                runs.append(run)
+            result = min(runs, key=lambda run: run["total_seconds"])
+            fetch_seconds = result["stages"]["fetch"]["seconds"]
+            result["fetch_bytes_per_second"] = result["wire_bytes"] / fetch_seconds
+            result["repeat"] = args.repeat
+            results.append(result)
+        stats = replay.stats()
+    return {
+        "archive": args.archive,
+        "latency_ms": args.latency_ms,
+        "bandwidth_kbps": args.bandwidth_kbps,
+        "pages": results,
+        "replay": stats,
+    }
+
+
+def bench_parallel(args):
+    """Time lex and full layout of a large page serially and across 1..N processes."""
+    body = synthetic_html(int(args.megabytes * 1024 * 1024))
+    serial_text, lex_seconds = timed(lex, body)
+    expected, layout_seconds = timed(layout, serial_text, args.width, args.height)
+    results = {
+        "megabytes": args.megabytes,
+        "cpu_count": os.cpu_count(),
+        "serial": {"lex_seconds": lex_seconds, "layout_seconds": layout_seconds},
+        "parallel": [],
+    }
+    for workers in args.workers:
+        # Start the workers first, so the timings leave out process startup
+        list(parallel.get_pool(workers).map(abs, range(workers)))
+        text, lex_seconds = timed(parallel.lex_parallel, body, workers)
+        document = DocumentLayout(text, args.width)
+        display_list, layout_seconds = timed(parallel.finish_parallel, document, workers)
+        results["parallel"].append({
+            "workers": workers,
+            "lex_seconds": lex_seconds,
+            "layout_seconds": layout_seconds,
+            "lex_speedup": results["serial"]["lex_seconds"] / lex_seconds,
+            "layout_speedup": results["serial"]["layout_seconds"] / layout_seconds,
+            "identical": text == serial_text and list(display_list) == list(expected),
+        })
+    parallel.shutdown_pool()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    benchmarks = parser.add_subparsers(dest="benchmark", required=True)
+
+    async_parser = benchmarks.add_parser("async", help=bench_async.__doc__)
+    async_parser.add_argument("--pages", type=int, default=20)
+    async_parser.add_argument("--delay", type=float, default=0.2,
+                              help="response delay of the slowest page, in seconds")
+    async_parser.add_argument("--concurrency", type=int, default=20)
+    async_parser.set_defaults(run=bench_async)
+
+    chunked_parser = benchmarks.add_parser("chunked", help=bench_chunked.__doc__)
+    chunked_parser.add_argument("--megabytes", type=float, default=8)
+    chunked_parser.add_argument("--chunk-kb", type=float, default=4)
+    chunked_parser.add_argument("--repeat", type=int, default=5)
+    chunked_parser.set_defaults(run=bench_chunked)
+
+    lex_parser = benchmarks.add_parser("lex", help=bench_lex.__doc__)
+    lex_parser.add_argument("--megabytes", type=float, nargs="+", default=[1, 10, 50])
+    lex_parser.add_argument("--skip-legacy", action="store_true",
+                            help="only time the current lexer")
+    lex_parser.set_defaults(run=bench_lex)
+
+    display_list_parser = benchmarks.add_parser("display-list", help=bench_display_list.__doc__)
+    display_list_parser.add_argument("--megabytes", type=float, default=5)
+    display_list_parser.add_argument("--width", type=int, default=800)
+    display_list_parser.add_argument("--height", type=int, default=600)
+    display_list_parser.set_defaults(run=bench_display_list)
+
+    scroll_parser = benchmarks.add_parser("scroll", help=bench_scroll.__doc__)
+    scroll_parser.add_argument("--megabytes", type=float, default=2)
+    scroll_parser.add_argument("--frames", type=int, default=200)
+    scroll_parser.add_argument("--step", type=int, default=100,
+                               help="pixels scrolled per frame")
+    scroll_parser.add_argument("--width", type=int, default=780)
+    scroll_parser.add_argument("--height", type=int, default=500)
+    scroll_parser.add_argument("--count-only", action="store_true",
+                               help="count Tk commands instead of drawing (no display needed)")
+    scroll_parser.set_defaults(run=bench_scroll)
+
+    emoji_parser = benchmarks.add_parser("emoji", help=bench_emoji.__doc__)
+    emoji_parser.add_argument("--kilobytes", type=float, default=512)
+    emoji_parser.add_argument("--directory", default="Assets/emojis")
+    emoji_parser.add_argument("--width", type=int, default=780)
+    emoji_parser.add_argument("--height", type=int, default=500)
+    emoji_parser.set_defaults(run=bench_emoji)
+
+    suite_parser = benchmarks.add_parser("suite", help=bench_suite.__doc__)
+    suite_parser.add_argument("--width", type=int, default=780)
+    suite_parser.add_argument("--height", type=int, default=500)
+    suite_parser.add_argument("--repeat", type=int, default=3)
+    suite_parser.add_argument("--no-memory", action="store_true",
+                              help="skip the extra run that measures memory")
+    suite_parser.set_defaults(run=bench_suite)
+
+    dns_parser = benchmarks.add_parser("dns", help=bench_dns.__doc__)
+    dns_parser.add_argument("--hosts", nargs="+", default=["localhost"])
+    dns_parser.add_argument("--lookups", type=int, default=1000,
+                            help="lookups of each host")
+    dns_parser.set_defaults(run=bench_dns)
+
+    tls_parser = benchmarks.add_parser("tls", help=bench_tls.__doc__)
+    tls_parser.add_argument("--connections", type=int, default=50)
+    tls_parser.set_defaults(run=bench_tls)
+
+    file_parser = benchmarks.add_parser("file", help=bench_file.__doc__)
+    file_parser.add_argument("--megabytes", type=float, default=48,
+                             help="file size; stays under FILE_CACHE_CHARS to time reopening")
+    file_parser.add_argument("--width", type=int, default=780)
+    file_parser.add_argument("--height", type=int, default=500)
+    file_parser.set_defaults(run=bench_file)
+
+    data_parser = benchmarks.add_parser("data", help=bench_data.__doc__)
+    data_parser.add_argument("--megabytes", type=float, nargs="+", default=[1, 4, 16],
+                             help="decoded payload sizes")
+    data_parser.set_defaults(run=bench_data)
+
+    prefetch_parser = benchmarks.add_parser("prefetch", help=bench_prefetch.__doc__)
+    prefetch_parser.add_argument("--links", type=int, default=20, help="links on the page")
+    prefetch_parser.add_argument("--prefetch", type=int, default=8, help="links prefetched")
+    prefetch_parser.add_argument("--follow", type=int, default=8, help="links then followed")
+    prefetch_parser.add_argument("--concurrency", type=int, default=2)
+    prefetch_parser.add_argument("--delay", type=float, default=0.05,
+                                 help="server response time, in seconds")
+    prefetch_parser.set_defaults(run=bench_prefetch)
+
+    record_parser = benchmarks.add_parser("record", help=bench_record.__doc__)
+    record_parser.add_argument("archive")
+    record_parser.add_argument("urls", nargs="*",
+                               help="pages to record; the suite pages, served locally, if none")
+    record_parser.add_argument("--url-file",
+                               help="more URLs, one per line or JSON lines with a url field")
+    record_parser.set_defaults(run=bench_record)
+
+    replay_parser = benchmarks.add_parser("replay", help=bench_replay.__doc__)
+    replay_parser.add_argument("archive")
+    replay_parser.add_argument("--latency-ms", type=float, default=0,
+                               help="simulated round trip time, per connection and response")
+    replay_parser.add_argument("--bandwidth-kbps", type=float, default=0,
+                               help="simulated bandwidth in kilobits per second; 0 for unlimited")
+    replay_parser.add_argument("--width", type=int, default=780)
+    replay_parser.add_argument("--height", type=int, default=500)
+    replay_parser.add_argument("--repeat", type=int, default=3)
+    replay_parser.set_defaults(run=bench_replay)
+
+    parallel_parser = benchmarks.add_parser("parallel", help=bench_parallel.__doc__)
+    parallel_parser.add_argument("--megabytes", type=float, default=20)
+    parallel_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parallel_parser.add_argument("--width", type=int, default=780)
+    parallel_parser.add_argument("--height", type=int, default=500)
+    parallel_parser.set_defaults(run=bench_parallel)
+
+    args = parser.parse_args(argv)
+    json.dump(args.run(args), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+HEX_DIGITS = b"0123456789abcdefABCDEF"
+
+
+def parse_chunk_size(line):
+    """
+    Parse a chunk-size line of a chunked body, ignoring chunk extensions.
+
+    Args:
+        line (bytes): The line, e.g. b"1a3f;name=value\\r\\n".
+
+    Returns:
+        int: The size of the chunk that follows.
+
+    Raises:
+        ValueError: If the line is not a valid chunk-size line.
+    """
+    size = line.split(b";", 1)[0].strip()
+    if not size or size.strip(HEX_DIGITS):
+        raise ValueError(f"Invalid chunk size line: {line[:40]!r}")
+    return int(size, 16)
+
+
+def parse_trailer_line(line):
+    """Split a trailer field into a lowercase name and a stripped value."""
+    name, value = line.split(b":", 1)
+    return name.strip().lower().decode("latin-1"), value.strip().decode("latin-1")
+
+
+def read_trailers(reader):
+    """
+    Read the trailer section that ends a chunked body.
+
+    Args:
+        reader: The buffered reader positioned after the last chunk.
+
+    Returns:
+        dict: Lowercase trailer names mapped to their values.
+    """
+    trailers = {}
+    while True:
+        line = reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            return trailers
+        name, value = parse_trailer_line(line)
+        trailers[name] = value
+
+
+class BodyReader:
+    """
+    Read HTTP/1.1 message bodies with as few copies as possible.
+
+    Chunked bodies are read with readinto straight into one bytearray that
+    grows geometrically, instead of allocating a bytes object per chunk and
+    concatenating them. The finished body is that same bytearray, trimmed
+    in place.
+    """
+    def __init__(self, reader, size_hint=64 * 1024):
+        """
+        Initialize a reader.
+
+        Args:
+            reader: A buffered binary reader (socket.makefile("rb")).
+            size_hint (int): The initial buffer size for chunked bodies.
+        """
+        self.reader = reader
+        self.size_hint = size_hint
+        self.trailers = {}
+
+    def read_content_length(self, length):
+        """
+        Read a body of known length.
+
+        A buffered reader fills a single bytes object of the requested size,
+        so this is already one allocation and one copy out of the socket.
+
+        Args:
+            length (int): The Content-Length of the body.
+
+        Returns:
+            bytes: The body.
+        """
+        content = self.reader.read(length)
+        if len(content) < length:
+            raise ConnectionResetError("Connection closed mid-body")
+        return content
+
+    def read_chunked(self):
+        """
+        Read a chunked body, including its trailers.
+
+        Returns:
+            bytearray: The de-chunked body; trailers are left in
+                       self.trailers.
+        """
+        buffer = bytearray(max(self.size_hint, 1))
+        length = 0
+        while True:
+            size = parse_chunk_size(self.reader.readline())
+            if size == 0:
+                self.trailers = read_trailers(self.reader)
+                break
+            end = length + size
+            if end > len(buffer):
+                # Repeat the buffer in place, at least doubling it; the
+                # repeated bytes are overwritten before they are used
+                buffer *= max(2, -(-end // len(buffer)))
+            with memoryview(buffer) as view:
+                self.readinto(view[length:end])
+            length = end
+            if self.reader.readline() not in (b"\r\n", b"\n"):
+                raise ValueError("Missing CRLF after chunk data")
+        del buffer[length:]
+        return buffer
+
+    def read_until_eof(self):
+        """Read a body delimited by the server closing the connection."""
+        return self.reader.read()
+
+    def readinto(self, view):
+        """Fill a memoryview completely from the reader."""
+        filled = 0
+        total = len(view)
+        while filled < total:
+            with view[filled:] as remaining:
+                count = self.reader.readinto(remaining)
+            if not count:
+                raise ConnectionResetError("Connection closed mid-chunk")
+            filled += count
@@ -0,0 +1,231 @@
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+
+def parse_http_date(value):
+    """
+    Parse an HTTP date header value into a Unix timestamp.
+
+    Args:
+        value (str): The header value, e.g. "Wed, 21 Oct 2015 07:28:00 GMT".
+
+    Returns:
+        float: The timestamp, or None if the value is not a valid date.
+    """
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def parse_cache_control(value):
+    """
+    Parse a Cache-Control header into a dictionary of directives.
+
+    Args:
+        value (str): The Cache-Control header value.
+
+    Returns:
+        dict: Lowercase directive names mapped to their value (or True).
+    """
+    directives = {}
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "=" in part:
+            name, arg = part.split("=", 1)
+            directives[name.strip().lower()] = arg.strip().strip('"')
+        else:
+            directives[part.lower()] = True
+    return directives
+
+
+def forbids_reuse(headers):
+    """Return True if Cache-Control forbids serving a response without asking the server."""
+    directives = parse_cache_control(headers.get("cache-control", ""))
+    return "no-store" in directives or "no-cache" in directives
+
+
+def freshness_lifetime(headers, now=None):
+    """
+    Compute how long a response stays fresh from its headers.
+
+    Cache-Control max-age takes precedence over Expires, and Expires is
+    measured against the Date header when one is present. The Age header
+    and the apparent age from Date are subtracted so that a response which
+    spent time in transit or in another cache is not kept too long.
+
+    Args:
+        headers (dict): Lowercase response headers.
+        now (float): The current time; defaults to time.time().
+
+    Returns:
+        float: Seconds the response remains fresh (0 if it must not be
+               reused without revalidation).
+    """
+    if now is None:
+        now = time.time()
+    if forbids_reuse(headers):
+        return 0
+    directives = parse_cache_control(headers.get("cache-control", ""))
+
+    date = parse_http_date(headers["date"]) if "date" in headers else None
+    if date is None:
+        date = now
+
+    if "max-age" in directives:
+        try:
+            lifetime = int(directives["max-age"])
+        except ValueError:
+            return 0
+    elif "expires" in headers:
+        expires = parse_http_date(headers["expires"])
+        if expires is None:
+            # Invalid dates such as "0" mean "already expired"
+            return 0
+        lifetime = expires - date
+    else:
+        return 0
+
+    age = max(0, now - date)
+    try:
+        age = max(age, int(headers.get("age", 0)))
+    except ValueError:
+        pass
+    return max(0, lifetime - age)
+
+
+class CacheEntry:
+    """A cached response body together with its expiry time."""
+    def __init__(self, content, expires):
+        self.content = content
+        self.expires = expires
+
+    @property
+    def size(self):
+        return len(self.content)
+
+    def is_fresh(self, now=None):
+        return (now if now is not None else time.time()) < self.expires
+
+
+class ResponseCache:
+    """
+    An in-memory LRU cache of response bodies bounded by entry count and
+    total size in bytes.
+    """
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_entries=256):
+        """
+        Initialize an empty cache.
+
+        Args:
+            max_bytes (int): Total size budget for cached bodies.
+            max_entries (int): Maximum number of cached responses.
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry.is_fresh()
+
+    def get(self, key, now=None):
+        """
+        Look up a fresh response and mark it as most recently used.
+
+        Args:
+            key (str): The cache key.
+            now (float): The current time; defaults to time.time().
+
+        Returns:
+            bytes: The cached body, or None on a miss or expired entry.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if not entry.is_fresh(now):
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry.content
+
+    def put(self, key, content, lifetime, now=None):
+        """
+        Store a response body for `lifetime` seconds, evicting the least
+        recently used entries if the cache goes over budget.
+
+        Args:
+            key (str): The cache key.
+            content (bytes): The response body.
+            lifetime (float): Seconds the body stays fresh.
+            now (float): The current time; defaults to time.time().
+
+        Returns:
+            bool: True if the body was stored.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            if lifetime <= 0 or len(content) > self.max_bytes or self.max_entries <= 0:
+                return False
+            self.entries[key] = CacheEntry(content, now + lifetime)
+            self.total_bytes += len(content)
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, key):
+        """Drop a single entry from the cache, if present."""
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def clear(self):
+        """Drop every entry; the counters are kept."""
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        """
+        Return the cache counters.
+
+        Returns:
+            dict: hits, misses, evictions, expirations, entries and bytes.
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+            }
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry.size
@@ -0,0 +1,259 @@
+import select
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+# Per thread, what is told about the connections the thread acquires
+_local = threading.local()
+
+
+@contextmanager
+def tracking(tracker):
+    """
+    Report every connection acquired on this thread in the enclosed block
+    to tracker.add(conn), and to tracker.discard(conn) once it is released,
+    e.g. so that a cancelled page load can abort what it is waiting on.
+    """
+    previous = getattr(_local, "tracker", None)
+    _local.tracker = tracker
+    try:
+        yield tracker
+    finally:
+        _local.tracker = previous
+
+
+class PooledConnection:
+    """A socket owned by a ConnectionPool plus its buffered reader."""
+    def __init__(self, key, sock):
+        self.key = key
+        self.sock = sock
+        self.reader = sock.makefile("rb")
+        self.last_used = time.monotonic()
+        self.reused = False
+        # Set by abort(); the response read from it may be cut short
+        self.aborted = False
+        self.tracker = None
+
+    def is_alive(self):
+        """
+        Check whether an idle socket can still carry a request.
+
+        An idle keep-alive socket has nothing to read, so a readable socket
+        means the server closed it (EOF, TLS close_notify) or sent stray
+        bytes; either way it must not be reused.
+
+        Returns:
+            bool: True if the socket looks healthy.
+        """
+        try:
+            if self.sock.fileno() < 0:
+                return False
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (OSError, ValueError, TypeError):
+            return False
+        return not readable
+
+    def abort(self):
+        """
+        Shut the socket down from another thread, so that a read blocked
+        on it returns at once. The owner still releases the connection.
+        """
+        self.aborted = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        for closable in (self.reader, self.sock):
+            try:
+                closable.close()
+            except OSError:
+                pass
+
+
+class ConnectionPool:
+    """
+    A pool of keep-alive connections keyed on (host, port, scheme).
+
+    Idle sockets are health-checked before reuse and closed once they have
+    been idle longer than `idle_timeout`, checked for every key whenever a
+    connection is acquired or released. At most `max_per_host` sockets are
+    open per key; callers beyond that wait for one to be released.
+    """
+    def __init__(self, connect, max_per_host=6, idle_timeout=60, acquire_timeout=30,
+                 on_release=None):
+        """
+        Initialize an empty pool.
+
+        Args:
+            connect (callable): connect(host, port, scheme) returning a socket.
+            max_per_host (int): Maximum open sockets per (host, port, scheme).
+            idle_timeout (float): Seconds an idle socket is kept open.
+            acquire_timeout (float): Seconds to wait for a free slot.
+            on_release (callable): on_release(conn), called with every
+                                   connection handed back, before it may
+                                   be closed.
+        """
+        self.connect = connect
+        self.on_release = on_release
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.idle = {}
+        self.active = {}
+        self.created = 0
+        self.reused = 0
+        self.dead = 0
+        self.expired = 0
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        """Return the number of open sockets, idle or in use."""
+        with self.condition:
+            return (sum(len(conns) for conns in self.idle.values())
+                    + sum(self.active.values()))
+
+    def acquire(self, host, port, scheme, fresh=False):
+        """
+        Get a connection, reusing a healthy idle one when possible.
+
+        Args:
+            host (str): The host to connect to.
+            port (int): The port to connect to.
+            scheme (str): The URL scheme (http or https).
+            fresh (bool): Skip idle sockets and always open a new one.
+
+        Returns:
+            PooledConnection: A connection reserved for the caller.
+        """
+        key = (host, port, scheme)
+        deadline = time.monotonic() + self.acquire_timeout
+        with self.condition:
+            while True:
+                self._prune_idle()
+                idle = self.idle.get(key, [])
+                while idle and not fresh:
+                    conn = idle.pop()
+                    if conn.is_alive():
+                        conn.reused = True
+                        self.reused += 1
+                        self.active[key] = self.active.get(key, 0) + 1
+                        return self._track(conn)
+                    self.dead += 1
+                    conn.close()
+                if fresh and idle and self._open_count(key) >= self.max_per_host:
+                    # Make room for the fresh socket by dropping an idle one
+                    idle.pop(0).close()
+                if self._open_count(key) < self.max_per_host:
+                    self.active[key] = self.active.get(key, 0) + 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No free connection to {host}:{port}")
+                self.condition.wait(remaining)
+        try:
+            sock = self.connect(host, port, scheme)
+        except BaseException:
+            with self.condition:
+                self._decrement(key)
+            raise
+        with self.condition:
+            self.created += 1
+        return self._track(PooledConnection(key, sock))
+
+    def _track(self, conn):
+        conn.tracker = getattr(_local, "tracker", None)
+        if conn.tracker is not None:
+            conn.tracker.add(conn)
+        return conn
+
+    def release(self, conn, reusable=True):
+        """
+        Return a connection after its response has been fully read.
+
+        Args:
+            conn (PooledConnection): The connection from acquire().
+            reusable (bool): False if the socket must be closed instead
+                             (Connection: close, body read to EOF, errors).
+        """
+        if conn.tracker is not None:
+            conn.tracker.discard(conn)
+            conn.tracker = None
+        if conn.aborted:
+            reusable = False
+        if self.on_release is not None:
+            self.on_release(conn)
+        with self.condition:
+            self._decrement(conn.key)
+            self._prune_idle()
+            if reusable:
+                conn.last_used = time.monotonic()
+                self.idle.setdefault(conn.key, []).append(conn)
+            self.condition.notify_all()
+        if not reusable:
+            conn.close()
+
+    def discard(self, conn):
+        """Close a connection that failed or cannot be reused."""
+        self.release(conn, reusable=False)
+
+    def prune(self):
+        """Close every idle socket that has exceeded the idle timeout."""
+        with self.condition:
+            self._prune_idle()
+
+    def close_all(self):
+        """Close every idle socket."""
+        with self.condition:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle.clear()
+
+    def stats(self):
+        """
+        Return the pool counters.
+
+        Returns:
+            dict: created, reused, dead, expired and open socket counts.
+        """
+        with self.condition:
+            return {
+                "created": self.created,
+                "reused": self.reused,
+                "dead": self.dead,
+                "expired": self.expired,
+                "open": len(self),
+            }
+
+    def _open_count(self, key):
+        return len(self.idle.get(key, [])) + self.active.get(key, 0)
+
+    def _decrement(self, key):
+        self.active[key] = self.active.get(key, 1) - 1
+        if self.active[key] <= 0:
+            del self.active[key]
+
+    def _prune_idle(self):
+        for key in list(self.idle):
+            self._prune_key(key)
+
+    def _prune_key(self, key):
+        idle = self.idle.get(key)
+        if not idle:
+            self.idle.pop(key, None)
+            return
+        cutoff = time.monotonic() - self.idle_timeout
+        keep = []
+        for conn in idle:
+            if conn.last_used < cutoff:
+                self.expired += 1
+                conn.close()
+            else:
+                keep.append(conn)
+        if keep:
+            self.idle[key] = keep
+        else:
+            del self.idle[key]
@@ -1,12 +1,275 @@
-def handle_data_url(data):
+import binascii
+import codecs
+import hashlib
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from urllib.parse import unquote_to_bytes
+
+# Characters of a data: URL decoded at a time
+CHUNK_CHARS = 64 * 1024
+# Decoded payloads kept so that navigating to a URL again skips decoding
+DATA_CACHE_ENTRIES = 16
+DATA_CACHE_CHARS = 32 * 1024 * 1024
+
+ASCII_WHITESPACE = "\t\n\f\r "
+# The media type of a data: URL whose own one is missing or invalid
+DEFAULT_MEDIA_TYPE = "text/plain;charset=US-ASCII"
+
+# A parsed media type: "type/subtype" in lowercase and its parameters
+MediaType = namedtuple("MediaType", "essence parameters")
+
+TOKEN_RE = re.compile(r"[!#$%&'*+.^_`|~0-9A-Za-z-]+\Z")
+PARAMETER_RE = re.compile(r'([^;=]*)(?:=("(?:[^"\\]|\\.)*"?|[^;]*))?[^;]*;?')
+BASE64_SUFFIX_RE = re.compile(r";[ ]*base64\Z", re.IGNORECASE)
+
+
+def parse_media_type(text):
+    """
+    Parse a media type such as 'text/html; charset="utf-8"'.
+
+    Args:
+        text (str): The media type.
+
+    Returns:
+        MediaType: The parsed type, or None if it is not valid.
+    """
+    essence, _, rest = text.strip(ASCII_WHITESPACE).partition(";")
+    type_, slash, subtype = essence.partition("/")
+    subtype = subtype.rstrip(ASCII_WHITESPACE)
+    if not slash or not TOKEN_RE.match(type_) or not TOKEN_RE.match(subtype):
+        return None
+    parameters = {}
+    for match in PARAMETER_RE.finditer(rest):
+        name = match.group(1).lstrip(ASCII_WHITESPACE).lower()
+        value = match.group(2)
+        if not name or value is None or not TOKEN_RE.match(name):
+            continue
+        if value.startswith('"'):
+            value = re.sub(r"\\(.)", r"\1", value[1:].rstrip('"'))
+        else:
+            value = value.rstrip(ASCII_WHITESPACE)
+        # The first occurrence of a parameter wins
+        if value and name not in parameters:
+            parameters[name] = value
+    return MediaType(f"{type_.lower()}/{subtype.lower()}", parameters)
+
+
+def parse_data_url(data, start=0):
+    """
+    Parse the header of a data: URL, the part before the first comma.
+
+    Args:
+        data (str): A string holding the URL's data, e.g. the whole URL.
+        start (int): Where the data begins, just after "data:".
+
+    Returns:
+        tuple: The MediaType, whether the body is base64, and the index
+               where the body begins.
+
+    Raises:
+        ValueError: If there is no comma.
+    """
+    comma = data.find(",", start)
+    if comma < 0:
+        raise ValueError("data: URL has no comma")
+    header = data[start:comma].strip(ASCII_WHITESPACE)
+    is_base64 = False
+    match = BASE64_SUFFIX_RE.search(header)
+    if match is not None:
+        is_base64 = True
+        header = header[:match.start()]
+    if header.startswith(";"):
+        header = "text/plain" + header
+    media_type = parse_media_type(header) or parse_media_type(DEFAULT_MEDIA_TYPE)
+    return media_type, is_base64, comma + 1
+
+
+class Base64Decoder:
+    """
+    The forgiving-base64 decode of the WHATWG Infra standard, fed in
+    pieces: ASCII whitespace is ignored and up to two "=" may end the
+    input.
+    """
+    def __init__(self):
+        self.pending = b""
+        self.length = 0
+        self.padding = 0
+
+    def feed(self, data):
+        """
+        Decode the next piece of base64 text.
+
+        Args:
+            data (bytes): The next piece.
+
+        Returns:
+            bytes: The bytes decoded so far.
+        """
+        data = data.translate(None, b"\t\n\f\r ")
+        if self.padding or b"=" in data:
+            first = 0 if self.padding else data.find(b"=")
+            head, pads = data[:first], data[first:]
+            # Only more padding may follow the first "="
+            if pads.strip(b"="):
+                raise ValueError("Invalid base64 in data: URL")
+            self.padding += len(pads)
+            data = head
+        self.length += len(data)
+        data = self.pending + data
+        usable = len(data) - len(data) % 4
+        self.pending = data[usable:]
+        return self._decode(data[:usable])
+
+    def close(self):
+        """
+        Decode what is left at the end of the input.
+
+        Returns:
+            bytes: The last decoded bytes.
+        """
+        if self.padding and (self.padding > 2 or (self.length + self.padding) % 4):
+            raise ValueError("Invalid base64 padding in data: URL")
+        remainder, self.pending = self.pending, b""
+        if len(remainder) == 1:
+            raise ValueError("Invalid base64 length in data: URL")
+        if not remainder:
+            return b""
+        return self._decode(remainder + b"=" * (4 - len(remainder)))
+
+    @staticmethod
+    def _decode(data):
+        try:
+            return binascii.a2b_base64(data, strict_mode=True)
+        except binascii.Error as e:
+            raise ValueError(f"Invalid base64 in data: URL: {e}") from None
+
+
+def iter_data_url(data, start=0, chunk_chars=CHUNK_CHARS):
+    """
+    Decode the body of a data: URL a chunk at a time.
+
+    The body is percent-decoded, then base64-decoded if the header ends
+    in ";base64", then decoded as text in the media type's charset
+    (UTF-8 if it has none), so only about `chunk_chars` of it are being
+    worked on at once.
+
+    Args:
+        data (str): A string holding the URL's data, e.g. the whole URL.
+        start (int): Where the data begins, just after "data:".
+        chunk_chars (int): How much of the URL to decode at a time.
+
+    Yields:
+        str: Consecutive pieces of the decoded payload.
+    """
+    media_type, is_base64, pos = parse_data_url(data, start)
+    end = len(data)
+    while end > pos and data[end - 1] in ASCII_WHITESPACE:
+        end -= 1
+    charset = media_type.parameters.get("charset", "utf-8")
+    if charset.lower() in ("us-ascii", "ascii"):
+        # The default charset; decode its superset so typed text survives
+        charset = "utf-8"
+    try:
+        decoder = codecs.getincrementaldecoder(charset)("replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    base64_decoder = Base64Decoder() if is_base64 else None
+    carry = ""
+    while pos < end:
+        stop = min(pos + chunk_chars, end)
+        chunk = carry + data[pos:stop]
+        pos = stop
+        carry = ""
+        # Keep a percent escape cut by the chunk's end for the next chunk
+        cut = chunk.find("%", len(chunk) - 2)
+        if cut >= 0 and pos < end:
+            chunk, carry = chunk[:cut], chunk[cut:]
+        raw = unquote_to_bytes(chunk) if "%" in chunk else chunk.encode("utf8")
+        if base64_decoder is not None:
+            raw = base64_decoder.feed(raw)
+        text = decoder.decode(raw)
+        if text:
+            yield text
+    raw = base64_decoder.close() if base64_decoder is not None else b""
+    text = decoder.decode(raw, final=True)
+    if text:
+        yield text
+
+
+def data_url_key(data, start=0, chunk_chars=CHUNK_CHARS):
+    """Return a digest of a data: URL, so the cache never holds the URL itself."""
+    # Not for security; SHA-1 is simply the fastest digest available here
+    digest = hashlib.sha1(usedforsecurity=False)
+    for pos in range(start, len(data), chunk_chars):
+        digest.update(data[pos:pos + chunk_chars].encode("utf8"))
+    return digest.digest()
+
+
+class DataURLCache:
+    """
+    The decoded payloads of recently loaded data: URLs, keyed on a hash
+    of the URL, least recently used first out.
+    """
+    def __init__(self, max_entries=DATA_CACHE_ENTRIES, max_chars=DATA_CACHE_CHARS):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.entries = OrderedDict()
+        self.chars = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the payload cached under a key, or None."""
+        with self.lock:
+            content = self.entries.get(key)
+            if content is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return content
+
+    def put(self, key, content):
+        """Cache a payload, if it fits the budget."""
+        if len(content) > self.max_chars:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.chars -= len(old)
+            self.entries[key] = content
+            self.chars += len(content)
+            while len(self.entries) > self.max_entries or self.chars > self.max_chars:
+                _, evicted = self.entries.popitem(last=False)
+                self.chars -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.chars = 0
+
+
+# Shared by every data: URL load
+data_cache = DataURLCache()
+
+
+def handle_data_url(data, start=0):
     """
     Handle the data URL scheme by returning the inlined data.
-    
+
     Args:
-        data (str): The data part of the data URL.
-        
+        data (str): The data part of the data URL, or a string holding
+                    it from index `start`, so large URLs need not be sliced.
+        start (int): Where the data part begins.
+
     Returns:
-        str: The inlined data.
+        str: The inlined data, decoded.
     """
-    _, data = data.split(",", 1)
-    return data
+    key = data_url_key(data, start)
+    content = data_cache.get(key)
+    if content is None:
+        content = "".join(iter_data_url(data, start))
+        data_cache.put(key, content)
+    return content
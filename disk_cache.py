@@ -0,0 +1,306 @@
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+
+from cache import freshness_lifetime
+
+# Response headers kept in the index so entries can be revalidated later
+STORED_HEADERS = ("cache-control", "expires", "date", "age", "etag", "last-modified")
+# Cache hits only move last_used, so the index they change is written at
+# most this often; stores, evictions and close() write it straight away
+INDEX_SAVE_INTERVAL = 30.0
+
+
+class DiskEntry:
+    """Index metadata for a response body stored on disk."""
+    def __init__(self, digest, size, headers, expires, last_used):
+        self.digest = digest
+        self.size = size
+        self.headers = headers
+        self.expires = expires
+        self.last_used = last_used
+
+    @property
+    def etag(self):
+        return self.headers.get("etag")
+
+    @property
+    def last_modified(self):
+        return self.headers.get("last-modified")
+
+    def is_fresh(self, now=None):
+        return (now if now is not None else time.time()) < self.expires
+
+    def can_revalidate(self):
+        return self.etag is not None or self.last_modified is not None
+
+    def validators(self):
+        """
+        Build the conditional request headers for revalidating this entry.
+
+        Returns:
+            dict: If-None-Match and/or If-Modified-Since headers.
+        """
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_json(self):
+        return {
+            "digest": self.digest,
+            "size": self.size,
+            "headers": self.headers,
+            "expires": self.expires,
+            "last_used": self.last_used,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data["digest"], data["size"], data["headers"],
+                   data["expires"], data["last_used"])
+
+
+class DiskCache:
+    """
+    A persistent response cache made of a JSON index plus body files named
+    by the SHA-256 of their content. Bodies are read back through mmap, and
+    the total size of the stored bodies is kept under a disk budget by
+    evicting the least recently used entries.
+
+    The recency a hit records is kept in memory and written with the next
+    change to the index, by close(), or after INDEX_SAVE_INTERVAL seconds.
+    """
+    INDEX_NAME = "index.json"
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        """
+        Open (or lazily create) a disk cache.
+
+        Args:
+            directory (str): The directory holding the index and bodies.
+            max_bytes (int): Disk budget for the stored bodies.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+        # Whether the index in memory has changes not yet on disk
+        self.dirty = False
+        self.saved_at = time.monotonic()
+        self._load_index()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def total_bytes(self):
+        sizes = {entry.digest: entry.size for entry in self.entries.values()}
+        return sum(sizes.values())
+
+    def lookup(self, key):
+        """
+        Return the index entry for a key, fresh or stale.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            DiskEntry: The entry, or None if the key is not stored.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+            return entry
+
+    def read(self, key, entry):
+        """
+        Read a stored body through a read-only memory map.
+
+        Args:
+            key (str): The cache key the entry belongs to.
+            entry (DiskEntry): The entry returned by lookup().
+
+        Returns:
+            bytes: The body, or None if the body file has gone missing.
+        """
+        path = self._body_path(entry.digest)
+        try:
+            with open(path, "rb") as f:
+                if entry.size == 0:
+                    content = b""
+                else:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                        content = m[:]
+        except (OSError, ValueError):
+            with self.lock:
+                self.entries.pop(key, None)
+                self._save_index()
+            return None
+        with self.lock:
+            entry.last_used = time.time()
+            self.hits += 1
+            self.dirty = True
+            if time.monotonic() - self.saved_at >= INDEX_SAVE_INTERVAL:
+                self._save_index()
+        return content
+
+    def store(self, key, content, headers, now=None):
+        """
+        Write a response body to disk and record it in the index.
+
+        Responses that are neither fresh nor revalidatable are not stored.
+
+        Args:
+            key (str): The cache key.
+            content (bytes): The decoded response body.
+            headers (dict): Lowercase response headers.
+            now (float): The current time; defaults to time.time().
+
+        Returns:
+            DiskEntry: The new entry, or None if the response was not stored.
+        """
+        if now is None:
+            now = time.time()
+        if "no-store" in headers.get("cache-control", "").lower():
+            self.invalidate(key)
+            return None
+        kept = {name: headers[name] for name in STORED_HEADERS if name in headers}
+        lifetime = freshness_lifetime(headers, now)
+        entry = DiskEntry(hashlib.sha256(content).hexdigest(), len(content),
+                          kept, now + lifetime, now)
+        if (lifetime <= 0 and not entry.can_revalidate()) or entry.size > self.max_bytes:
+            self.invalidate(key)
+            return None
+        with self.lock:
+            path = self._body_path(entry.digest)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+            old = self.entries.get(key)
+            self.entries[key] = entry
+            if old is not None:
+                self._release(old.digest)
+            self._evict()
+            self._save_index()
+        return entry
+
+    def freshen(self, key, entry, headers, now=None):
+        """
+        Update an entry after the server answered 304 Not Modified.
+
+        Args:
+            key (str): The cache key.
+            entry (DiskEntry): The entry that was revalidated.
+            headers (dict): Lowercase headers of the 304 response.
+            now (float): The current time; defaults to time.time().
+
+        Returns:
+            float: The new freshness lifetime in seconds.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            entry.headers.update(
+                {name: headers[name] for name in STORED_HEADERS if name in headers})
+            lifetime = freshness_lifetime(entry.headers, now)
+            entry.expires = now + lifetime
+            entry.last_used = now
+            self.revalidations += 1
+            self._save_index()
+        return lifetime
+
+    def invalidate(self, key):
+        """Remove a key from the index and delete its body if unused."""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self._release(entry.digest)
+                self._save_index()
+
+    def clear(self):
+        """Remove every entry and body file."""
+        with self.lock:
+            for key in list(self.entries):
+                entry = self.entries.pop(key)
+                self._release(entry.digest)
+            self._save_index()
+
+    def close(self):
+        """Write out recency changes that are only in memory."""
+        with self.lock:
+            if self.dirty:
+                self._save_index()
+
+    def stats(self):
+        """
+        Return the disk cache counters.
+
+        Returns:
+            dict: hits, misses, revalidations, evictions, entries and bytes.
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+            }
+
+    def _body_path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _release(self, digest):
+        """Delete a body file once no index entry refers to it."""
+        if any(entry.digest == digest for entry in self.entries.values()):
+            return
+        try:
+            os.remove(self._body_path(digest))
+        except OSError:
+            pass
+
+    def _evict(self):
+        by_age = sorted(self.entries.items(), key=lambda item: item[1].last_used)
+        total = self.total_bytes
+        for key, entry in by_age:
+            if total <= self.max_bytes:
+                break
+            del self.entries[key]
+            self.evictions += 1
+            if not any(other.digest == entry.digest for other in self.entries.values()):
+                total -= entry.size
+            self._release(entry.digest)
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.directory, self.INDEX_NAME), "r", encoding="utf8") as f:
+                data = json.load(f)
+            self.entries = {key: DiskEntry.from_json(value) for key, value in data.items()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            # Missing or corrupt index: start with an empty cache
+            self.entries = {}
+
+    def _save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, self.INDEX_NAME)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump({key: entry.to_json() for key, entry in self.entries.items()}, f)
+        os.replace(tmp_path, path)
+        self.dirty = False
+        self.saved_at = time.monotonic()
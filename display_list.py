@@ -0,0 +1,116 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class DisplayList:
+    """
+    A compact list of (x, y, glyph) entries.
+
+    Coordinates live in two array('i') columns and each glyph is stored as
+    an index into a table of distinct glyphs (text runs or images), so an
+    entry costs 12 bytes instead of a tuple and its objects. Layout only
+    ever moves down the page, so the y column is sorted and the entries of
+    any band of rows can be found with bisect.
+    """
+    def __init__(self, glyphs=None, glyph_index=None):
+        """
+        Initialize an empty display list.
+
+        Args:
+            glyphs (list): A glyph table to share with other display lists.
+            glyph_index (dict): The glyph -> index mapping of that table.
+        """
+        self.xs = array('i')
+        self.ys = array('i')
+        self.glyph_ids = array('i')
+        self.glyphs = glyphs if glyphs is not None else []
+        self.glyph_index = glyph_index if glyph_index is not None else {}
+        self.max_y = 0
+
+    def append(self, x, y, glyph):
+        """
+        Add an entry below or beside the previous one.
+
+        Args:
+            x (int): The x position.
+            y (int): The y position; must not be above the previous entry.
+            glyph: A character or an image.
+        """
+        glyph_id = self.glyph_index.get(glyph)
+        if glyph_id is None:
+            glyph_id = self.glyph_index[glyph] = len(self.glyphs)
+            self.glyphs.append(glyph)
+        self.xs.append(x)
+        self.ys.append(y)
+        self.glyph_ids.append(glyph_id)
+        if y > self.max_y:
+            self.max_y = y
+
+    def extend(self, other, dy=0):
+        """
+        Append every entry of another display list, moved down by `dy`.
+
+        Glyphs of a list with its own table are added to this one's and
+        the entries renumbered to match.
+
+        Args:
+            other (DisplayList): The entries to append.
+            dy (int): The offset added to each y.
+        """
+        self.xs.extend(other.xs)
+        self.ys.extend([y + dy for y in other.ys] if dy else other.ys)
+        if other.glyphs is self.glyphs:
+            self.glyph_ids.extend(other.glyph_ids)
+        else:
+            glyphs, glyph_index = self.glyphs, self.glyph_index
+            renumber = list(map(glyph_index.get, other.glyphs))
+            if None in renumber:
+                for i, glyph_id in enumerate(renumber):
+                    if glyph_id is None:
+                        glyph = other.glyphs[i]
+                        renumber[i] = glyph_index[glyph] = len(glyphs)
+                        glyphs.append(glyph)
+            self.glyph_ids.extend(map(renumber.__getitem__, other.glyph_ids))
+        if len(other) and other.max_y + dy > self.max_y:
+            self.max_y = other.max_y + dy
+
+    def __len__(self):
+        return len(self.xs)
+
+    def __getitem__(self, i):
+        return self.xs[i], self.ys[i], self.glyphs[self.glyph_ids[i]]
+
+    def __iter__(self):
+        glyphs = self.glyphs
+        for x, y, glyph_id in zip(self.xs, self.ys, self.glyph_ids):
+            yield x, y, glyphs[glyph_id]
+
+    def row_range(self, top, bottom):
+        """
+        Find the entries whose y lies within [top, bottom].
+
+        Args:
+            top (int): The smallest y to include.
+            bottom (int): The largest y to include.
+
+        Returns:
+            tuple: (start, end) indices of the matching entries.
+        """
+        return bisect_left(self.ys, top), bisect_right(self.ys, bottom)
+
+    def rows(self, top, bottom):
+        """
+        Iterate over the entries whose y lies within [top, bottom].
+
+        Yields:
+            tuple: (x, y, glyph) for each entry in the band.
+        """
+        start, end = self.row_range(top, bottom)
+        glyphs = self.glyphs
+        for i in range(start, end):
+            yield self.xs[i], self.ys[i], glyphs[self.glyph_ids[i]]
+
+    def memory_size(self):
+        """Return the approximate number of bytes used by the columns."""
+        return sum(column.itemsize * len(column)
+                   for column in (self.xs, self.ys, self.glyph_ids))
@@ -0,0 +1,272 @@
+import json
+import os
+import sys
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+
+EMOJI_DIR = "Assets/emojis"
+MANIFEST_NAME = "manifest.json"
+# The code points that default to emoji presentation: the
+# Emoji_Presentation property of Unicode 15's emoji-data.txt, as inclusive
+# ranges. Others (e.g. "-", "©", U+1F321) default to text presentation,
+# so they are only drawn as emoji as part of a longer sequence or a :CODE:
+EMOJI_PRESENTATION_RANGES = (
+    (0x231A, 0x231B), (0x23E9, 0x23EC), (0x23F0, 0x23F0), (0x23F3, 0x23F3),
+    (0x25FD, 0x25FE), (0x2614, 0x2615), (0x2648, 0x2653), (0x267F, 0x267F),
+    (0x2693, 0x2693), (0x26A1, 0x26A1), (0x26AA, 0x26AB), (0x26BD, 0x26BE),
+    (0x26C4, 0x26C5), (0x26CE, 0x26CE), (0x26D4, 0x26D4), (0x26EA, 0x26EA),
+    (0x26F2, 0x26F3), (0x26F5, 0x26F5), (0x26FA, 0x26FA), (0x26FD, 0x26FD),
+    (0x2705, 0x2705), (0x270A, 0x270B), (0x2728, 0x2728), (0x274C, 0x274C),
+    (0x274E, 0x274E), (0x2753, 0x2755), (0x2757, 0x2757), (0x2795, 0x2797),
+    (0x27B0, 0x27B0), (0x27BF, 0x27BF), (0x2B1B, 0x2B1C), (0x2B50, 0x2B50),
+    (0x2B55, 0x2B55), (0x1F004, 0x1F004), (0x1F0CF, 0x1F0CF), (0x1F18E, 0x1F18E),
+    (0x1F191, 0x1F19A), (0x1F1E6, 0x1F1FF), (0x1F201, 0x1F201), (0x1F21A, 0x1F21A),
+    (0x1F22F, 0x1F22F), (0x1F232, 0x1F236), (0x1F238, 0x1F23A), (0x1F250, 0x1F251),
+    (0x1F300, 0x1F320), (0x1F32D, 0x1F335), (0x1F337, 0x1F37C), (0x1F37E, 0x1F393),
+    (0x1F3A0, 0x1F3CA), (0x1F3CF, 0x1F3D3), (0x1F3E0, 0x1F3F0), (0x1F3F4, 0x1F3F4),
+    (0x1F3F8, 0x1F43E), (0x1F440, 0x1F440), (0x1F442, 0x1F4FC), (0x1F4FF, 0x1F53D),
+    (0x1F54B, 0x1F54E), (0x1F550, 0x1F567), (0x1F57A, 0x1F57A), (0x1F595, 0x1F596),
+    (0x1F5A4, 0x1F5A4), (0x1F5FB, 0x1F64F), (0x1F680, 0x1F6C5), (0x1F6CC, 0x1F6CC),
+    (0x1F6D0, 0x1F6D2), (0x1F6D5, 0x1F6D7), (0x1F6DC, 0x1F6DF), (0x1F6EB, 0x1F6EC),
+    (0x1F6F4, 0x1F6FC), (0x1F7E0, 0x1F7EB), (0x1F7F0, 0x1F7F0), (0x1F90C, 0x1F93A),
+    (0x1F93C, 0x1F945), (0x1F947, 0x1F9FF), (0x1FA70, 0x1FA7C), (0x1FA80, 0x1FA88),
+    (0x1FA90, 0x1FABD), (0x1FABF, 0x1FAC5), (0x1FACE, 0x1FADB), (0x1FAE0, 0x1FAE8),
+    (0x1FAF0, 0x1FAF8),
+)
+EMOJI_PRESENTATION_STARTS = [start for start, _ in EMOJI_PRESENTATION_RANGES]
+
+# A display-list glyph standing for the emoji image stored as <name>.png
+Emoji = namedtuple("Emoji", "name")
+# Emoji presentation selector, often left out of typed sequences
+VS16 = "\uFE0F"
+
+
+class EmojiTrie:
+    """
+    A code point trie of emoji sequences for longest-match lookup.
+
+    Each node is a dict from the next character to the child node; the
+    None key of a node holds the glyph of the sequence ending there.
+    """
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, sequence):
+        node = self.root
+        for c in sequence:
+            node = node.get(c)
+            if node is None:
+                return False
+        return None in node
+
+    def insert(self, sequence, glyph):
+        """Add a sequence, replacing the glyph of an existing one."""
+        node = self.root
+        for c in sequence:
+            node = node.setdefault(c, {})
+        if None not in node:
+            self.size += 1
+        node[None] = glyph
+
+    def match(self, text, start):
+        """
+        Find the longest sequence in the trie starting at text[start].
+
+        Args:
+            text (str): The text to search.
+            start (int): The index to match from.
+
+        Returns:
+            tuple: (end, glyph) for the longest match, or None.
+        """
+        node = self.root
+        best = None
+        for i in range(start, len(text)):
+            node = node.get(text[i])
+            if node is None:
+                break
+            glyph = node.get(None)
+            if glyph is not None:
+                best = (i + 1, glyph)
+        return best
+
+    @classmethod
+    def from_mapping(cls, emoji_mapping):
+        """Build a trie of the single characters of a plain emoji mapping."""
+        trie = cls()
+        for key, glyph in emoji_mapping.items():
+            if len(key) == 1:
+                trie.insert(key, glyph)
+        return trie
+
+
+class EmojiMapping(dict):
+    """
+    :CODE: names and single emoji characters mapped to glyphs, as layout
+    has always taken them, plus `trie` holding every emoji sequence.
+    """
+    def __init__(self, entries=(), trie=None):
+        super().__init__(entries)
+        self.trie = trie if trie is not None else EmojiTrie()
+
+
+def emoji_trie(emoji_mapping):
+    """Return the sequence trie for an emoji mapping, building one if needed."""
+    if isinstance(emoji_mapping, EmojiMapping):
+        return emoji_mapping.trie
+    return EmojiTrie.from_mapping(emoji_mapping)
+
+
+def presented_as_emoji(sequence):
+    """Return False for a lone code point that defaults to text presentation."""
+    if len(sequence) > 1:
+        return True
+    i = bisect_right(EMOJI_PRESENTATION_STARTS, ord(sequence)) - 1
+    return i >= 0 and ord(sequence) <= EMOJI_PRESENTATION_RANGES[i][1]
+
+
+def sequence_of(name):
+    """
+    Convert an image name such as "1F44D-1F3FD" to its code point sequence.
+
+    Returns:
+        str: The emoji characters, or None if the name is not hex code points.
+    """
+    try:
+        return "".join(chr(int(part, 16)) for part in name.split("-"))
+    except ValueError:
+        return None
+
+
+def build_manifest(directory=EMOJI_DIR):
+    """
+    Index the emoji images in a directory without decoding any of them.
+
+    Args:
+        directory (str): The directory holding <CODEPOINTS>.png files.
+
+    Returns:
+        dict: Code point sequences mapped to image filenames.
+    """
+    manifest = {}
+    for entry in os.scandir(directory):
+        name, extension = os.path.splitext(entry.name)
+        if extension.lower() != ".png":
+            continue
+        sequence = sequence_of(name)
+        if sequence is not None:
+            manifest[sequence] = entry.name
+    return manifest
+
+
+def write_manifest(directory=EMOJI_DIR):
+    """Build the manifest of a directory and save it there as JSON."""
+    manifest = build_manifest(directory)
+    with open(os.path.join(directory, MANIFEST_NAME), "w", encoding="utf8") as f:
+        json.dump(manifest, f, ensure_ascii=False, sort_keys=True, indent=0)
+    return manifest
+
+
+def load_manifest(directory=EMOJI_DIR):
+    """
+    Return the manifest of a directory, preferring a prebuilt one.
+
+    A manifest.json is used if it is at least as new as the directory
+    itself, i.e. no image has been added or removed since it was written;
+    otherwise the directory is scanned.
+    """
+    path = os.path.join(directory, MANIFEST_NAME)
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(directory):
+            with open(path, encoding="utf8") as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        pass
+    return build_manifest(directory)
+
+
+class EmojiStore:
+    """
+    Every emoji image in a directory, decoded only when first drawn.
+
+    Layout only needs to know which emoji exist, so it works on the
+    `mapping` of :CODE: names to Emoji glyphs, whose trie matches every
+    sequence in the directory, with or without U+FE0F selectors. image()
+    decodes the PNG behind a glyph on first use and keeps at most
+    `max_images` decoded images, evicting the least recently used.
+    """
+    def __init__(self, directory=EMOJI_DIR, load_image=None, max_images=256):
+        """
+        Index the emoji directory.
+
+        Args:
+            directory (str): The directory holding the emoji images.
+            load_image (callable): Decodes an image from a path, e.g.
+                                   lambda path: tkinter.PhotoImage(file=path).
+            max_images (int): The most decoded images to keep.
+        """
+        self.directory = directory
+        self.load_image = load_image
+        self.max_images = max_images
+        self.images = OrderedDict()
+        self.manifest = load_manifest(directory) if os.path.isdir(directory) else {}
+        self.filenames = {}
+        self.mapping = EmojiMapping()
+        trie = self.mapping.trie
+        for sequence, filename in self.manifest.items():
+            emoji = Emoji(os.path.splitext(filename)[0])
+            self.filenames[emoji] = filename
+            # The :CODE: form, e.g. :1F600:
+            self.mapping[emoji.name] = emoji
+            if presented_as_emoji(sequence):
+                trie.insert(sequence, emoji)
+                if len(sequence) == 1:
+                    self.mapping[sequence] = emoji
+        # Text often omits the U+FE0F selectors the file names include
+        for sequence, filename in self.manifest.items():
+            bare = sequence.replace(VS16, "")
+            if bare != sequence and bare and presented_as_emoji(bare) and bare not in trie:
+                trie.insert(bare, Emoji(os.path.splitext(filename)[0]))
+        self.loads = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def image(self, emoji):
+        """
+        Return the decoded image of an emoji glyph.
+
+        Args:
+            emoji (Emoji): A glyph from `mapping`.
+
+        Returns:
+            The image, or None if the emoji is unknown or cannot be decoded.
+        """
+        image = self.images.get(emoji)
+        if image is not None:
+            self.images.move_to_end(emoji)
+            return image
+        filename = self.filenames.get(emoji)
+        if filename is None or self.load_image is None:
+            return None
+        try:
+            image = self.load_image(os.path.join(self.directory, filename))
+        except Exception as e:
+            print(f"Error loading emoji {filename}: {e}")
+            return None
+        self.loads += 1
+        self.images[emoji] = image
+        while len(self.images) > self.max_images:
+            self.images.popitem(last=False)
+            self.evictions += 1
+        return image
+
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else EMOJI_DIR
+    print(f"Indexed {len(write_manifest(directory))} emoji in {directory}")
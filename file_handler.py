@@ -1,12 +1,228 @@
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+# Bytes decoded at a time from a memory-mapped file
+WINDOW_BYTES = 256 * 1024
+# Files larger than this are decoded a window at a time as they are read
+LARGE_FILE_BYTES = 32 * 1024 * 1024
+# Decoded characters kept by the file cache
+FILE_CACHE_CHARS = 64 * 1024 * 1024
+
+
+class FileCache:
+    """
+    Decoded file contents, whole files or windows of them, kept under a
+    budget of characters and evicted least recently used first.
+
+    Keys start with (path, mtime, size), so an edited file is never
+    served from the cache.
+    """
+    def __init__(self, max_chars=FILE_CACHE_CHARS):
+        self.max_chars = max_chars
+        self.entries = OrderedDict()
+        self.chars = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value for a key, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, chars):
+        """Cache a value holding `chars` characters, if it fits the budget."""
+        if chars > self.max_chars:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.chars -= old[1]
+            self.entries[key] = (value, chars)
+            self.chars += chars
+            while self.chars > self.max_chars:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.chars -= evicted
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.chars = 0
+
+
+# Shared by every file:// load
+file_cache = FileCache()
+
+
+def file_key(path):
+    """Return the (path, mtime, size) cache key of a file."""
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def decode_text(data):
+    """Decode UTF-8 bytes with universal newlines, as open(path, "r") does."""
+    text = str(data, "utf8")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+class FileChanged(OSError):
+    """Raised when a mapped file was modified while it was being read."""
+
+
+class MappedFile:
+    """
+    A file memory-mapped for reading and decoded in windows.
+
+    Windows end between characters, and never between a CR and its LF,
+    so each one decodes on its own and can be cached; only the windows
+    being read are ever in memory as text. Iterating starts again from
+    the first window each time.
+
+    The file is checked before each window is mapped in, as reading past
+    the end of a file truncated after mapping it kills the process with
+    SIGBUS; a changed file stops the iteration early instead.
+    """
+    def __init__(self, path, cache=None, window_bytes=WINDOW_BYTES):
+        """
+        Map a file.
+
+        Args:
+            path (str): The file path.
+            cache (FileCache): Where decoded windows are kept.
+            window_bytes (int): The size of each decoded window.
+        """
+        self.key = file_key(path)
+        self.size = self.key[2]
+        self.cache = cache if cache is not None else file_cache
+        self.window_bytes = window_bytes
+        self.path = path
+        # Kept open to check the mapped file itself, even if it is renamed
+        self.file = open(path, "rb")
+        try:
+            # mmap refuses empty files
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        except BaseException:
+            self.file.close()
+            raise
+
+    def check(self):
+        """Raise FileChanged if the file is no longer as it was mapped."""
+        stat = os.fstat(self.file.fileno())
+        if (stat.st_mtime_ns, stat.st_size) != self.key[1:]:
+            raise FileChanged(f"{self.path} changed while being read")
+
+    def window_end(self, start):
+        """Return where the window starting at byte `start` ends."""
+        data = self.data
+        end = min(start + self.window_bytes, self.size)
+        if end == self.size:
+            return end
+        # Back up over UTF-8 continuation bytes to a character start, or
+        # go forward if the window is smaller than the character
+        stop = max(start + 1, end - 3)
+        while end > stop and data[end] & 0xC0 == 0x80:
+            end -= 1
+        while end < self.size and data[end] & 0xC0 == 0x80:
+            end += 1
+        if end == self.size:
+            return end
+        if data[end - 1] == 0x0D and data[end] == 0x0A:
+            end += 1
+        return end
+
+    def window(self, start):
+        """
+        Decode the window starting at byte `start`.
+
+        Returns:
+            tuple: The window's text and the byte offset where the next starts.
+        """
+        key = self.key + (start, self.window_bytes)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        self.check()
+        end = self.window_end(start)
+        text = decode_text(self.data[start:end])
+        self.cache.put(key, (text, end), len(text))
+        return text, end
+
+    def __iter__(self):
+        """Yield the file's text a window at a time."""
+        start = 0
+        while start < self.size:
+            try:
+                text, start = self.window(start)
+            except FileChanged as e:
+                print(f"Stopped reading: {e}")
+                return
+            yield text
+
+    def read(self):
+        """Decode the whole file at once, bypassing the window cache."""
+        self.check()
+        return decode_text(self.data)
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+
+def is_large_file(path):
+    """Return True if a file URL's file should be read a window at a time."""
+    return os.path.getsize(path.lstrip('/')) > LARGE_FILE_BYTES
+
+
+def open_file_url(path):
+    """
+    Map a file URL's file for windowed reading.
+
+    Args:
+        path (str): The file path.
+
+    Returns:
+        MappedFile: The file, iterable as decoded windows of text.
+    """
+    return MappedFile(path.lstrip('/'))
+
+
 def handle_file_url(path):
     """
     Handle the file URL scheme by reading the file content.
-    
+
+    The text is decoded from a memory map and cached until the file's
+    modification time or size changes.
+
     Args:
         path (str): The file path.
-        
+
     Returns:
         str: The content of the file.
     """
-    with open(path.lstrip('/'), "r", encoding="utf8") as f:
-        return f.read()
+    path = path.lstrip('/')
+    key = file_key(path)
+    content = file_cache.get(key)
+    if content is None:
+        mapped = MappedFile(path)
+        try:
+            content = mapped.read()
+        finally:
+            mapped.close()
+        file_cache.put(key, content, len(content))
+    return content
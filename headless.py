@@ -0,0 +1,173 @@
+"""
+Run the fetch -> lex -> layout pipeline without a display.
+
+    python -m main --headless URL            print the page's text
+    python -m main --headless --bench URL    print stage timings as JSON
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from url import URL
+from utils import LexedText
+from layout import DocumentLayout
+from emoji_store import EmojiStore, EMOJI_DIR
+from timing import navigation
+from request import resolver
+from parallel import lex_document, finish_document
+
+# The Browser's canvas at its default window size
+HEADLESS_WIDTH, HEADLESS_HEIGHT = 780, 500
+
+
+class StageTimer:
+    """
+    Time the stages of one pipeline run, optionally tracking the peak
+    memory allocated during each stage with tracemalloc.
+    """
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.peak_bytes = 0
+
+    def run(self, name, function, *args):
+        """
+        Call function(*args) as the stage `name` and return its result.
+        """
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        result = function(*args)
+        stage = {"seconds": time.perf_counter() - start}
+        if self.trace_memory:
+            stage["peak_bytes"] = tracemalloc.get_traced_memory()[1] - before
+            self.peak_bytes = max(self.peak_bytes, tracemalloc.get_traced_memory()[1])
+        self.stages[name] = stage
+        return result
+
+
+def run_pipeline(url, width=HEADLESS_WIDTH, height=HEADLESS_HEIGHT, emoji_mapping=None,
+                 trace_memory=True):
+    """
+    Fetch, lex and lay out a page the way Browser.load does, without Tk.
+
+    Args:
+        url (URL): The page to load.
+        width (int): The width to lay the page out at.
+        height (int): The viewport height.
+        emoji_mapping (dict): Emoji codes and characters mapped to glyphs.
+        trace_memory (bool): Record each stage's peak memory. Tracing
+                             slows the stages down many times over.
+
+    Returns:
+        dict: The per-stage timings and sizes of the run.
+    """
+    timer = StageTimer(trace_memory)
+    # Leave tracing alone if the caller is already tracing
+    owns_tracing = trace_memory and not tracemalloc.is_tracing()
+    if owns_tracing:
+        tracemalloc.start()
+    try:
+        with navigation(url.url) as timing:
+            body = timer.run("fetch", url.request)
+            text = body if getattr(url, "view_source", False) else timer.run("lex", lex_document, body)
+            document = DocumentLayout(text, width, emoji_mapping)
+            first_screen = timer.run("layout_first_screen", document.ensure, height)
+            first_screen_entries = len(first_screen)
+            display_list = timer.run("layout_remaining", finish_document, document, len(text))
+    finally:
+        if owns_tracing:
+            tracemalloc.stop()
+    result = {
+        "url": url.url,
+        "width": width,
+        "body_chars": len(body),
+        "text_chars": len(text),
+        "first_screen_entries": first_screen_entries,
+        "entries": len(display_list),
+        "stages": timer.stages,
+        # The finer breakdown recorded by the pipeline itself
+        "phases": timing.as_dict()["phases"],
+        "total_seconds": sum(stage["seconds"] for stage in timer.stages.values()),
+        # Cumulative over the process, so repeated runs show the cache at work
+        "dns": resolver.stats(),
+    }
+    if trace_memory:
+        result["peak_bytes"] = timer.peak_bytes
+    return result
+
+
+def benchmark(url, width=HEADLESS_WIDTH, height=HEADLESS_HEIGHT, emoji_mapping=None,
+              repeat=1, trace_memory=True):
+    """
+    Time the pipeline on a page and measure its memory.
+
+    The timings are those of the fastest of `repeat` untraced runs; the
+    peak memory of each stage comes from one extra run under tracemalloc,
+    so tracing never distorts the timings.
+
+    Args:
+        url (str): The page to load.
+        repeat (int): How many timed runs to make.
+        trace_memory (bool): Make the extra run to measure memory.
+
+    Returns:
+        dict: The result of run_pipeline, with peak_bytes per stage.
+    """
+    runs = [run_pipeline(URL(url), width, height, emoji_mapping, trace_memory=False)
+            for _ in range(repeat)]
+    result = min(runs, key=lambda run: run["total_seconds"])
+    result["repeat"] = repeat
+    if trace_memory:
+        traced = run_pipeline(URL(url), width, height, emoji_mapping, trace_memory=True)
+        for name, stage in traced["stages"].items():
+            result["stages"][name]["peak_bytes"] = stage["peak_bytes"]
+        result["peak_bytes"] = traced["peak_bytes"]
+    return result
+
+
+def print_source(body):
+    """Print a page's text, a window at a time if it is lazily read."""
+    if isinstance(body, str):
+        print(body)
+        return
+    for piece in body:
+        sys.stdout.write(piece)
+    print()
+
+
+def main(argv=None):
+    """The command line of `python -m main --headless`."""
+    parser = argparse.ArgumentParser(prog="python -m main --headless",
+                                     description="Load a page without a display.")
+    parser.add_argument("url")
+    parser.add_argument("--bench", action="store_true",
+                        help="print per-stage timings and peak memory as JSON")
+    parser.add_argument("--width", type=int, default=HEADLESS_WIDTH)
+    parser.add_argument("--height", type=int, default=HEADLESS_HEIGHT)
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="run the pipeline this many times and keep the fastest")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the extra run that measures memory")
+    args = parser.parse_args(argv)
+
+    if not args.bench:
+        url = URL(args.url)
+        body = url.source()
+        try:
+            if getattr(url, "view_source", False):
+                print_source(body)
+            else:
+                print_source(lex_document(body) if isinstance(body, str) else LexedText(body))
+        finally:
+            if not isinstance(body, str):
+                body.close()
+        return 0
+    emoji_mapping = EmojiStore(EMOJI_DIR).mapping
+    result = benchmark(args.url, args.width, args.height, emoji_mapping, args.repeat,
+                       trace_memory=not args.no_memory)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+    return 0
@@ -0,0 +1,195 @@
+import os
+import sys
+from itertools import islice
+
+# Memory the back/forward cache may use for pages other than the current one
+HISTORY_BUDGET_BYTES = int(os.environ.get("CREATOR_HISTORY_BYTES", 64 * 1024 * 1024))
+HISTORY_MAX_ENTRIES = 50
+
+
+def close_source(text):
+    """Unmap the file a lazily lexed text is read from, if it has one."""
+    close = getattr(getattr(text, "source", None), "close", None)
+    if close is not None:
+        close()
+
+
+class HistoryEntry:
+    """
+    One page of the session history and what is kept to show it again.
+
+    `text` is the lexed text and `document` its DocumentLayout at the
+    width it was laid out at, with `scroll` the position the user left
+    the page at. Either may be dropped by the cache; an entry without
+    text must be fetched again. A text read lazily from a mapped file
+    owns the mapping, which is closed when the text is dropped.
+    """
+    def __init__(self, url, text=None, document=None, scroll=0):
+        self.url = url
+        self.text = text
+        self.document = document
+        self.scroll = scroll
+        # The glyph strings of `document` measured so far; its glyph
+        # table only grows, so each one is measured once
+        self.measured = None
+        self.glyphs_measured = 0
+        self.glyph_bytes = 0
+
+    @property
+    def text_bytes(self):
+        # Lazily read files keep a MappedFile, not their text
+        return sys.getsizeof(self.text) if isinstance(self.text, str) else 0
+
+    @property
+    def layout_bytes(self):
+        if self.document is None:
+            return 0
+        display_list = self.document.display_list
+        if self.measured is not self.document:
+            self.measured, self.glyphs_measured, self.glyph_bytes = self.document, 0, 0
+        glyphs = display_list.glyphs
+        for glyph in islice(glyphs, self.glyphs_measured, None):
+            # Emoji glyphs belong to the emoji store, text runs to the layout
+            if isinstance(glyph, str):
+                self.glyph_bytes += sys.getsizeof(glyph)
+        self.glyphs_measured = len(glyphs)
+        size = sum(column.itemsize * len(column) for column in
+                   (display_list.xs, display_list.ys, display_list.glyph_ids))
+        size += self.glyph_bytes + sys.getsizeof(glyphs) + sys.getsizeof(display_list.glyph_index)
+        if not self.document.complete:
+            # The paragraphs still to be laid out
+            size += self.text_bytes
+        return size
+
+
+class History:
+    """
+    The back/forward list of a Browser, with a bounded cache of pages.
+
+    Every entry but the current one counts against `budget_bytes`. Over
+    budget, layouts are dropped first, starting with the entry furthest
+    from the current one, as a layout can be recomputed from the text
+    without the network; texts go after that, in the same order.
+    """
+    def __init__(self, budget_bytes=HISTORY_BUDGET_BYTES, max_entries=HISTORY_MAX_ENTRIES):
+        """
+        Initialize an empty history.
+
+        Args:
+            budget_bytes (int): The memory allowed for cached pages.
+            max_entries (int): The longest history kept.
+        """
+        self.budget_bytes = budget_bytes
+        self.max_entries = max_entries
+        self.entries = []
+        self.index = -1
+        self.restored = 0
+        self.relaid = 0
+        self.refetched = 0
+        self.layouts_evicted = 0
+        self.texts_evicted = 0
+
+    @property
+    def current(self):
+        return self.entries[self.index] if self.index >= 0 else None
+
+    def can_go(self, delta):
+        return 0 <= self.index + delta < len(self.entries)
+
+    def visit(self, entry):
+        """Add a newly loaded page after the current one, dropping the forward list."""
+        dropped = self.entries[self.index + 1:]
+        del self.entries[self.index + 1:]
+        self.entries.append(entry)
+        if len(self.entries) > self.max_entries:
+            dropped.extend(self.entries[:len(self.entries) - self.max_entries])
+            del self.entries[:len(self.entries) - self.max_entries]
+        self.index = len(self.entries) - 1
+        for old in dropped:
+            self.drop_text(old)
+        self.enforce_budget()
+
+    def drop_text(self, entry):
+        """Forget an entry's text and layout, unmapping a lazily read file."""
+        text, entry.text, entry.document = entry.text, None, None
+        if text is not None and not any(other.text is text for other in self.entries):
+            close_source(text)
+
+    def save(self, text, scroll, document):
+        """
+        Remember the scroll position and layout of the page being left.
+
+        Args:
+            text: The text on screen; nothing is saved unless it is the
+                  current entry's, e.g. after an error page was shown.
+            scroll (int): The scroll position.
+            document (DocumentLayout): The text's layout.
+        """
+        entry = self.current
+        if entry is None or entry.text is None or entry.text is not text:
+            return
+        entry.scroll = scroll
+        if document is not None:
+            entry.document = document
+
+    def go(self, delta):
+        """
+        Move back (-1) or forward (+1) through the history.
+
+        Returns:
+            HistoryEntry: The entry to show, or None at either end.
+        """
+        if not self.can_go(delta):
+            return None
+        self.index += delta
+        entry = self.current
+        if entry.text is None:
+            self.refetched += 1
+        elif entry.document is None:
+            self.relaid += 1
+        else:
+            self.restored += 1
+        self.enforce_budget()
+        return entry
+
+    @property
+    def cached_bytes(self):
+        return sum(entry.text_bytes + entry.layout_bytes
+                   for i, entry in enumerate(self.entries) if i != self.index)
+
+    def enforce_budget(self):
+        """Drop cached layouts, then texts, until the cache fits its budget."""
+        total = self.cached_bytes
+        if total <= self.budget_bytes:
+            return
+        furthest_first = sorted((i for i in range(len(self.entries)) if i != self.index),
+                                key=lambda i: -abs(i - self.index))
+        for kind in ("document", "text"):
+            for i in furthest_first:
+                if total <= self.budget_bytes:
+                    return
+                entry = self.entries[i]
+                if getattr(entry, kind) is None:
+                    continue
+                before = entry.text_bytes + entry.layout_bytes
+                if kind == "document":
+                    entry.document = None
+                    self.layouts_evicted += 1
+                else:
+                    self.drop_text(entry)
+                    self.texts_evicted += 1
+                total -= before - (entry.text_bytes + entry.layout_bytes)
+
+    def stats(self):
+        """Return how history navigations were served and what was evicted."""
+        navigations = self.restored + self.relaid + self.refetched
+        return {
+            "entries": len(self.entries),
+            "cached_bytes": self.cached_bytes,
+            "restored": self.restored,
+            "relaid": self.relaid,
+            "refetched": self.refetched,
+            "hit_rate": (self.restored + self.relaid) / navigations if navigations else 0.0,
+            "layouts_evicted": self.layouts_evicted,
+            "texts_evicted": self.texts_evicted,
+        }
@@ -0,0 +1,338 @@
+from collections import OrderedDict
+from display_list import DisplayList
+from emoji_store import emoji_trie
+from timing import phase
+
+HSTEP, VSTEP = 13, 18
+# Extra height laid out below the viewport so small scrolls need no layout
+LAYOUT_MARGIN = 600
+
+
+def split_paragraphs(text):
+    """
+    Split text at the newlines that start a new paragraph.
+
+    A newline inside an emoji :CODE: is part of the code rather than a
+    paragraph break, so lines are joined back together while an odd
+    number of colons has been seen.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        list: The paragraphs, without their separating newlines.
+    """
+    paragraphs = []
+    pending = None
+    for line in text.split("\n"):
+        if pending is not None:
+            line = pending + "\n" + line
+        if line.count(":") % 2:
+            pending = line
+        else:
+            pending = None
+            paragraphs.append(line)
+    if pending is not None:
+        paragraphs.append(pending)
+    return paragraphs
+
+
+def iter_paragraphs(pieces):
+    """
+    Split text that arrives in pieces the way split_paragraphs splits it
+    whole, yielding each paragraph once the piece ending it is read.
+
+    Args:
+        pieces (iterable): Consecutive pieces of the text.
+
+    Yields:
+        str: The paragraphs, without their separating newlines.
+    """
+    pending = None
+    # The unfinished last line, kept as pieces so a long line is joined once
+    partial = []
+    for piece in pieces:
+        partial.append(piece)
+        if "\n" not in piece:
+            continue
+        lines = "".join(partial).split("\n")
+        partial = [lines.pop()]
+        for line in lines:
+            if pending is not None:
+                line = pending + "\n" + line
+            if line.count(":") % 2:
+                pending = line
+            else:
+                pending = None
+                yield line
+    line = "".join(partial)
+    yield line if pending is None else pending + "\n" + line
+
+
+class FontMetrics:
+    """
+    Memoized glyph widths for one font.
+
+    Font.measure is a Tcl round trip, so each character is measured once
+    and its width remembered. Without a font every character is HSTEP
+    wide, which is also what layout uses when no display is available.
+    """
+    def __init__(self, font=None):
+        """
+        Initialize the width cache.
+
+        Args:
+            font: A tkinter.font.Font, or None for fixed-width glyphs.
+        """
+        self.font = font
+        self.widths = {}
+
+    def measure(self, c):
+        """Return the width of a character, measuring it on first use."""
+        width = self.widths[c] = self.font.measure(c) if self.font is not None else HSTEP
+        return width
+
+
+def layout_paragraph(text, WIDTH, emoji_mapping, display_list, metrics=None):
+    """
+    Lay out one paragraph with its first line at y = 0.
+
+    Consecutive characters on a line are emitted as a single text run at
+    the x of its first character. Emoji are found in one forward pass:
+    at each character that can start one, the longest sequence in the
+    mapping's trie becomes a single image entry, as does each :CODE:.
+
+    Args:
+        text (str): The paragraph text.
+        WIDTH (int): The width to wrap lines at.
+        emoji_mapping (dict): Emoji codes and characters mapped to glyphs;
+                              an EmojiMapping also matches sequences.
+        display_list (DisplayList): Where to append the entries.
+        metrics (FontMetrics): The widths of the glyphs; fixed if None.
+
+    Returns:
+        tuple: (height, needed_width). height is the y of the last line;
+               needed_width is None if a line wrapped, otherwise the
+               smallest width at which no line would wrap.
+    """
+    if metrics is None:
+        metrics = FontMetrics()
+    widths = metrics.widths
+    trie = emoji_trie(emoji_mapping)
+    starts = trie.root
+    cursor_x, cursor_y = HSTEP, 0
+    widest = 0
+    wrapped = False
+    # Start index and x of the text run being collected
+    run_start = None
+    run_x = 0
+    # Characters before this index were consumed by a code or a sequence
+    skip = 0
+
+    for i, c in enumerate(text):
+        if i < skip:
+            continue
+        if c == ":":
+            if run_start is not None:
+                display_list.append(run_x, cursor_y, text[run_start:i])
+                run_start = None
+            # Everything up to the closing colon is the code
+            close = text.find(":", i + 1)
+            if close < 0:
+                break
+            code = text[i + 1:close]
+            skip = close + 1
+            if code in emoji_mapping:
+                cursor_x+= 31
+                display_list.append(cursor_x, cursor_y, emoji_mapping[code])
+                cursor_x += 31  # Adjust for emoji size
+            # else:
+            #     display_list.append((cursor_x, cursor_y, ":" + code + ":"))
+            #     cursor_x += HSTEP
+            continue
+        if c == '\n':
+            if run_start is not None:
+                display_list.append(run_x, cursor_y, text[run_start:i])
+                run_start = None
+            cursor_y += VSTEP * 2  # Increment by more than VSTEP for paragraph breaks
+            cursor_x = HSTEP
+            continue
+        if c in starts:
+            # The longest emoji sequence starting here becomes one image
+            match = trie.match(text, i)
+            if match is not None:
+                if run_start is not None:
+                    display_list.append(run_x, cursor_y, text[run_start:i])
+                    run_start = None
+                skip, glyph = match
+                display_list.append(cursor_x, cursor_y, glyph)
+                cursor_x += 16  # Adjust for emoji size
+                continue
+        if run_start is None:
+            run_start, run_x = i, cursor_x
+        width = widths.get(c)
+        cursor_x += width if width is not None else metrics.measure(c)
+        if cursor_x >= WIDTH - HSTEP:
+            display_list.append(run_x, cursor_y, text[run_start:i + 1])
+            run_start = None
+            cursor_y += VSTEP
+            cursor_x = HSTEP
+            wrapped = True
+        elif cursor_x > widest:
+            widest = cursor_x
+
+    if run_start is not None:
+        display_list.append(run_x, cursor_y, text[run_start:])
+    return cursor_y, None if wrapped else widest + HSTEP + 1
+
+
+class LayoutCache:
+    """
+    Paragraph layouts keyed on their text and width, with LRU eviction
+    once the cached entries exceed `max_glyphs`.
+
+    A paragraph that did not wrap is stored once with the smallest width
+    it fits in and reused at any width at least that large; a paragraph
+    that wrapped is only reused at the exact same width. Each cached
+    layout has its own glyph table, so an evicted one takes its glyphs
+    with it; a document copying it in renumbers them into the document's
+    table. A cache must only be used with one emoji mapping, and measures
+    glyphs with its own `metrics`.
+    """
+    def __init__(self, max_glyphs=2000000, metrics=None):
+        self.max_glyphs = max_glyphs
+        self.metrics = metrics if metrics is not None else FontMetrics()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text, width):
+        """
+        Return a cached paragraph layout usable at this width.
+
+        Returns:
+            tuple: (display_list, height), or None on a miss.
+        """
+        entry = self.entries.get((text, None))
+        if entry is not None and entry[2] <= width:
+            self.entries.move_to_end((text, None))
+            self.hits += 1
+            return entry[0], entry[1]
+        entry = self.entries.get((text, width))
+        if entry is not None:
+            self.entries.move_to_end((text, width))
+            self.hits += 1
+            return entry[0], entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, text, width, display_list, height, needed_width):
+        """Store a paragraph layout produced by layout_paragraph."""
+        key = (text, None) if needed_width is not None else (text, width)
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old[0])
+        self.entries[key] = (display_list, height, needed_width)
+        self.size += len(display_list)
+        while self.size > self.max_glyphs and self.entries:
+            _, (evicted, _, _) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def layout(self, text, width, emoji_mapping):
+        """
+        Lay out a paragraph, reusing a cached layout when possible.
+
+        Returns:
+            tuple: (display_list, height) with the first line at y = 0.
+        """
+        cached = self.get(text, width)
+        if cached is not None:
+            return cached
+        display_list = DisplayList()
+        height, needed_width = layout_paragraph(text, width, emoji_mapping, display_list,
+                                                self.metrics)
+        if text:
+            self.put(text, width, display_list, height, needed_width)
+        return display_list, height
+
+
+class DocumentLayout:
+    """
+    The layout of a whole text, computed a paragraph at a time on demand.
+
+    Only the paragraphs needed to fill the area being shown are laid out;
+    ensure() extends the display list further down as the user scrolls.
+    The text may also be an iterable of pieces, such as the windows of a
+    huge file, which is then only read as far as the layout has got.
+    """
+    def __init__(self, text, WIDTH, emoji_mapping=None, cache=None, metrics=None):
+        """
+        Prepare a lazy layout.
+
+        Args:
+            text (str or iterable): The text to layout, or its pieces.
+            WIDTH (int): The width to wrap lines at.
+            emoji_mapping (dict): Emoji characters and codes mapped to images.
+            cache (LayoutCache): Paragraph layouts to reuse, if any.
+            metrics (FontMetrics): Glyph widths, when no cache is given.
+        """
+        paragraphs = split_paragraphs(text) if isinstance(text, str) else iter_paragraphs(text)
+        self.paragraphs = iter(paragraphs)
+        # The next paragraph to lay out, or None once the text is used up
+        self.upcoming = next(self.paragraphs, None)
+        self.width = WIDTH
+        self.emoji_mapping = emoji_mapping if emoji_mapping is not None else {}
+        self.cache = cache if cache is not None else LayoutCache(max_glyphs=0, metrics=metrics)
+        # The document's own glyph table lives and dies with it
+        self.display_list = DisplayList()
+        self.next_paragraph = 0
+        self.cursor_y = VSTEP
+
+    @property
+    def complete(self):
+        return self.upcoming is None
+
+    def ensure(self, bottom):
+        """
+        Lay out paragraphs until the display list reaches `bottom`.
+
+        Args:
+            bottom (int): The y position that must be laid out.
+
+        Returns:
+            DisplayList: The display list laid out so far.
+        """
+        if self.complete or self.cursor_y > bottom:
+            return self.display_list
+        with phase("layout"):
+            while not self.complete and self.cursor_y <= bottom:
+                if self.next_paragraph:
+                    self.cursor_y += VSTEP * 2  # Increment by more than VSTEP for paragraph breaks
+                paragraph = self.upcoming
+                self.upcoming = next(self.paragraphs, None)
+                display_list, height = self.cache.layout(paragraph, self.width, self.emoji_mapping)
+                self.display_list.extend(display_list, self.cursor_y)
+                self.cursor_y += height
+                self.next_paragraph += 1
+        return self.display_list
+
+    def finish(self):
+        """Lay out every remaining paragraph and return the display list."""
+        return self.ensure(float("inf"))
+
+
+def layout(text, WIDTH, HEIGHT,emoji_mapping = {}, metrics=None):
+    """
+    Arrange the text into a list of positions and text runs,
+    handling newline characters to create paragraph breaks.
+
+    Args:
+        text (str): The text to layout.
+        metrics (FontMetrics): Glyph widths; every glyph is HSTEP if None.
+
+    Returns:
+        DisplayList: The (x, y, run) entries giving the start
+                     position of each run of text or emoji image.
+    """
+    return DocumentLayout(text, WIDTH, emoji_mapping, metrics=metrics).finish()
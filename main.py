@@ -1,63 +1,27 @@
 import sys
 from url import URL
-from utils import lex
-import tkinter
+from utils import lex, LexedText
+from parallel import lex_document
+from layout import layout, DocumentLayout, LayoutCache, FontMetrics, HSTEP, VSTEP, LAYOUT_MARGIN
+from viewport import CanvasViewport
+from emoji_store import EmojiStore, EMOJI_DIR
+from timing import phase, recording, finish_navigation
+from navigator import Navigator, Navigation
+from headless import print_source
+from prefetch import Prefetcher, PREFETCH_LINKS
+from history import History, HistoryEntry
+try:
+    import tkinter
+    import tkinter.font
+except ImportError:
+    # Only the headless mode works without Tk
+    tkinter = None
 WIDTH, HEIGHT = 800, 600
-HSTEP, VSTEP = 13, 18
 SCROLL_STEP = 100
-def layout(text, WIDTH, HEIGHT,emoji_mapping = {}):
-    """
-    Arrange the text into a list of positions and characters,
-    handling newline characters to create paragraph breaks.
-    
-    Args:
-        text (str): The text to layout.
-    
-    Returns:
-        list: A list of tuples (x, y, character) representing 
-              each character's position.
-    """
-    display_list = []
-    cursor_x, cursor_y = HSTEP, VSTEP + 50
-
-    cursor_x, cursor_y = HSTEP, VSTEP
-    buffer = ""
-    in_code = False
-
-    for c in text:
-        if c == ":":
-            if in_code:
-                # Process code
-                code = buffer
-
-                buffer = ""
-                in_code = False
-                if code in emoji_mapping:
-                    cursor_x+= 31
-                    display_list.append((cursor_x, cursor_y, emoji_mapping[code]))
-                    cursor_x += 31  # Adjust for emoji size
-                # else:
-                #     display_list.append((cursor_x, cursor_y, ":" + code + ":"))
-                #     cursor_x += HSTEP
-            else:
-                in_code = True
-        elif in_code:
-            buffer += c
-
-        elif c == '\n':
-            cursor_y += VSTEP * 2  # Increment by more than VSTEP for paragraph breaks
-            cursor_x = HSTEP
-        elif c in emoji_mapping:
-            display_list.append((cursor_x, cursor_y, emoji_mapping[c]))
-            cursor_x += 16  # Adjust for emoji size
-        else:
-            display_list.append((cursor_x, cursor_y, c))
-            cursor_x += HSTEP
-            if cursor_x >= WIDTH - HSTEP:
-                cursor_y += VSTEP
-                cursor_x = HSTEP
-    
-    return display_list
+# Resize events arriving closer together than this are coalesced
+RESIZE_DELAY_MS = 100
+# How often a running navigation is checked for its result
+NAVIGATION_POLL_MS = 50
 class Browser:
     def __init__(self):
         
@@ -69,7 +33,8 @@ class Browser:
         self.url_frame = tkinter.Frame(self.window)
         self.url_frame.pack(side=tkinter.TOP, fill=tkinter.X)
         
-        self.title_label = tkinter.Label(self.url_frame, text="Page Title")
+        self.title = "Page Title"
+        self.title_label = tkinter.Label(self.url_frame, text=self.title)
         self.title_label.pack(side=tkinter.TOP, fill=tkinter.X)
         
         self.url_entry = tkinter.Entry(self.url_frame)
@@ -92,7 +57,25 @@ class Browser:
         )
         self.canvas.pack(side=tkinter.LEFT, fill=tkinter.BOTH, expand=True)
         self.window.bind("<Configure>", self.on_resize)
+        self.resize_job = None
+        self.pending_size = None
+        # Text runs are measured and drawn in the canvas's default font
+        self.font = tkinter.font.nametofont("TkDefaultFont")
+        self.layout_cache = LayoutCache(metrics=FontMetrics(self.font))
+        self.document = None
+        self.emoji_store = EmojiStore(EMOJI_DIR, lambda path: tkinter.PhotoImage(file=path))
+        self.viewport = CanvasViewport(self.canvas, self.font, self.emoji_store)
         self.scrollbar_rect = None
+        self.navigator = Navigator()
+        self.navigation_job = None
+        # Off unless CREATOR_PREFETCH_LINKS is set
+        self.prefetcher = Prefetcher(PREFETCH_LINKS) if PREFETCH_LINKS else None
+        # Back/forward list, caching the text and layout of visited pages
+        self.history = History()
+        # The timing of the last load, shown on demand with F2
+        self.timing = None
+        self.show_timing = False
+        self.timing_overlay = None
         self.max_scroll = 0
         self.scroll = 0
         self.window.bind("<Down>", self.scrolldown)
@@ -100,9 +83,13 @@ class Browser:
         self.window.bind("<MouseWheel>", self.on_mousewheel)
         self.window.bind("<Button-4>", self.on_mousewheel_linux)
         self.window.bind("<Button-5>", self.on_mousewheel_linux)
+        self.window.bind("<F2>", self.toggle_timing_overlay)
+        self.window.bind("<Alt-Left>", self.go_back)
+        self.window.bind("<Alt-Right>", self.go_forward)
         self.window.iconbitmap("Assets\window_icon.ico")
-        # self.load_emoji_images()
         self.emoji_mapping = self.create_emoji_mapping()
+        self.text = ""
+        self.relayout(WIDTH - 20)
     def scroll_canvas(self, *args):
         self.canvas.yview(*args)
         self.scroll = int(self.canvas.canvasy(0))
@@ -113,12 +100,14 @@ class Browser:
     def scrollup(self, e=None):
         self.scroll = max(0, self.scroll - SCROLL_STEP)
         self.update_scroll()
+    def ensure_layout(self):
+        """Lay out enough of the document to cover the viewport."""
+        if self.document is not None:
+            self.document.ensure(self.scroll + self.canvas.winfo_height() + SCROLL_STEP + LAYOUT_MARGIN)
     def update_scroll(self):
+        self.ensure_layout()
         # Calculate maximum scroll based on the height of the document
-        try:
-            self.max_scroll = max(1, max(y for _, y, _ in self.display_list) - self.canvas.winfo_height())
-        except ValueError:
-            self.max_scroll = 1
+        self.max_scroll = max(1, self.display_list.max_y - self.canvas.winfo_height())
         # Ensure we do not scroll past the last entry
         self.scroll = min(self.scroll, self.max_scroll)
         self.canvas.yview_moveto(self.scroll / self.max_scroll)
@@ -139,96 +128,299 @@ class Browser:
         Handle the window resize event by adjusting the layout
         of the content to fit the new window size.
         
+        Tk sends many <Configure> events during a drag-resize, so the
+        relayout is postponed until they stop for RESIZE_DELAY_MS.
+        
         Args:
             event: The event object containing the new width and height.
         """
-        # self.canvas.config(width=event.width - 20, height=event.height - 100)
-        self.display_list = layout(self.text, event.width - 20, event.height - 100 , self.emoji_mapping)
-        # try:
-        #     self.max_scroll = max(0, max(y for _, y, _ in self.display_list) - self.canvas.winfo_height())
-        # except ValueError:
-        #     self.max_scroll = 1
+        if event.widget is not self.window:
+            return
+        self.pending_size = (event.width, event.height)
+        if self.resize_job is not None:
+            self.window.after_cancel(self.resize_job)
+        self.resize_job = self.window.after(RESIZE_DELAY_MS, self.apply_resize)
+    def apply_resize(self):
+        """Relayout for the last window size seen by on_resize."""
+        self.resize_job = None
+        width, height = self.pending_size
+        # self.canvas.config(width=width - 20, height=height - 100)
+        if self.document is None or self.document.width != width - 20:
+            self.relayout(width - 20)
         self.update_scroll()
+    def relayout(self, width):
+        """Start a lazy layout of the current text at the given width."""
+        self.document = DocumentLayout(self.text, width, self.emoji_mapping, self.layout_cache)
+        self.display_list = self.document.display_list
     def draw(self):
-        self.canvas.delete("all")
         canvas_width = self.canvas.winfo_width()
         canvas_height = self.canvas.winfo_height()
-        for x, y, c in self.display_list:
-            if y > self.scroll + self.window.winfo_height(): continue
-            if y + VSTEP < self.scroll: continue
-            # self.canvas.create_text(x, y - self.scroll, text=c)
-            if isinstance(c, str):
-                self.canvas.create_text(x, y - self.scroll, text=c)
-            else:
-                self.canvas.create_image(x, y - self.scroll, image=c)
+        # Only the visible rows are touched; their canvas items are reused
+        self.viewport.draw(self.display_list, self.scroll, self.window.winfo_height())
         # Draw the scrollbar
         if self.max_scroll > canvas_height:
             scrollbar_height = (canvas_height / self.max_scroll) * canvas_height
             scrollbar_y = (self.scroll / self.max_scroll) * (canvas_height - scrollbar_height)
             
             if self.scrollbar_rect:
-                self.canvas.delete(self.scrollbar_rect)
-            
-            self.scrollbar_rect = self.canvas.create_rectangle(
-                canvas_width - 10, scrollbar_y,
-                canvas_width, scrollbar_y + scrollbar_height,
-                fill="blue", outline="blue"
-                )
+                self.canvas.coords(self.scrollbar_rect,
+                                   canvas_width - 10, scrollbar_y,
+                                   canvas_width, scrollbar_y + scrollbar_height)
+                self.canvas.itemconfigure(self.scrollbar_rect, state="normal")
+            else:
+                self.scrollbar_rect = self.canvas.create_rectangle(
+                    canvas_width - 10, scrollbar_y,
+                    canvas_width, scrollbar_y + scrollbar_height,
+                    fill="blue", outline="blue"
+                    )
+        elif self.scrollbar_rect:
+            self.canvas.itemconfigure(self.scrollbar_rect, state="hidden")
     def load_url(self, event=None):
         url = self.url_entry.get()
-        self.load(URL(url))
+        self.navigate(URL(url))
+    def navigate(self, url):
+        """
+        Load a page without blocking the window.
+        
+        The fetch and lex run on a worker thread and the result is shown
+        once poll_navigation picks it up; starting another navigation
+        cancels this one.
+        
+        Args:
+            url (URL): The URL object to load content from.
+        
+        Returns:
+            Navigation: The navigation started.
+        """
+        self.show_loading(url)
+        if self.prefetcher is not None:
+            self.prefetcher.record_navigation(url.url)
+        navigation = self.navigator.start(url, self.fetch_page, self.show_page, self.show_error)
+        if self.navigation_job is None:
+            self.navigation_job = self.window.after(NAVIGATION_POLL_MS, self.poll_navigation)
+        return navigation
+    def poll_navigation(self):
+        """Show finished navigations; keep polling while one is running."""
+        self.navigation_job = None
+        if self.navigator.poll():
+            self.navigation_job = self.window.after(NAVIGATION_POLL_MS, self.poll_navigation)
     def load(self,url):
         """
-        Load the content from the given URL and display it.
+        Load the content from the given URL and display it, blocking
+        until the page is shown.
         
         Args:
             url (URL): The URL object to load content from.
+        
+        Returns:
+            LoadTiming: The time spent in each phase of the load.
         """
+        self.navigator.cancel()
+        navigation = Navigation(url)
+        self.show_loading(url)
+        if self.prefetcher is not None:
+            self.prefetcher.record_navigation(url.url)
         try:
-            self.url_entry.delete(0, tkinter.END)
-            self.url_entry.insert(0, url.scheme +"://" + url.host +  url.path)
-            self.body = url.request()
-            if url.view_source:
-                print(self.body)  # Print the raw HTML source
+            result = self.fetch_page(navigation)
+        except Exception as e:
+            return self.show_error(navigation, e)
+        return self.show_page(navigation, result)
+    def fetch_page(self, navigation):
+        """
+        Fetch and lex a page. This may run on a worker thread, so it must
+        not touch Tk.
+        
+        Args:
+            navigation (Navigation): The load to run.
+        
+        Returns:
+            tuple: (body, text); text is None for view-source URLs. Both
+                   are lazy, re-iterable pieces for very large files.
+        """
+        url = navigation.url
+        view_source = getattr(url, "view_source", False)
+        with recording(navigation.timing):
+            if getattr(url, "scheme", None) in ("http", "https"):
+                # Stream the body so a cancelled load stops downloading
+                # The stream times its own phases, from dns to decode
+                pieces = []
+                for piece in url.stream():
+                    navigation.check()
+                    pieces.append(piece)
+                body = "".join(pieces)
             else:
-                self.text = lex(self.body)
-            
-            self.display_list = layout(self.text, self.window.winfo_width(), self.window.winfo_height(), self.emoji_mapping)
+                body = url.source()
+            navigation.check()
+            if view_source:
+                text = None
+            elif isinstance(body, str):
+                text = lex_document(body)
+            else:
+                # Lexed as layout reads it, while the user scrolls
+                text = LexedText(body)
+        return body, text
+    def show_page(self, navigation, result):
+        """Lay out and draw a fetched page. Runs on the Tk thread."""
+        body, text = result
+        # Set when a history entry whose text was evicted is loaded again
+        entry = getattr(navigation, "history_entry", None)
+        if entry is None:
+            self.history.save(self.text, self.scroll, self.document)
+        with recording(navigation.timing):
+            self.body = body
+            if text is None:
+                print_source(self.body)
+                if not isinstance(self.body, str):
+                    # Only a page's text keeps its file mapped
+                    self.body.close()
+            else:
+                self.text = text
             
-        except Exception as e:
+            self.relayout(self.window.winfo_width())
+            if entry is None:
+                self.scroll = 0
+                self.history.visit(HistoryEntry(navigation.url, self.text, self.document))
+            else:
+                entry.text, entry.document = self.text, self.document
+                self.scroll = entry.scroll
+            # Lay out the first screen first so first_draw is drawing only
+            self.ensure_layout()
+            with phase("first_draw"):
+                self.update_scroll()
+        if self.prefetcher is not None and isinstance(body, str) \
+                and getattr(navigation.url, "scheme", None) in ("http", "https"):
+            self.prefetcher.start(navigation.url.url, body)
+        return self.finish_loading(navigation)
+    def go_back(self, e=None):
+        """Show the previous page of the history."""
+        return self.traverse(-1)
+    def go_forward(self, e=None):
+        """Show the next page of the history."""
+        return self.traverse(1)
+    def traverse(self, delta):
+        """
+        Move through the history by `delta` pages.
+        
+        A page still in the back/forward cache is shown as it was left,
+        without fetching, lexing or laying it out again, unless its layout
+        was evicted or the window width has changed since. A page whose
+        text was evicted is loaded again.
+        
+        Returns:
+            LoadTiming: The timing of a page shown from the cache, else None.
+        """
+        if not self.history.can_go(delta):
+            return None
+        self.navigator.cancel()
+        self.history.save(self.text, self.scroll, self.document)
+        entry = self.history.go(delta)
+        if entry.text is None:
+            navigation = self.navigate(entry.url)
+            navigation.history_entry = entry
+            return None
+        return self.restore(entry)
+    def restore(self, entry):
+        """Show a page from the back/forward cache. Runs on the Tk thread."""
+        navigation = Navigation(entry.url)
+        self.show_loading(entry.url)
+        with recording(navigation.timing):
+            self.text = entry.text
+            width = self.document.width if self.document is not None else self.window.winfo_width()
+            if entry.document is not None and entry.document.width == width:
+                self.document = entry.document
+                self.display_list = self.document.display_list
+            else:
+                self.relayout(width)
+                entry.document = self.document
+            self.scroll = entry.scroll
+            self.ensure_layout()
+            with phase("first_draw"):
+                self.update_scroll()
+        return self.finish_loading(navigation)
+    def show_error(self, navigation, e):
+        """Show about:blank after a failed load. Runs on the Tk thread."""
+        with recording(navigation.timing):
             # Log the exception (optional)
             print(f"Error loading URL: {e}")
             # Fallback to about:blank
+            self.url_entry.delete(0, tkinter.END)
             self.url_entry.insert(0, "about:blank")
             self.text = ""
-            self.display_list = layout(self.text, self.canvas.winfo_width(), self.canvas.winfo_height(), self.emoji_mapping) 
-        self.update_scroll()       
-    def load_emoji_images(self):
-        """
-        Load all emoji images from the 'emojis' directory into a dictionary.
-        """
-        self.emoji_images = {}
-        import os
-        emoji_dir = "Assets/emojis"
-        for file in os.listdir(emoji_dir):
-            if file.endswith(".png"):
-                name = os.path.splitext(file)[0]
-                self.emoji_images[name] = tkinter.PhotoImage(file=os.path.join(emoji_dir, file))
+            self.relayout(self.canvas.winfo_width())
+            self.update_scroll()
+        return self.finish_loading(navigation)
+    def show_loading(self, url):
+        """Show the URL being loaded and the loading indicator."""
+        self.url_entry.delete(0, tkinter.END)
+        self.url_entry.insert(0, url.url)
+        self.title_label.config(text=f"Loading {url.url}...")
+    def finish_loading(self, navigation):
+        """Clear the loading indicator and record the load's timing."""
+        self.title_label.config(text=self.title)
+        finish_navigation(navigation.timing)
+        self.timing = navigation.timing
+        self.draw_timing_overlay()
+        return self.timing
+    def toggle_timing_overlay(self, e=None):
+        """Show or hide the timing breakdown of the last load."""
+        self.show_timing = not self.show_timing
+        self.draw_timing_overlay()
+    def draw_timing_overlay(self):
+        """Draw the last load's timing breakdown in the top right corner."""
+        if not self.show_timing or self.timing is None:
+            if self.timing_overlay:
+                self.canvas.itemconfigure(self.timing_overlay, state="hidden")
+            return
+        x = self.canvas.winfo_width() - 15
+        if self.timing_overlay:
+            self.canvas.coords(self.timing_overlay, x, 5)
+            self.canvas.itemconfigure(self.timing_overlay, text=self.timing.format(), state="normal")
+        else:
+            self.timing_overlay = self.canvas.create_text(
+                x, 5, text=self.timing.format(), anchor="ne",
+                font=("Courier", 9), fill="gray30")
+        self.canvas.tag_raise(self.timing_overlay)
     def create_emoji_mapping(self):
         """
-        Create a mapping of emoji characters to their corresponding image filenames.
+        Create a mapping of emoji characters and codes to their glyphs.
+
+        Every image in Assets/emojis is indexed up front, but an image is
+        only decoded the first time it is drawn.
         """
-        # Example mapping; update with actual file names
-        return {
-            "1F600": tkinter.PhotoImage(file="Assets/emojis/1F600.png"),
-            # other emojis as needed
-        }
+        return self.emoji_store.mapping
+def show(body):
+    """
+    Print the text content of a page, without its markup.
+
+    Args:
+        body (str): The page source.
+    """
+    print(lex(body), end="")
+def load(url):
+    """
+    Print a page without opening a window: its source for a view-source:
+    URL, otherwise its text content.
+
+    Args:
+        url (URL): The page to load.
+    """
+    body = url.request()
+    if getattr(url, "view_source", False):
+        print(body, end="")
+    else:
+        show(body)
 if __name__ == "__main__":
+    if "--headless" in sys.argv[1:]:
+        import headless
+        sys.exit(headless.main([arg for arg in sys.argv[1:] if arg != "--headless"]))
+    if tkinter is None:
+        print("tkinter is not available; run with --headless instead")
+        sys.exit(1)
     if len(sys.argv) > 1:
-        Browser().load(URL(sys.argv[1]))
+        Browser().navigate(URL(sys.argv[1]))
         tkinter.mainloop()
     else:
         # Default file path for quick testing
 
-        Browser().load(URL(""))
-        tkinter.mainloop()
+        Browser().navigate(URL(""))
+        tkinter.mainloop()
\ No newline at end of file
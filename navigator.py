@@ -0,0 +1,141 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from connection_pool import tracking
+from timing import LoadTiming
+
+
+class NavigationCancelled(Exception):
+    """Raised inside a navigation's work once a newer one has started."""
+
+
+class Navigation:
+    """
+    One page load: its URL, timing and cancellation flag.
+
+    While its work runs on a Navigator, the pooled connections it holds
+    are tracked, so that cancelling aborts them instead of leaving the
+    worker blocked on a server that never answers.
+    """
+    def __init__(self, url):
+        """
+        Args:
+            url (URL): The page being loaded.
+        """
+        self.url = url
+        self.timing = LoadTiming(url.url)
+        self.cancelled = threading.Event()
+        self.connections = set()
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        """Ask the work to stop at its next check(), aborting its connections."""
+        with self.lock:
+            self.cancelled.set()
+            connections = list(self.connections)
+        for conn in connections:
+            conn.abort()
+
+    def add(self, conn):
+        """Track a connection acquired by the work; see connection_pool.tracking."""
+        with self.lock:
+            if not self.cancelled.is_set():
+                self.connections.add(conn)
+                return
+        conn.abort()
+
+    def discard(self, conn):
+        """Stop tracking a connection that was released."""
+        with self.lock:
+            self.connections.discard(conn)
+
+    def check(self):
+        """Raise NavigationCancelled if the navigation was cancelled."""
+        if self.cancelled.is_set():
+            raise NavigationCancelled(self.url.url)
+
+
+class Navigator:
+    """
+    Run the blocking part of page loads on worker threads.
+
+    Starting a navigation cancels the previous one. Worker results are
+    queued and only handed to their callbacks by poll(), which the UI
+    calls from its own thread (e.g. via window.after), so callbacks can
+    touch Tk widgets safely. Results of cancelled navigations are dropped.
+    """
+    def __init__(self, max_workers=2):
+        """
+        Initialize a navigator.
+
+        Args:
+            max_workers (int): How many loads may run at once; a cancelled
+                               load keeps its worker until it next checks
+                               or its aborted connection fails.
+        """
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="navigation")
+        self.results = queue.Queue()
+        self.current = None
+
+    @property
+    def busy(self):
+        """True while a navigation's result has not been delivered."""
+        return self.current is not None
+
+    def start(self, url, work, on_done, on_error):
+        """
+        Start loading a page, cancelling any load in progress.
+
+        Args:
+            url (URL): The page to load.
+            work (callable): work(navigation) runs on a worker thread and
+                             returns the result; it should call
+                             navigation.check() between steps.
+            on_done (callable): on_done(navigation, result), run by poll().
+            on_error (callable): on_error(navigation, exception), run by poll().
+
+        Returns:
+            Navigation: The new navigation.
+        """
+        self.cancel()
+        navigation = self.current = Navigation(url)
+
+        def run():
+            try:
+                with tracking(navigation):
+                    result = work(navigation)
+            except NavigationCancelled:
+                return
+            except Exception as e:
+                self.results.put((navigation, on_error, e))
+            else:
+                self.results.put((navigation, on_done, result))
+        self.executor.submit(run)
+        return navigation
+
+    def cancel(self):
+        """Cancel the navigation in progress, if any."""
+        if self.current is not None:
+            self.current.cancel()
+            self.current = None
+
+    def poll(self):
+        """
+        Deliver finished results to their callbacks on the calling thread.
+
+        Returns:
+            bool: True if a navigation is still in progress.
+        """
+        while True:
+            try:
+                navigation, callback, value = self.results.get_nowait()
+            except queue.Empty:
+                return self.busy
+            if navigation is self.current and not navigation.cancelled.is_set():
+                self.current = None
+                callback(navigation, value)
+
+    def shutdown(self):
+        """Cancel any load and stop the worker threads."""
+        self.cancel()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,260 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from display_list import DisplayList
+from layout import LayoutCache, FontMetrics, VSTEP
+from timing import phase
+from utils import lex, split_markup, unescape_run
+
+# Documents at least this many characters long are lexed and laid out
+# across processes; below it the serial path is faster
+PARALLEL_MIN_CHARS = int(os.environ.get("CREATOR_PARALLEL_CHARS", 8 * 1024 * 1024))
+PARALLEL_WORKERS = int(os.environ.get("CREATOR_PARALLEL_WORKERS", "0")) or os.cpu_count() or 1
+# Characters after a lex chunk that its worker also scans, to check that
+# the chunk ends where the serial scan would have cut the body
+LEX_LOOKAHEAD = 64 * 1024
+
+pool = None
+pool_workers = 0
+pool_lock = threading.Lock()
+
+
+def get_pool(workers):
+    """
+    Return the shared process pool, starting it with `workers` processes
+    if it is not running with that many.
+
+    Workers are spawned rather than forked, as forking a process that runs
+    Tk or other threads is unsafe; the pool is kept so that only the first
+    parallel job pays for starting them.
+    """
+    global pool, pool_workers
+    with pool_lock:
+        if pool is None or pool_workers != workers:
+            if pool is not None:
+                pool.shutdown()
+            pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+            pool_workers = workers
+        return pool
+
+
+def shutdown_pool():
+    """Stop the worker processes, e.g. when the browser exits."""
+    global pool
+    with pool_lock:
+        if pool is not None:
+            pool.shutdown()
+            pool = None
+
+
+def find_tag_after(body, marker, start, end):
+    """
+    Find a tag opening right after `marker`, between `start` and `end`.
+
+    Returns:
+        int: The position of the tag's "<", or -1 if there is none.
+    """
+    while True:
+        pos = body.find(marker, start, end)
+        if pos < 0 or pos + 2 >= len(body):
+            return -1
+        if body[pos + 2].isalpha() or body[pos + 2] == "/":
+            return pos + 1
+        start = pos + 2
+
+
+def lex_boundaries(body, parts):
+    """
+    Choose where to cut a body into about `parts` pieces for lexing.
+
+    Cuts fall on a "<" that starts a tag at the beginning of a line, the
+    first one after each even share of the body. Where no line starts in
+    the share that follows, as in minified HTML, a tag that directly
+    follows another tag's ">" is cut at instead.
+
+    Returns:
+        list: Increasing cut positions, not including 0 and len(body).
+    """
+    cuts = []
+    share = max(len(body) // parts, 1)
+    for k in range(1, parts):
+        pos = max(len(body) * k // parts, cuts[-1] if cuts else 0)
+        cut = find_tag_after(body, "\n<", pos, pos + share)
+        if cut < 0:
+            cut = find_tag_after(body, "><", pos, pos + share)
+        if cut > 0:
+            cuts.append(cut)
+    return cuts
+
+
+def lex_chunk(chunk, lookahead):
+    """
+    Lex one chunk of a body in a worker.
+
+    The chunk is scanned together with the text after it, and only lexed
+    if that scan cuts the markup exactly at the chunk's end, as the serial
+    scan of the whole body would.
+
+    Args:
+        chunk (str): The piece of the body.
+        lookahead (str): The text following it; empty for the last chunk.
+
+    Returns:
+        str: The chunk's text, or None if the cut falls inside markup.
+    """
+    if not lookahead:
+        return lex(chunk)
+    pieces = split_markup(chunk + lookahead)
+    pos = len(chunk) + len(lookahead)
+    end = len(pieces)
+    while pos > len(chunk):
+        end -= 1
+        pos -= len(pieces[end])
+    if pos != len(chunk):
+        return None
+    return "".join(map(unescape_run, pieces[0:end:2]))
+
+
+def lex_parallel(body, workers=None):
+    """
+    Lex a body in chunks across the process pool.
+
+    The result is the same as lex(body). A chunk whose end cannot be shown
+    to match the serial scan, such as one cut inside a comment or a
+    <script>, makes the whole body be lexed serially instead; only a tag
+    with a quoted value longer than LEX_LOOKAHEAD spanning a cut could
+    still be read differently.
+
+    Args:
+        body (str): The page source.
+        workers (int): How many processes to use; PARALLEL_WORKERS if None.
+
+    Returns:
+        str: The text content of the body.
+    """
+    workers = workers or PARALLEL_WORKERS
+    cuts = [0] + lex_boundaries(body, workers) + [len(body)]
+    if len(cuts) > 2:
+        with phase("lex"):
+            chunks = [body[start:end] for start, end in zip(cuts, cuts[1:])]
+            lookaheads = [body[end:end + LEX_LOOKAHEAD] for end in cuts[1:]]
+            texts = list(get_pool(workers).map(lex_chunk, chunks, lookaheads))
+        if None not in texts:
+            return "".join(texts)
+    # lex() times itself
+    return lex(body)
+
+
+def layout_chunk(paragraphs, width, emoji_mapping, widths, leading_gap):
+    """
+    Lay out consecutive paragraphs in a worker, as DocumentLayout.ensure does.
+
+    Args:
+        paragraphs (list): The paragraphs to lay out.
+        width (int): The width to wrap lines at.
+        emoji_mapping (dict): Emoji characters and codes mapped to glyphs.
+        widths (dict): The width of every character, or None for HSTEP.
+        leading_gap (bool): Whether a paragraph precedes the first one.
+
+    Returns:
+        tuple: The xs, ys and glyph_ids columns, the glyph table they
+               index, and the height the paragraphs take up, with y
+               relative to where the layout stood before them.
+    """
+    metrics = FontMetrics()
+    if widths:
+        metrics.widths.update(widths)
+    cache = LayoutCache(max_glyphs=0, metrics=metrics)
+    display_list = DisplayList()
+    cursor_y = 0
+    for i, paragraph in enumerate(paragraphs):
+        if i or leading_gap:
+            cursor_y += VSTEP * 2  # Increment by more than VSTEP for paragraph breaks
+        laid_out, height = cache.layout(paragraph, width, emoji_mapping)
+        display_list.extend(laid_out, cursor_y)
+        cursor_y += height
+    return display_list.xs, display_list.ys, display_list.glyph_ids, display_list.glyphs, cursor_y
+
+
+def split_evenly(paragraphs, parts):
+    """Group consecutive paragraphs into about `parts` groups of similar length."""
+    total = sum(map(len, paragraphs))
+    groups = []
+    group = []
+    size = 0
+    for paragraph in paragraphs:
+        group.append(paragraph)
+        size += len(paragraph)
+        if size >= total * (len(groups) + 1) / parts and len(groups) < parts - 1:
+            groups.append(group)
+            group = []
+    if group:
+        groups.append(group)
+    return groups
+
+
+def finish_parallel(document, workers=None):
+    """
+    Lay out the rest of a DocumentLayout across the process pool.
+
+    The paragraphs left are grouped into one chunk per worker, and each
+    chunk's entries are moved down by the height of everything above it
+    and their glyphs renumbered into the document's glyph table, so the
+    display list is the same as document.finish() would make.
+
+    Args:
+        document (DocumentLayout): The layout to complete.
+        workers (int): How many processes to use; PARALLEL_WORKERS if None.
+
+    Returns:
+        DisplayList: The document's complete display list.
+    """
+    workers = workers or PARALLEL_WORKERS
+    if document.complete:
+        return document.display_list
+    with phase("layout"):
+        paragraphs = [document.upcoming]
+        paragraphs.extend(document.paragraphs)
+        document.upcoming = None
+        metrics = document.cache.metrics
+        widths = None
+        if metrics.font is not None:
+            # Workers cannot reach the font, so measure every character here
+            chars = set()
+            for paragraph in paragraphs:
+                chars.update(paragraph)
+            for c in chars.difference(metrics.widths):
+                metrics.measure(c)
+            widths = metrics.widths
+        groups = split_evenly(paragraphs, workers)
+        gaps = [document.next_paragraph > 0] + [True] * (len(groups) - 1)
+        results = get_pool(workers).map(
+            layout_chunk, groups, [document.width] * len(groups),
+            [document.emoji_mapping] * len(groups), [widths] * len(groups), gaps)
+        display_list = document.display_list
+        for xs, ys, glyph_ids, glyphs, height in results:
+            chunk = DisplayList(glyphs)
+            chunk.xs, chunk.ys, chunk.glyph_ids = xs, ys, glyph_ids
+            chunk.max_y = ys[-1] if ys else 0
+            display_list.extend(chunk, document.cursor_y)
+            document.cursor_y += height
+        document.next_paragraph += len(paragraphs)
+    return display_list
+
+
+def lex_document(body):
+    """Lex a body, across processes if it is at least PARALLEL_MIN_CHARS long."""
+    if PARALLEL_WORKERS > 1 and len(body) >= PARALLEL_MIN_CHARS:
+        return lex_parallel(body)
+    return lex(body)
+
+
+def finish_document(document, size):
+    """
+    Complete a DocumentLayout, across processes if its text, `size`
+    characters long, is at least PARALLEL_MIN_CHARS.
+    """
+    if PARALLEL_WORKERS > 1 and size >= PARALLEL_MIN_CHARS:
+        return finish_parallel(document)
+    return document.finish()
@@ -0,0 +1,199 @@
+import asyncio
+import os
+import re
+import threading
+from html import unescape
+from urllib.parse import urljoin, urldefrag
+from async_request import AsyncFetcher, ResponseTooLarge
+from request import cache, cache_key, parse_url
+
+# Links prefetched after each page load; 0 turns prefetching off
+PREFETCH_LINKS = int(os.environ.get("CREATOR_PREFETCH_LINKS", "0"))
+# Seconds a prefetched response lacking its own freshness stays cached
+PREFETCH_LIFETIME = 300
+PREFETCH_CONCURRENCY = 2
+# The largest single response, and the most bytes fetched after one page
+PREFETCH_MAX_BYTES = 1024 * 1024
+PREFETCH_BUDGET_BYTES = 4 * 1024 * 1024
+
+HREF_RE = re.compile(r"""<a\s(?:[^>]*?\s)?href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""",
+                     re.IGNORECASE)
+
+
+def extract_links(body, base_url, limit=None):
+    """
+    Find the http(s) links of a page in document order.
+
+    Args:
+        body (str): The page's HTML.
+        base_url (str): The page's URL, to resolve relative links against.
+        limit (int): The most links to return.
+
+    Returns:
+        list: Absolute URLs without fragments, each once, leaving out
+              links back to the page itself.
+    """
+    page = urldefrag(base_url)[0]
+    links = []
+    seen = {page}
+    for match in HREF_RE.finditer(body):
+        href = unescape(next(group for group in match.groups() if group is not None).strip())
+        link = urldefrag(urljoin(base_url, href))[0]
+        if link in seen or not link.startswith(("http://", "https://")):
+            continue
+        seen.add(link)
+        links.append(link)
+        if limit is not None and len(links) >= limit:
+            break
+    return links
+
+
+def link_key(url):
+    """Return the response cache key a URL is stored under."""
+    return cache_key(*parse_url(url))
+
+
+class Prefetcher:
+    """
+    Fetch the first links of a page into the response cache in the
+    background, so following one of them is a cache hit.
+
+    Each run uses its own event loop on a daemon thread. Responses that
+    carry no freshness information are kept for PREFETCH_LIFETIME
+    seconds; no-store and no-cache responses are fetched but not kept.
+    Starting a new run, or navigating, cancels the fetches of the last
+    run that have not begun.
+    """
+    def __init__(self, max_links=8, concurrency=PREFETCH_CONCURRENCY,
+                 max_bytes=PREFETCH_MAX_BYTES, budget_bytes=PREFETCH_BUDGET_BYTES,
+                 lifetime=PREFETCH_LIFETIME):
+        """
+        Initialize a prefetcher.
+
+        Args:
+            max_links (int): How many links of each page to prefetch.
+            concurrency (int): Most prefetches in flight at once.
+            max_bytes (int): Responses longer than this are abandoned.
+            budget_bytes (int): No new prefetch starts once a run has
+                                fetched this many bytes.
+            lifetime (float): The least time a prefetched page stays cached.
+        """
+        self.max_links = max_links
+        self.concurrency = concurrency
+        self.max_bytes = max_bytes
+        self.budget_bytes = budget_bytes
+        self.lifetime = lifetime
+        self.lock = threading.Lock()
+        self.cancelled = None
+        self.thread = None
+        # Cache keys prefetched and not yet navigated to
+        self.prefetched = set()
+        self.counts = dict.fromkeys(
+            ["started", "cached", "not_cacheable", "too_large", "over_budget", "failed",
+             "navigations", "used"], 0)
+        self.bytes = 0
+
+    def start(self, page_url, body):
+        """
+        Prefetch the links of a page that has just loaded.
+
+        Args:
+            page_url (str): The page's URL.
+            body (str): The page's HTML.
+
+        Returns:
+            list: The links being prefetched.
+        """
+        self.cancel()
+        links = extract_links(body, page_url, self.max_links)
+        if not links:
+            return links
+        cancelled = self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=asyncio.run, args=(self.run(links, cancelled),),
+                                       name="prefetch", daemon=True)
+        self.thread.start()
+        return links
+
+    def cancel(self):
+        """Stop the current run from starting any more fetches."""
+        if self.cancelled is not None:
+            self.cancelled.set()
+
+    def wait(self, timeout=None):
+        """Wait for the current run to finish; mainly for tests and benchmarks."""
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    async def run(self, links, cancelled):
+        """Prefetch `links` until done, cancelled or over budget."""
+        fetcher = AsyncFetcher(self.concurrency, self.max_bytes, self.lifetime)
+        budget = {"bytes": 0}
+        try:
+            await asyncio.gather(*(self.fetch(fetcher, link, cancelled, budget) for link in links))
+        finally:
+            await fetcher.close()
+
+    async def fetch(self, fetcher, link, cancelled, budget):
+        key = link_key(link)
+        if key in cache:
+            return
+        async with fetcher.semaphore:
+            if cancelled.is_set():
+                return
+            if budget["bytes"] >= self.budget_bytes:
+                self.count("over_budget")
+                return
+            self.count("started")
+            try:
+                content = await fetcher.request(*parse_url(link))
+            except ResponseTooLarge:
+                self.count("too_large")
+                return
+            except Exception:
+                self.count("failed")
+                return
+        size = len(content.encode("utf8"))
+        budget["bytes"] += size
+        with self.lock:
+            self.bytes += size
+            if key in cache:
+                self.counts["cached"] += 1
+                self.prefetched.add(key)
+            else:
+                self.counts["not_cacheable"] += 1
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def record_navigation(self, url):
+        """
+        Note a navigation, counting it as used if it was prefetched, and
+        cancel the prefetches that have not started.
+
+        Args:
+            url (str): The URL being navigated to.
+        """
+        self.cancel()
+        if not url.startswith(("http://", "https://")):
+            return
+        key = link_key(url)
+        with self.lock:
+            self.counts["navigations"] += 1
+            if key in self.prefetched:
+                self.prefetched.discard(key)
+                self.counts["used"] += 1
+
+    def stats(self):
+        """
+        Return the prefetch counters.
+
+        hit_rate is the share of cached prefetches the user went on to
+        follow; navigation_hit_rate the share of navigations they served.
+        """
+        with self.lock:
+            stats = dict(self.counts, bytes=self.bytes)
+        stats["hit_rate"] = stats["used"] / stats["cached"] if stats["cached"] else 0.0
+        stats["navigation_hit_rate"] = (stats["used"] / stats["navigations"]
+                                        if stats["navigations"] else 0.0)
+        return stats
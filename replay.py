@@ -0,0 +1,451 @@
+import asyncio
+import gzip
+import io
+import json
+import socket
+import threading
+import time
+from collections import namedtuple
+from socketserver import BaseRequestHandler, ThreadingTCPServer
+import request
+import async_request
+
+# The first line of every archive; `pages` follows in its JSON
+ARCHIVE_FORMAT = "creator-replay"
+ARCHIVE_VERSION = 1
+# Bytes written at a time when replaying at a limited bandwidth
+REPLAY_SLICE_BYTES = 16 * 1024
+
+# One request and the raw response it got, exactly as sent and received:
+# status line, headers, transfer and content encoding. `closed` is True
+# when the server closed the connection after the response.
+Exchange = namedtuple("Exchange", "origin request response closed")
+
+
+def origin_of(host, port, scheme):
+    return f"{scheme}://{host}:{port}"
+
+
+def save_archive(path, exchanges, pages=()):
+    """
+    Write exchanges to a gzip-compressed archive.
+
+    Each exchange is a JSON line giving its origin and sizes, followed by
+    the request and response bytes themselves.
+
+    Args:
+        path (str): The archive to write.
+        exchanges (list): The Exchanges, in the order they happened.
+        pages (list): The URLs that were loaded, for replaying them later.
+    """
+    with gzip.open(path, "wb") as f:
+        header = {"format": ARCHIVE_FORMAT, "version": ARCHIVE_VERSION, "pages": list(pages)}
+        f.write(json.dumps(header).encode("utf8") + b"\n")
+        for exchange in exchanges:
+            record = {"origin": exchange.origin, "request": len(exchange.request),
+                      "response": len(exchange.response), "closed": exchange.closed}
+            f.write(json.dumps(record).encode("utf8") + b"\n")
+            f.write(exchange.request)
+            f.write(exchange.response)
+
+
+def load_archive(path):
+    """
+    Read an archive written by save_archive.
+
+    Returns:
+        tuple: The list of page URLs and the list of Exchanges.
+
+    Raises:
+        ValueError: If the file is not a replay archive.
+    """
+    with gzip.open(path, "rb") as f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            header = None
+        if not isinstance(header, dict) or header.get("format") != ARCHIVE_FORMAT:
+            raise ValueError(f"{path} is not a replay archive")
+        exchanges = []
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            record = json.loads(line)
+            request_bytes = f.read(record["request"])
+            response_bytes = f.read(record["response"])
+            if len(response_bytes) != record["response"]:
+                raise ValueError(f"{path} is truncated")
+            exchanges.append(Exchange(record["origin"], request_bytes, response_bytes,
+                                      record["closed"]))
+    return header["pages"], exchanges
+
+
+class RecordingReader(io.RawIOBase):
+    """The raw stream under a RecordingSocket's makefile()."""
+    def __init__(self, sock):
+        self.sock = sock
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.sock.recv_into(buffer)
+
+
+class ConnectionLog:
+    """
+    Split what passes through one recorded connection into exchanges.
+
+    Everything received after a request was sent, up to the next request
+    on the same connection, is that request's response.
+    """
+    def __init__(self, recorder, origin):
+        self.recorder = recorder
+        self.origin = origin
+        self.exchange = None
+
+    def sent(self, data):
+        if self.exchange is None or self.exchange["response"]:
+            self.exchange = self.recorder.start(self.origin)
+        self.exchange["request"] += bytes(data)
+
+    def received(self, data):
+        if self.exchange is not None:
+            if data:
+                self.exchange["response"] += bytes(data)
+            else:
+                self.exchange["closed"] = True
+
+
+class RecordingSocket:
+    """A connected socket that copies what goes through it to a Recorder."""
+    def __init__(self, sock, recorder, origin):
+        self.sock = sock
+        self.log = ConnectionLog(recorder, origin)
+
+    def send(self, data):
+        sent = self.sock.send(data)
+        self.log.sent(data[:sent])
+        return sent
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+        self.log.sent(data)
+
+    def recv_into(self, buffer, nbytes=0):
+        received = self.sock.recv_into(buffer, nbytes)
+        self.log.received(memoryview(buffer)[:received])
+        return received
+
+    def recv(self, size):
+        data = self.sock.recv(size)
+        self.log.received(data)
+        return data
+
+    def makefile(self, mode="rb"):
+        if mode != "rb":
+            raise ValueError("RecordingSocket only makes binary read files")
+        return io.BufferedReader(RecordingReader(self))
+
+    def __getattr__(self, name):
+        # fileno, close, session and the rest come from the real socket
+        return getattr(self.sock, name)
+
+
+class RecordingStreamReader:
+    """An asyncio StreamReader that copies what it reads to a ConnectionLog."""
+    def __init__(self, reader, log):
+        self.reader = reader
+        self.log = log
+
+    async def readline(self):
+        data = await self.reader.readline()
+        self.log.received(data)
+        return data
+
+    async def read(self, n=-1):
+        data = await self.reader.read(n)
+        if n:
+            self.log.received(data)
+        return data
+
+    async def readexactly(self, n):
+        try:
+            data = await self.reader.readexactly(n)
+        except asyncio.IncompleteReadError as e:
+            self.log.received(e.partial)
+            self.log.received(b"")
+            raise
+        if n:
+            # Nothing read here means nothing was asked for, not EOF
+            self.log.received(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.reader, name)
+
+
+class RecordingStreamWriter:
+    """An asyncio StreamWriter that copies what it writes to a ConnectionLog."""
+    def __init__(self, writer, log):
+        self.writer = writer
+        self.log = log
+
+    def write(self, data):
+        self.writer.write(data)
+        self.log.sent(data)
+
+    def __getattr__(self, name):
+        # drain, close, is_closing and the rest come from the real writer
+        return getattr(self.writer, name)
+
+
+class Recorder:
+    """
+    Record every request made through request.create_connection, with
+    the raw bytes of its response, for ReplayServer to serve later.
+
+    Bytes are captured above TLS, so HTTPS exchanges replay as plain
+    HTTP with the same responses.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = []
+        self.pages = []
+
+    def start(self, origin):
+        """Begin a new exchange on a connection to `origin`."""
+        record = {"origin": origin, "request": b"", "response": b"", "closed": False}
+        with self.lock:
+            self.records.append(record)
+        return record
+
+    def connect(self, host, port, scheme, timeout=None):
+        """Open a real connection, recording what passes through it."""
+        sock = request.open_socket(host, port, scheme, timeout)
+        return RecordingSocket(sock, self, origin_of(host, port, scheme))
+
+    async def open_streams(self, host, port, scheme):
+        """Open real asyncio streams, recording what passes through them."""
+        reader, writer = await async_request.open_streams(host, port, scheme)
+        log = ConnectionLog(self, origin_of(host, port, scheme))
+        return RecordingStreamReader(reader, log), RecordingStreamWriter(writer, log)
+
+    @property
+    def exchanges(self):
+        with self.lock:
+            return [Exchange(r["origin"], r["request"], r["response"], r["closed"])
+                    for r in self.records]
+
+    def install(self):
+        """Record every connection made from now on, closing idle ones first."""
+        request.open_connections.close_all()
+        request.transport = self
+
+    def uninstall(self):
+        if request.transport is self:
+            request.transport = None
+            request.open_connections.close_all()
+
+    def save(self, path):
+        """Write what was recorded to an archive."""
+        save_archive(path, self.exchanges, self.pages)
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+
+def request_target(request_bytes):
+    """Return the request line of a request, e.g. b"GET / HTTP/1.1"."""
+    return request_bytes.split(b"\r\n", 1)[0]
+
+
+class ReplayHandler(BaseRequestHandler):
+    """Answer each request on a connection with its recorded response."""
+    def handle(self):
+        reader = self.request.makefile("rb")
+        try:
+            while True:
+                head = read_request_head(reader)
+                if not head:
+                    return
+                exchange = self.server.replay.find(self.server.origin, head)
+                self.server.replay.send(self.request, exchange)
+                if exchange is None or exchange.closed:
+                    return
+        except OSError:
+            pass
+        finally:
+            reader.close()
+
+
+def read_request_head(reader):
+    """Read a request line and headers; these requests never have bodies."""
+    lines = []
+    while True:
+        line = reader.readline()
+        if not line:
+            return b"".join(lines) if lines else b""
+        lines.append(line)
+        if line in (b"\r\n", b"\n"):
+            return b"".join(lines)
+
+
+class ReplayServer:
+    """
+    Serve recorded responses byte for byte from local sockets, one per
+    recorded origin, and send connections meant for those origins there.
+
+    Requests are matched on their exact bytes first, then on their
+    request line alone; a request recorded several times gets its
+    responses in the order they were recorded, the last one repeating.
+
+    `latency` seconds are added before each connection is made and
+    before each response; with `bandwidth` set, each slice of a response
+    is sent when that many bytes per second would have delivered it,
+    timed from the start of the response so the pace does not drift
+    with the cost of each write.
+    """
+    def __init__(self, exchanges, latency=0.0, bandwidth=None, slice_bytes=REPLAY_SLICE_BYTES):
+        """
+        Prepare to serve an archive's exchanges.
+
+        Args:
+            exchanges (list): The Exchanges to replay.
+            latency (float): Seconds of simulated round trip time.
+            bandwidth (float): Bytes per second, or None for no limit.
+            slice_bytes (int): Bytes written at a time when paced.
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.slice_bytes = slice_bytes
+        self.by_request = {}
+        self.by_target = {}
+        for exchange in exchanges:
+            self.by_request.setdefault((exchange.origin, exchange.request), []).append(exchange)
+            self.by_target.setdefault((exchange.origin, request_target(exchange.request)),
+                                      []).append(exchange)
+        self.served = {}
+        self.servers = {}
+        self.started = False
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_sent = 0
+        for origin in {exchange.origin for exchange in exchanges}:
+            server = ThreadingTCPServer(("127.0.0.1", 0), ReplayHandler, bind_and_activate=False)
+            server.daemon_threads = True
+            server.allow_reuse_address = True
+            server.request_queue_size = 128
+            server.server_bind()
+            server.server_activate()
+            server.origin = origin
+            server.replay = self
+            self.servers[origin] = server
+
+    @classmethod
+    def from_archive(cls, path, **kwargs):
+        pages, exchanges = load_archive(path)
+        replay = cls(exchanges, **kwargs)
+        replay.pages = pages
+        return replay
+
+    def find(self, origin, head):
+        """Return the recorded exchange answering a request, or None."""
+        with self.lock:
+            for table, key in ((self.by_request, (origin, head)),
+                               (self.by_target, (origin, request_target(head)))):
+                recorded = table.get(key)
+                if recorded:
+                    count = self.served.get(key, 0)
+                    self.served[key] = count + 1
+                    self.hits += 1
+                    return recorded[min(count, len(recorded) - 1)]
+            self.misses += 1
+            return None
+
+    def send(self, sock, exchange):
+        """Write an exchange's response with the configured timing."""
+        if exchange is None:
+            sock.sendall(b"HTTP/1.1 502 Not In Archive\r\nContent-Length: 0\r\n"
+                         b"Connection: close\r\n\r\n")
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        data = memoryview(exchange.response)
+        if self.bandwidth is None:
+            sock.sendall(data)
+        else:
+            started = time.perf_counter()
+            for start in range(0, len(data), self.slice_bytes):
+                piece = data[start:start + self.slice_bytes]
+                # A slice goes out once the link would have carried it
+                delay = started + (start + len(piece)) / self.bandwidth - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                sock.sendall(piece)
+        with self.lock:
+            self.bytes_sent += len(data)
+
+    def connect(self, host, port, scheme, timeout=None):
+        """Connect to the local server replaying an origin."""
+        server = self.servers.get(origin_of(host, port, scheme))
+        if server is None:
+            raise ConnectionRefusedError(f"{origin_of(host, port, scheme)} is not in the archive")
+        if self.latency:
+            time.sleep(self.latency)
+        return socket.create_connection(server.server_address,
+                                        request.CONNECT_TIMEOUT if timeout is None else timeout)
+
+    async def open_streams(self, host, port, scheme):
+        """Connect asyncio streams to the local server replaying an origin."""
+        sock = await asyncio.to_thread(self.connect, host, port, scheme)
+        try:
+            return await asyncio.open_connection(sock=sock)
+        except BaseException:
+            sock.close()
+            raise
+
+    def start(self):
+        """Serve every origin in the background."""
+        if not self.started:
+            self.started = True
+            for server in self.servers.values():
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self
+
+    def install(self):
+        """Send every connection from now on to the replay servers."""
+        request.open_connections.close_all()
+        request.transport = self
+
+    def uninstall(self):
+        if request.transport is self:
+            request.transport = None
+            request.open_connections.close_all()
+
+    def close(self):
+        self.uninstall()
+        for server in self.servers.values():
+            if self.started:
+                server.shutdown()
+            server.server_close()
+        self.started = False
+
+    def __enter__(self):
+        self.start()
+        self.install()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self):
+        with self.lock:
+            return {"origins": len(self.servers), "hits": self.hits, "misses": self.misses,
+                    "bytes_sent": self.bytes_sent}
@@ -1,10 +1,34 @@
-import ssl
+import atexit
+import os
+import time
 import socket
 import gzip
 from urllib.parse import urlparse, urljoin
-# Global dictionary to store open connections
-open_connections = {}
-cache = {}
+from cache import ResponseCache, freshness_lifetime, forbids_reuse
+from disk_cache import DiskCache
+from connection_pool import ConnectionPool
+from body_reader import BodyReader
+from timing import phase, record
+from resolver import DNSCache, happy_eyeballs_connect, CONNECT_TIMEOUT
+from tls import TLSSessionCache, TLS_CA_FILE
+# Shared in-memory response cache
+cache = ResponseCache()
+# Persistent cache tier below the in-memory one
+DISK_CACHE_DIR = os.environ.get(
+    "CREATOR_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "creator"))
+disk_cache = DiskCache(DISK_CACHE_DIR)
+atexit.register(disk_cache.close)
+# Host name lookups shared by every connection
+resolver = DNSCache()
+# The TLS context and resumable sessions shared by every HTTPS connection
+tls_sessions = TLSSessionCache(cafile=TLS_CA_FILE)
+# Records or replays every new connection when set; see replay.py
+transport = None
+
+def cache_key(host, port, path, scheme):
+    """Build the cache key for a request."""
+    return f"{scheme}://{host}:{port}{path}"
+
 def make_http_request(host, port, path, scheme,max_redirects=5):
     """
     Make an HTTP/HTTPS request and return the response content.
@@ -18,98 +42,162 @@ def make_http_request(host, port, path, scheme,max_redirects=5):
     Returns:
         str: The content of the response.
     """
-    global open_connections, cache
+    global cache, disk_cache
     
-    # Check cache first
-    cache_key = f"{scheme}://{host}{path}"
-    if cache_key in cache:
-        cached_response = cache[cache_key]
-        if cached_response['valid']:
-            print(f"Serving from cache: {cache_key}")
-            return cached_response['content']
+    # Check the memory and disk caches first
+    key = cache_key(host, port, path, scheme)
+    with phase("cache"):
+        cached_content, disk_entry = lookup_cache(key)
+    if cached_content is not None:
+        with phase("decode"):
+            return cached_content.decode('utf-8')
+
+    request = build_request(host, path, disk_entry)
+    conn, statusline = send_request(host, port, scheme, request)
+    download_started = time.perf_counter()
+    # Use binary mode for reading the response
+    response = conn.reader
+    content = b""
+    try:
+        version, status, explanation = parse_status_line(statusline)
+
+        response_headers = {}
+        while True:
+            line = response.readline()
+            if line in (b"\r\n", b"\n", b""): break
+
+            header, value = parse_header_line(line)
+            response_headers[header] = value
+
+        reusable = keeps_alive(version, response_headers)
+        body_reader = BodyReader(response)
+        if not response_has_body(status):
+            pass
+        elif "content-length" in response_headers:
+            content_length = int(response_headers["content-length"])
+            content = body_reader.read_content_length(content_length)
+        elif "transfer-encoding" in response_headers and response_headers["transfer-encoding"] == "chunked":
+            # Handle chunked transfer encoding
+            content = body_reader.read_chunked()
+        else:
+            content = body_reader.read_until_eof()  # Read the rest of the response
+            # The body ran to EOF, so the connection cannot be reused
+            reusable = False
+        if conn.aborted:
+            # A cancelled load shut the socket down; the body may be cut short
+            raise ConnectionAbortedError("Connection aborted")
+    except BaseException:
+        # Whatever went wrong, the connection is mid-response and unusable
+        open_connections.discard(conn)
+        raise
+    open_connections.release(conn, reusable)
+    record("download", time.perf_counter() - download_started)
+
+    new_url = redirect_target(host, port, path, scheme, response_headers)
+    if new_url is not None and max_redirects > 0:
+        # Follow the redirect; the pool hands back the same socket
+        # when it stays on this origin
+        return make_http_request(*parse_url(new_url), max_redirects=max_redirects - 1)
+
+    with phase("gunzip"):
+        content = decode_content(content, response_headers)
+    content = finish_response(key, status, content, response_headers, disk_entry)
+    if content is None:
+        # The revalidated body vanished from disk; fetch it again
+        return make_http_request(host, port, path, scheme, max_redirects)
+    with phase("decode"):
+        return content.decode('utf-8')
+
+def lookup_cache(key):
+    """
+    Look a request up in the memory cache, then in the disk cache.
     
-    connection_key = (host, port, scheme)
-    if connection_key in open_connections:
-        s = open_connections[connection_key]
-    else:
-        s = create_connection(host, port, scheme)
-        open_connections[connection_key] = s
+    Args:
+        key (str): The cache key from cache_key().
+        
+    Returns:
+        tuple: (content, disk_entry). content is the cached body when a
+               fresh copy exists, otherwise None; disk_entry is a stale
+               disk entry that can be revalidated, or None.
+    """
+    cached_content = cache.get(key)
+    if cached_content is not None:
+        print(f"Serving from cache: {key}")
+        return cached_content, None
+
+    # Serve fresh disk entries, revalidate stale ones
+    disk_entry = disk_cache.lookup(key) if disk_cache is not None else None
+    if disk_entry is not None and disk_entry.is_fresh():
+        content = disk_cache.read(key, disk_entry)
+        if content is not None:
+            cache.put(key, content, disk_entry.expires - time.time())
+            return content, None
+        disk_entry = None
+    if disk_entry is not None and not disk_entry.can_revalidate():
+        disk_entry = None
+    return None, disk_entry
 
+def build_request(host, path, disk_entry=None):
+    """
+    Build the encoded GET request head.
+    
+    Args:
+        host (str): The Host header value.
+        path (str): The path to request.
+        disk_entry (DiskEntry): A stale cache entry to revalidate, if any.
+        
+    Returns:
+        bytes: The request line and headers.
+    """
     headers = {
         "Host": host,
         "User-Agent": "Creator/1.0",
         "Accept-Encoding": "gzip"  # Enable gzip compression
     }
+    if disk_entry is not None:
+        headers.update(disk_entry.validators())
 
     request = f"GET {path} HTTP/1.1\r\n"
     for header, value in headers.items():
         request += f"{header}: {value}\r\n"
     request += "\r\n"
-    
-    s.send(request.encode("utf8"))
-    
-    # Use binary mode for reading the response
-    response = s.makefile("rb")
-    statusline = response.readline()
+    return request.encode("utf8")
 
+def parse_status_line(statusline):
+    """Split a status line into (version, status, explanation)."""
     # Ensure the status line is handled as bytes
     if isinstance(statusline, bytes):
         statusline = statusline.decode('utf-8')
-    
     version, status, explanation = statusline.split(" ", 2)
+    return version, status, explanation
+
+def parse_header_line(line):
+    """Split a raw header line into a lowercase name and a stripped value."""
+    header, value = line.split(b":", 1)
+    return header.strip().lower().decode('utf-8'), value.strip().decode('utf-8')
+
+def response_has_body(status):
+    """Return False for status codes that never carry a body."""
+    return not (status.startswith("1") or status in ("204", "304"))
+
+def redirect_target(host, port, path, scheme, response_headers):
+    """
+    Resolve the Location header of a response against the request URL.
     
-    response_headers = {}
-    while True:
-        line = response.readline()
-        if line == b"\r\n": break
-        
-        header, value = line.split(b":", 1)
-        response_headers[header.lower().decode('utf-8')] = value.strip().decode('utf-8')
-    # print(response_headers)
-    if "location" in response_headers and max_redirects > 0:
-        redirect_url = response_headers["location"]
-        # Handle absolute and relative URLs
-        if redirect_url.startswith('http://') or redirect_url.startswith('https://'):
-            new_url = redirect_url
-        else:
-            # Construct the absolute URL using the original host and scheme
-            new_url = urljoin(f"{scheme}://{host}", redirect_url)
-        
-        # Close the current connection
-        s.close()
-        del open_connections[connection_key]
-        
-        # Follow the redirect
-        return make_http_request(*parse_url(new_url), max_redirects=max_redirects - 1)
-    # Handle caching based on Cache-Control
-    should_cache = True
-    if 'cache-control' in response_headers:
-        cache_control = response_headers['cache-control'].lower()
-        if 'no-store' in cache_control:
-            should_cache = False
-        elif 'max-age' in cache_control:
-            max_age = int(cache_control.split('max-age=')[1].split(',')[0])
-    
-    content = b""
-    
-    if "content-length" in response_headers:
-        content_length = int(response_headers["content-length"])
-        content = response.read(content_length)
-    elif "transfer-encoding" in response_headers and response_headers["transfer-encoding"] == "chunked":
-        # Handle chunked transfer encoding
-        while True:
-            chunk_size_line = response.readline().strip()
-            if not chunk_size_line:
-                break
-            chunk_size = int(chunk_size_line, 16)
-            if chunk_size == 0:
-                break
-            content += response.read(chunk_size)  
-    else:
-        content = response.read()  # Read the rest of the response
-        # Close the connection
-        s.close()
-        del open_connections[connection_key]
+    Returns:
+        str: The absolute redirect URL, or None if there is no redirect.
+    """
+    if "location" not in response_headers:
+        return None
+    redirect_url = response_headers["location"]
+    # Handle absolute and relative URLs
+    if redirect_url.startswith('http://') or redirect_url.startswith('https://'):
+        return redirect_url
+    # Construct the absolute URL using the original host, port and scheme
+    return urljoin(f"{scheme}://{host}:{port}{path}", redirect_url)
+
+def decode_content(content, response_headers):
+    """Undo gzip content encoding, if the response used it."""
     # Print the first few bytes to check if it's valid gzip data
     # print("Raw content before decompression:", content[:20])  # Check the first 20 bytes
     # Handle gzip compression
@@ -121,30 +209,165 @@ def make_http_request(host, port, path, scheme,max_redirects=5):
             # Log the content for further inspection
             with open("response_content.raw", "wb") as f:
                 f.write(content)
+    return content
+
+def finish_response(key, status, content, response_headers, disk_entry, min_lifetime=0):
+    """
+    Store a response in the caches and resolve 304 Not Modified.
+    
+    Args:
+        key (str): The cache key.
+        status (str): The response status code.
+        content (bytes): The decoded response body.
+        response_headers (dict): Lowercase response headers.
+        disk_entry (DiskEntry): The entry that was revalidated, if any.
+        min_lifetime (float): Keep a successful response in memory at least
+                              this long unless no-store or no-cache forbid
+                              it, e.g. so a prefetched page is there when
+                              the user follows the link.
+        
+    Returns:
+        bytes: The body to return, or None if a 304 refers to a body
+               that is no longer on disk.
+    """
+    # Handle caching based on Cache-Control, Expires and Date
+    lifetime = freshness_lifetime(response_headers)
+    if min_lifetime and status.startswith('2') and not forbids_reuse(response_headers):
+        lifetime = max(lifetime, min_lifetime)
+    if status == "304" and disk_entry is not None:
+        # Not modified: serve the stored body without downloading it again
+        lifetime = disk_cache.freshen(key, disk_entry, response_headers)
+        content = disk_cache.read(key, disk_entry)
+        if content is None:
+            return None
 
     # Cache the response if applicable
-    if status.startswith('2') and should_cache:  # 200 OK
-        cache[cache_key] = {'content': content, 'valid': True}
+    if status.startswith('2') or (status == "304" and disk_entry is not None):  # 200 OK
+        if lifetime > 0:
+            cache.put(key, content, lifetime)
+        if status.startswith('2') and disk_cache is not None:
+            disk_cache.store(key, content, response_headers)
+    return content
 
+def send_request(host, port, scheme, request):
+    """
+    Send a request on a pooled connection and read its status line.
 
-    return content.decode('utf-8')
+    A reused keep-alive socket may have been closed by the server since it
+    was last used; in that case the request is retried once on a fresh
+    connection.
 
-def create_connection(host, port, scheme):
-    """Create a new connection to the specified host."""
-    s = socket.socket(
-        family=socket.AF_INET,
-        type=socket.SOCK_STREAM,
-        proto=socket.IPPROTO_TCP,
-    )
-    s.connect((host, port))
+    Args:
+        host (str): The host to connect to.
+        port (int): The port to connect to.
+        scheme (str): The URL scheme (http or https).
+        request (bytes): The encoded request head.
+
+    Returns:
+        tuple: The PooledConnection and the raw status line.
+    """
+    conn = open_connections.acquire(host, port, scheme)
+    try:
+        statusline = send_on(conn, request)
+    except OSError:
+        open_connections.discard(conn)
+        if not conn.reused:
+            raise
+        conn = open_connections.acquire(host, port, scheme, fresh=True)
+        try:
+            statusline = send_on(conn, request)
+        except BaseException:
+            open_connections.discard(conn)
+            raise
+    except BaseException:
+        open_connections.discard(conn)
+        raise
+    return conn, statusline
+
+def send_on(conn, request):
+    """Send a request on a connection and wait for the status line."""
+    with phase("request_sent"):
+        conn.sock.send(request)
+    with phase("ttfb"):
+        statusline = conn.reader.readline()
+    if not statusline:
+        raise ConnectionResetError("Connection closed by server")
+    return statusline
+
+def keeps_alive(version, response_headers):
+    """Return True if the connection may be reused after this response."""
+    connection = response_headers.get("connection", "").lower()
+    if version.strip().upper() == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+def create_connection(host, port, scheme, timeout=None):
+    """
+    Create a new connection to the specified host, through the record or
+    replay transport if one is installed.
+    
+    Args:
+        host (str): The host to connect to.
+        port (int): The port to connect to.
+        scheme (str): The URL scheme (http or https).
+        timeout (float): Seconds allowed to connect; CONNECT_TIMEOUT if None.
+    """
+    if transport is not None:
+        return transport.connect(host, port, scheme, timeout)
+    return open_socket(host, port, scheme, timeout)
+
+def open_socket(host, port, scheme, timeout=None):
+    """
+    Connect to the specified host over the network.
+    
+    The host is resolved through the DNS cache and its IPv4 and IPv6
+    addresses are raced Happy-Eyeballs style.
+    
+    Args:
+        host (str): The host to connect to.
+        port (int): The port to connect to.
+        scheme (str): The URL scheme (http or https).
+        timeout (float): Seconds allowed to connect; CONNECT_TIMEOUT if None.
+    """
+    s = open_tcp(host, port, timeout)
     if scheme == "https":
-        ctx = ssl.create_default_context()
-        s = ctx.wrap_socket(s, server_hostname=host)
+        with phase("tls"):
+            try:
+                s = tls_sessions.wrap(s, host, port)
+            except BaseException:
+                s.close()
+                raise
     return s
+
+def open_tcp(host, port, timeout=None):
+    """
+    Open a TCP connection through the DNS cache and Happy Eyeballs,
+    without TLS.
+    
+    Args:
+        host (str): The host to connect to.
+        port (int): The port to connect to.
+        timeout (float): Seconds allowed to connect; CONNECT_TIMEOUT if None.
+    """
+    with phase("dns"):
+        addresses = resolver.resolve(host, port)
+    with phase("connect"):
+        return happy_eyeballs_connect(addresses, CONNECT_TIMEOUT if timeout is None else timeout)
+
+def save_tls_session(conn):
+    """Keep the TLS session of a connection handed back to the pool."""
+    host, port, scheme = conn.key
+    if scheme == "https":
+        # TLS 1.3 tickets arrive with the response, after the handshake
+        tls_sessions.save(host, port, conn.sock)
+# Pool of keep-alive connections shared by every request
+open_connections = ConnectionPool(create_connection, on_release=save_tls_session)
 def parse_url(url):
     """Parse the URL and return host, port, path, and scheme."""
     parsed = urlparse(url)
     host = parsed.hostname
     port = parsed.port or (443 if parsed.scheme == 'https' else 80)
     path = parsed.path or '/'
+    if parsed.query:
+        path += "?" + parsed.query
     return host, port, path, parsed.scheme
\ No newline at end of file
@@ -0,0 +1,256 @@
+import queue
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds allowed for a TCP connect, across every address tried
+CONNECT_TIMEOUT = 10.0
+# Head start given to each address before the next one is tried (RFC 8305)
+CONNECT_STAGGER = 0.25
+# Seconds a connected socket waits for the server before a read fails
+READ_TIMEOUT = 30.0
+
+
+class DNSCache:
+    """
+    A TTL cache in front of getaddrinfo.
+
+    getaddrinfo does not report record TTLs, so successful lookups are kept
+    for `ttl` seconds and failed ones for `negative_ttl` seconds, after
+    which the name is resolved again. Hosts can also be pinned to fixed
+    addresses, like entries in /etc/hosts.
+    """
+    def __init__(self, ttl=300, negative_ttl=30, max_entries=512, getaddrinfo=None):
+        """
+        Initialize an empty cache.
+
+        Args:
+            ttl (float): Seconds to keep the addresses of a host.
+            negative_ttl (float): Seconds to remember that a host failed.
+            max_entries (int): Most hosts kept, least recently used first out.
+            getaddrinfo (callable): The resolver; socket.getaddrinfo by default.
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.getaddrinfo = getaddrinfo or socket.getaddrinfo
+        self.entries = OrderedDict()
+        self.pinned = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.expirations = 0
+        self.lookup_seconds = 0.0
+
+    def pin(self, host, addresses):
+        """
+        Always resolve `host` to the given IP addresses.
+
+        Args:
+            host (str): The host name.
+            addresses (list): IPv4 or IPv6 address strings.
+        """
+        self.pinned[host] = [
+            (socket.AF_INET6 if ":" in address else socket.AF_INET,
+             (address, 0, 0, 0) if ":" in address else (address, 0))
+            for address in addresses
+        ]
+
+    def resolve(self, host, port):
+        """
+        Return the addresses of a host, from the cache when possible.
+
+        Args:
+            host (str): The host name or IP literal.
+            port (int): The port to put in each socket address.
+
+        Returns:
+            list: (family, sockaddr) pairs in the resolver's order.
+
+        Raises:
+            socket.gaierror: If the name does not resolve, possibly cached.
+        """
+        addresses = self.lookup(host)
+        return [(family, (sockaddr[0], port) + tuple(sockaddr[2:]))
+                for family, sockaddr in addresses]
+
+    def lookup(self, host):
+        """Return the cached or freshly resolved (family, sockaddr) pairs."""
+        if host in self.pinned:
+            return self.pinned[host]
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(host)
+            if entry is not None:
+                expires, addresses, error = entry
+                if expires > now:
+                    self.entries.move_to_end(host)
+                    if error is not None:
+                        self.negative_hits += 1
+                        raise error
+                    self.hits += 1
+                    return addresses
+                del self.entries[host]
+                self.expirations += 1
+            self.misses += 1
+
+        start = time.perf_counter()
+        try:
+            infos = self.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            self.store(host, None, e, now + self.negative_ttl)
+            raise
+        finally:
+            self.lookup_seconds += time.perf_counter() - start
+        addresses = []
+        for family, _, _, _, sockaddr in infos:
+            if (family, sockaddr) not in addresses:
+                addresses.append((family, sockaddr))
+        self.store(host, addresses, None, now + self.ttl)
+        return addresses
+
+    def store(self, host, addresses, error, expires):
+        with self.lock:
+            self.entries[host] = (expires, addresses, error)
+            self.entries.move_to_end(host)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, host):
+        """Forget the cached result for a host."""
+        with self.lock:
+            self.entries.pop(host, None)
+
+    def clear(self):
+        """Forget every cached result; pinned hosts stay."""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Return the cache's counters.
+
+        saved_seconds estimates the resolver time avoided by hits, using
+        the average time of the lookups that missed.
+        """
+        lookups = self.hits + self.negative_hits + self.misses
+        average = self.lookup_seconds / self.misses if self.misses else 0.0
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "entries": len(self.entries),
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+            "lookup_seconds": self.lookup_seconds,
+            "saved_seconds": (self.hits + self.negative_hits) * average,
+        }
+
+
+def interleave_families(addresses):
+    """
+    Order addresses so that families alternate, starting with the family
+    of the first address, as RFC 8305 section 4 recommends.
+    """
+    if not addresses:
+        return []
+    first = addresses[0][0]
+    preferred = [address for address in addresses if address[0] == first]
+    others = [address for address in addresses if address[0] != first]
+    ordered = []
+    for i in range(max(len(preferred), len(others))):
+        ordered.extend(preferred[i:i + 1])
+        ordered.extend(others[i:i + 1])
+    return ordered
+
+
+def connect_to(family, sockaddr, timeout=CONNECT_TIMEOUT):
+    """
+    Open a TCP socket to one address, giving up after `timeout`. Reads on
+    the socket then time out after READ_TIMEOUT.
+    """
+    s = socket.socket(family=family, type=socket.SOCK_STREAM, proto=socket.IPPROTO_TCP)
+    try:
+        s.settimeout(timeout)
+        s.connect(sockaddr)
+        s.settimeout(READ_TIMEOUT)
+    except BaseException:
+        s.close()
+        raise
+    return s
+
+
+def happy_eyeballs_connect(addresses, timeout=CONNECT_TIMEOUT, stagger=CONNECT_STAGGER):
+    """
+    Connect to the first of several addresses that answers.
+
+    Addresses are tried in interleaved family order; each attempt gets a
+    `stagger` head start before the next one begins, and a failed attempt
+    starts the next one at once. The first connection made wins and any
+    that complete later are closed.
+
+    Args:
+        addresses (list): (family, sockaddr) pairs from DNSCache.resolve.
+        timeout (float): Seconds allowed for the whole race.
+        stagger (float): Seconds between starting attempts.
+
+    Returns:
+        socket.socket: The connected socket.
+    """
+    addresses = interleave_families(addresses)
+    if not addresses:
+        raise OSError("No addresses to connect to")
+    if len(addresses) == 1:
+        return connect_to(*addresses[0], timeout)
+
+    deadline = time.monotonic() + timeout
+    results = queue.Queue()
+    lock = threading.Lock()
+    state = {"decided": False}
+
+    def attempt(family, sockaddr):
+        try:
+            s = connect_to(family, sockaddr, max(0.0, deadline - time.monotonic()))
+        except OSError as e:
+            results.put((None, e))
+            return
+        with lock:
+            if state["decided"]:
+                # Another address won the race
+                s.close()
+                return
+            state["decided"] = True
+        results.put((s, None))
+
+    started = failed = 0
+    errors = []
+    while True:
+        # Start the next address after each stagger or failure
+        if started < len(addresses):
+            threading.Thread(target=attempt, args=addresses[started], daemon=True).start()
+            started += 1
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        wait = min(stagger, remaining) if started < len(addresses) else remaining
+        try:
+            s, error = results.get(timeout=wait)
+        except queue.Empty:
+            continue
+        if s is not None:
+            return s
+        errors.append(error)
+        failed += 1
+        if failed == len(addresses):
+            raise errors[0]
+
+    with lock:
+        state["decided"] = True
+    # A winner may have been queued just before the deadline
+    while not results.empty():
+        s, _ = results.get_nowait()
+        if s is not None:
+            s.close()
+    raise TimeoutError(f"Timed out connecting to {addresses[0][1][0]}")
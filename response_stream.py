@@ -0,0 +1,240 @@
+import codecs
+import zlib
+import request
+from request import (
+    cache_key, lookup_cache, build_request, send_request, parse_status_line,
+    parse_header_line, response_has_body, keeps_alive, redirect_target,
+    finish_response, parse_url,
+)
+from cache import freshness_lifetime
+from timing import phase
+from body_reader import parse_chunk_size, read_trailers
+
+CHUNK_SIZE = 64 * 1024
+
+
+class BodyDecoder:
+    """
+    Incrementally undo gzip content encoding and decode the body to text.
+
+    Bytes are fed in as they arrive; each call returns whatever text can be
+    decoded so far, holding back partial gzip blocks and split UTF-8
+    sequences until the rest of them arrives.
+    """
+    def __init__(self, response_headers, encoding="utf-8"):
+        """
+        Initialize a decoder for one response.
+
+        Args:
+            response_headers (dict): Lowercase response headers.
+            encoding (str): The character encoding of the body.
+        """
+        self.decompressor = None
+        if response_headers.get("content-encoding") == "gzip":
+            # 16 + MAX_WBITS makes zlib expect a gzip header and trailer
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.started = False
+
+    def decompress(self, data):
+        """
+        Decompress the next piece of the body.
+
+        Args:
+            data (bytes): Raw body bytes as received.
+
+        Returns:
+            bytes: The decompressed bytes available so far.
+        """
+        if self.decompressor is None:
+            return data
+        try:
+            data = self.decompressor.decompress(data)
+        except zlib.error as e:
+            if self.started:
+                raise
+            print("Received content is not gzipped, skipping decompression. Error:", e)
+            self.decompressor = None
+        self.started = True
+        return data
+
+    def flush_bytes(self):
+        """Return any bytes still buffered in the decompressor."""
+        if self.decompressor is None:
+            return b""
+        return self.decompressor.flush()
+
+    def decode(self, data, final=False):
+        """Decode decompressed bytes to text."""
+        return self.decoder.decode(data, final)
+
+
+def iter_body(reader, status, response_headers, chunk_size=CHUNK_SIZE):
+    """
+    Yield the raw body of a response in pieces as they are read.
+
+    Args:
+        reader: The buffered reader of the connection.
+        status (str): The response status code.
+        response_headers (dict): Lowercase response headers.
+        chunk_size (int): The largest piece to read at once.
+
+    Yields:
+        bytes: Body bytes with transfer encoding removed.
+    """
+    if not response_has_body(status):
+        return
+    if "content-length" in response_headers:
+        remaining = int(response_headers["content-length"])
+        while remaining > 0:
+            data = reader.read(min(chunk_size, remaining))
+            if not data:
+                raise ConnectionResetError("Connection closed mid-body")
+            remaining -= len(data)
+            yield data
+    elif response_headers.get("transfer-encoding") == "chunked":
+        while True:
+            remaining = parse_chunk_size(reader.readline())
+            if remaining == 0:
+                read_trailers(reader)
+                break
+            while remaining > 0:
+                data = reader.read(min(chunk_size, remaining))
+                if not data:
+                    raise ConnectionResetError("Connection closed mid-chunk")
+                remaining -= len(data)
+                yield data
+            if reader.readline() not in (b"\r\n", b"\n"):
+                raise ValueError("Missing CRLF after chunk data")
+    else:
+        while True:
+            data = reader.read1(chunk_size) if hasattr(reader, "read1") else reader.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+
+def is_cacheable(status, response_headers):
+    """Return True if a response body would be kept by either cache."""
+    if not status.startswith("2"):
+        return False
+    if "no-store" in response_headers.get("cache-control", "").lower():
+        return False
+    return (freshness_lifetime(response_headers) > 0
+            or "etag" in response_headers or "last-modified" in response_headers)
+
+
+def stream_http_request(host, port, path, scheme, max_redirects=5, chunk_size=CHUNK_SIZE):
+    """
+    Make an HTTP/HTTPS request and yield the body as text while it arrives.
+
+    Chunked transfer encoding, gzip and UTF-8 are all decoded incrementally,
+    so memory use is bounded by `chunk_size` unless the response is
+    cacheable, in which case the body is also collected for the caches.
+
+    Args:
+        host (str): The host to connect to.
+        port (int): The port to connect to.
+        path (str): The path to request.
+        scheme (str): The URL scheme (http or https).
+        max_redirects (int): How many redirects to follow.
+        chunk_size (int): The largest piece read from the socket at once.
+
+    Yields:
+        str: Decoded pieces of the response content.
+    """
+    key = cache_key(host, port, path, scheme)
+    with phase("cache"):
+        cached_content, disk_entry = lookup_cache(key)
+    if cached_content is not None:
+        yield from iter_text(cached_content, chunk_size)
+        return
+
+    conn, statusline = send_request(host, port, scheme, build_request(host, path, disk_entry))
+    reusable = False
+    try:
+        response = conn.reader
+        version, status, explanation = parse_status_line(statusline)
+        response_headers = {}
+        while True:
+            line = response.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            header, value = parse_header_line(line)
+            response_headers[header] = value
+
+        new_url = redirect_target(host, port, path, scheme, response_headers)
+        if new_url is not None and max_redirects > 0:
+            with phase("download"):
+                for _ in iter_body(response, status, response_headers, chunk_size):
+                    pass
+            reusable = body_is_delimited(status, response_headers) and \
+                keeps_alive(version, response_headers)
+        else:
+            new_url = None
+            decoder = BodyDecoder(response_headers)
+            collected = [] if is_cacheable(status, response_headers) else None
+            body = iter_body(response, status, response_headers, chunk_size)
+            while True:
+                # Only the reads count as download time, not what the
+                # caller does with each piece in between
+                with phase("download"):
+                    data = next(body, None)
+                if data is None:
+                    break
+                with phase("gunzip"):
+                    data = decoder.decompress(data)
+                if collected is not None:
+                    collected.append(data)
+                with phase("decode"):
+                    text = decoder.decode(data)
+                if text:
+                    yield text
+            with phase("gunzip"):
+                tail = decoder.flush_bytes()
+            if collected is not None:
+                collected.append(tail)
+            if conn.aborted:
+                # A cancelled load shut the socket down; the body may be cut short
+                raise ConnectionAbortedError("Connection aborted")
+            with phase("decode"):
+                text = decoder.decode(tail, final=True)
+            if text:
+                yield text
+            reusable = body_is_delimited(status, response_headers) and \
+                keeps_alive(version, response_headers)
+    finally:
+        # A generator closed early leaves unread bytes on the socket
+        request.open_connections.release(conn, reusable)
+
+    if new_url is not None:
+        yield from stream_http_request(*parse_url(new_url), max_redirects=max_redirects - 1,
+                                       chunk_size=chunk_size)
+        return
+    if status == "304" and disk_entry is not None:
+        content = finish_response(key, status, b"", response_headers, disk_entry)
+        if content is None:
+            yield from stream_http_request(host, port, path, scheme, max_redirects, chunk_size)
+        else:
+            yield from iter_text(content, chunk_size)
+    elif collected is not None:
+        finish_response(key, status, b"".join(collected), response_headers, disk_entry)
+
+
+def body_is_delimited(status, response_headers):
+    """Return True unless the body is only delimited by connection close."""
+    return (not response_has_body(status) or "content-length" in response_headers
+            or response_headers.get("transfer-encoding") == "chunked")
+
+
+def iter_text(content, chunk_size=CHUNK_SIZE):
+    """Yield an already-downloaded body as decoded text pieces."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for start in range(0, len(content), chunk_size):
+        with phase("decode"):
+            text = decoder.decode(content[start:start + chunk_size])
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
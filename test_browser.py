@@ -1,10 +1,55 @@
+import asyncio
+import base64
+import io
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
 import unittest
 import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from io import StringIO
-from unittest.mock import patch, mock_open, Mock
-from main import URL, load, show
+from unittest.mock import patch, mock_open, Mock, AsyncMock, ANY
+# Keep the persistent HTTP cache out of the user's home directory
+os.environ.setdefault("CREATOR_CACHE_DIR", tempfile.mkdtemp())
+from main import URL, load, show, layout
 
 from request import make_http_request, open_connections
+import request
+from cache import ResponseCache, freshness_lifetime, parse_http_date
+from disk_cache import DiskCache
+from connection_pool import ConnectionPool
+from async_request import AsyncFetcher, fetch_sync, fetch_many_sync
+from response_stream import BodyDecoder, stream_http_request
+from body_reader import BodyReader
+from file_handler import MappedFile, FileCache, handle_file_url, file_cache
+import file_handler
+from data_handler import (
+    parse_data_url, parse_media_type, iter_data_url, data_cache, MediaType, DEFAULT_MEDIA_TYPE,
+)
+from utils import lex, iter_lex, IncrementalLexer, LexedText, split_markup, MARKUP_SPLIT_RE
+from display_list import DisplayList
+from layout import DocumentLayout, LayoutCache, FontMetrics, split_paragraphs, iter_paragraphs, VSTEP
+from viewport import CanvasViewport, CONTENT_TAG
+from emoji_store import EmojiStore, EmojiMapping, Emoji, build_manifest, write_manifest, MANIFEST_NAME
+import headless
+from navigator import Navigator
+from prefetch import Prefetcher, extract_links
+from history import History, HistoryEntry
+import parallel
+from replay import Recorder, ReplayServer, Exchange, save_archive, load_archive
+from timing import LoadTiming, navigation, phase, current_timing, add_timing_hook, remove_timing_hook
+from tls import TLSSessionCache
+from bench import make_test_ca, serve_tls, tls_fetch
+from resolver import DNSCache, interleave_families, happy_eyeballs_connect
+
+# The mocked-socket tests use these hosts and must not depend on DNS
+request.resolver.pin("example.com", ["93.184.216.34"])
+request.resolver.pin("altostrat.com", ["93.184.216.35"])
 
 class TestURL(unittest.TestCase):
     """Tests for the URL class."""
@@ -53,11 +98,16 @@ class TestURL(unittest.TestCase):
 
 class TestRequest(unittest.TestCase):
     """Tests for the request method of the URL class."""
-    @patch("builtins.open", new_callable=mock_open, read_data="file content")
-    def test_file_request(self, mock_file):
+    def test_file_request(self):
         """Test the request method for a file URL."""
-        url = URL("file:///path/to/file")
-        content = url.request()
+        # Files are memory-mapped, so a real file is needed
+        with tempfile.NamedTemporaryFile("w", delete=False) as f:
+            f.write("file content")
+        try:
+            url = URL("file:///" + os.path.relpath(f.name))
+            content = url.request()
+        finally:
+            os.remove(f.name)
         self.assertEqual(content, "file content")
 
     @patch("socket.socket.connect")
@@ -85,10 +135,15 @@ class TestRequest(unittest.TestCase):
 
 class TestIntegration(unittest.TestCase):
     """Integration tests for the load function."""
-    @patch("builtins.open", new_callable=mock_open, read_data="file content")
-    def test_load_file_url(self, mock_file):
+    def test_load_file_url(self):
         """Test loading and displaying content from a file URL."""
-        url = URL("file:///path/to/file")
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, "file.txt")
+        with open(path, "w") as f:
+            f.write("file content")
+        # file:// paths are read relative to the working directory
+        url = URL("file:///" + os.path.relpath(path))
         with patch("sys.stdout", new=StringIO()) as fake_out:
             load(url)
             self.assertEqual(fake_out.getvalue(), "file content")
@@ -102,11 +157,12 @@ class TestIntegration(unittest.TestCase):
     
     def test_load_view_source_url(self):
         """Test loading and displaying content from a view-source URL."""
-        
-        url = URL("view-source:http://example.com/path")
-        with patch("sys.stdout", new=StringIO()) as fake_out:
-            load(url)
-            output = fake_out.getvalue()
+        self.addCleanup(open_connections.close_all)
+        with LocalServer(ExamplePageHandler) as server:
+            url = URL(f"view-source:http://127.0.0.1:{server.port}/path")
+            with patch("sys.stdout", new=StringIO()) as fake_out:
+                load(url)
+                output = fake_out.getvalue()
             # Check for the presence of specific elements
             self.assertIn("<!doctype html>", output)
             self.assertIn("<title>Example Domain</title>", output)
@@ -130,6 +186,10 @@ class TestShow(unittest.TestCase):
             self.assertEqual(fake_out.getvalue(), expected_output)
 
 class TestKeepAlive(unittest.TestCase):
+    def setUp(self):
+        # Earlier tests may have left a connection open to the same host
+        open_connections.close_all()
+
     @patch('socket.socket')
     def test_keep_alive(self, mock_socket):
         
@@ -161,7 +221,7 @@ class TestKeepAlive(unittest.TestCase):
         # Second request
         content2 = make_http_request("example.com", 80, "/test", "http")
 
-        self.assertEqual(len(open_connections), 2)
+        self.assertEqual(len(open_connections), 1)
         print(open_connections)
         # # Verify that socket was created only once
         # mock_socket.assert_called_once()
@@ -194,9 +254,25 @@ class TestKeepAlive(unittest.TestCase):
 
         self.assertEqual(len(open_connections), 2)
 
+    @patch('socket.socket')
+    def test_malformed_response_releases_connection(self, mock_socket):
+        open_connections.close_all()
+        for lines in ([b"garbage\r\n"], [b"HTTP/1.1 200 OK\r\n", b"no colon\r\n"]):
+            mock_conn = Mock()
+            mock_socket.return_value = mock_conn
+            mock_conn.makefile.return_value.readline.side_effect = lines
+            with self.assertRaises(ValueError):
+                make_http_request("example.com", 80, "/malformed", "http")
+            self.assertEqual(len(open_connections), 0)
+            mock_conn.close.assert_called()
+
 class TestCaching(unittest.TestCase):
     def setUp(self):
         self.maxDiff = None
+        # Earlier tests may have cached a response for the same URL
+        # or left a connection open to its host
+        request.cache.clear()
+        open_connections.close_all()
 
     @patch('socket.socket')
     def test_caching(self, mock_socket):
@@ -221,13 +297,22 @@ class TestCaching(unittest.TestCase):
 
         # Second request should use cache
         content2 = make_http_request("example.com", 80, "/resource", "http")
-        self.assertEqual(content2, b"Hello, World!")
+        self.assertEqual(content2, "Hello, World!")
 
         # Check that the send method was called only once for the first request
         self.assertEqual(mock_socket.return_value.send.call_count, 1)
 class TestCompression(unittest.TestCase):
     def setUp(self):
         self.maxDiff = None
+        # Earlier tests may have cached a response for the same URL
+        # or left a connection open to its host
+        request.cache.clear()
+        open_connections.close_all()
+        self.cache_dir = tempfile.mkdtemp()
+        disk_cache_patch = patch("request.disk_cache", DiskCache(self.cache_dir))
+        disk_cache_patch.start()
+        self.addCleanup(disk_cache_patch.stop)
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
 
     @patch('socket.socket')
     def test_compression(self, mock_socket):
@@ -247,8 +332,1381 @@ class TestCompression(unittest.TestCase):
         # Call the make_http_request function
         content = make_http_request("example.com", 80, "/resource", "http")
 
-        # Assert the decompressed content
-        self.assertEqual(content, original_content)
+        # Assert the decompressed and decoded content
+        self.assertEqual(content, original_content.decode("utf8"))
+class TestResponseCache(unittest.TestCase):
+    def test_lru_eviction_by_entry_count(self):
+        cache = ResponseCache(max_entries=2)
+        cache.put("a", b"1", 60)
+        cache.put("b", b"2", 60)
+        cache.get("a")
+        cache.put("c", b"3", 60)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"1")
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_byte_budget(self):
+        cache = ResponseCache(max_bytes=10)
+        cache.put("a", b"12345", 60)
+        cache.put("b", b"123456", 60)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.total_bytes, 6)
+        self.assertFalse(cache.put("c", b"x" * 11, 60))
+
+    def test_expiry(self):
+        cache = ResponseCache()
+        cache.put("a", b"body", 10, now=100)
+        self.assertEqual(cache.get("a", now=105), b"body")
+        self.assertIsNone(cache.get("a", now=111))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_freshness_lifetime(self):
+        date = "Wed, 21 Oct 2015 07:28:00 GMT"
+        now = parse_http_date(date)
+        self.assertEqual(freshness_lifetime({"cache-control": "max-age=60"}, now), 60)
+        self.assertEqual(freshness_lifetime({"cache-control": "max-age=60", "age": "20"}, now), 40)
+        self.assertEqual(freshness_lifetime({
+            "date": date, "expires": "Wed, 21 Oct 2015 07:38:00 GMT"}, now), 600)
+        self.assertEqual(freshness_lifetime({"expires": "0"}, now), 0)
+        self.assertEqual(freshness_lifetime({"cache-control": "no-store, max-age=60"}, now), 0)
+        self.assertEqual(freshness_lifetime({}, now), 0)
+class LocalServer:
+    """Run a BaseHTTPRequestHandler subclass on a local port in a thread."""
+    def __init__(self, handler):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ExamplePageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = (b"<!doctype html>\n<html><head><title>Example Domain</title></head>\n"
+                b"<body><h1>Example Domain</h1></body></html>\n")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RevalidatingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests_seen = []
+
+    def do_GET(self):
+        type(self).requests_seen.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.send_header("ETag", '"v1"')
+            self.end_headers()
+            return
+        body = b"cached body"
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Cache-Control", "max-age=0")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_persists_across_instances(self):
+        disk = DiskCache(self.tmp.name)
+        entry = disk.store("k", b"body", {"cache-control": "max-age=60"})
+        reopened = DiskCache(self.tmp.name)
+        self.assertEqual(reopened.read("k", reopened.lookup("k")), b"body")
+        self.assertEqual(reopened.lookup("k").digest, entry.digest)
+
+    def test_content_addressed_bodies_are_shared(self):
+        disk = DiskCache(self.tmp.name)
+        disk.store("a", b"same", {"etag": '"x"'})
+        disk.store("b", b"same", {"etag": '"y"'})
+        self.assertEqual(disk.total_bytes, 4)
+        disk.invalidate("a")
+        self.assertEqual(disk.read("b", disk.lookup("b")), b"same")
+
+    def test_disk_budget(self):
+        disk = DiskCache(self.tmp.name, max_bytes=10)
+        disk.store("a", b"x" * 6, {"etag": '"a"'}, now=1)
+        disk.store("b", b"y" * 6, {"etag": '"b"'}, now=2)
+        self.assertIsNone(disk.lookup("a"))
+        self.assertEqual(disk.stats()["evictions"], 1)
+
+    def test_hits_write_index_on_close(self):
+        disk = DiskCache(self.tmp.name)
+        disk.store("k", b"body", {"cache-control": "max-age=60"}, now=1)
+        with patch.object(disk, "_save_index", wraps=disk._save_index) as save:
+            for _ in range(3):
+                disk.read("k", disk.lookup("k"))
+            save.assert_not_called()
+            disk.close()
+            save.assert_called_once()
+        self.assertGreater(DiskCache(self.tmp.name).lookup("k").last_used, 1)
+
+    def test_unvalidated_stale_response_not_stored(self):
+        disk = DiskCache(self.tmp.name)
+        self.assertIsNone(disk.store("a", b"x", {}))
+
+    def test_304_served_from_disk(self):
+        RevalidatingHandler.requests_seen = []
+        disk = DiskCache(self.tmp.name)
+        with LocalServer(RevalidatingHandler) as server, \
+                patch.object(request, "disk_cache", disk), \
+                patch.object(request, "cache", ResponseCache()):
+            first = make_http_request("127.0.0.1", server.port, "/page", "http")
+            second = make_http_request("127.0.0.1", server.port, "/page", "http")
+        self.assertEqual(first, "cached body")
+        self.assertEqual(second, "cached body")
+        self.assertEqual(RevalidatingHandler.requests_seen[1]["If-None-Match"], '"v1"')
+        self.assertEqual(disk.stats()["revalidations"], 1)
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    close_after_response = False
+
+    def do_GET(self):
+        if self.path == "/redirect":
+            self.send_response(301)
+            self.send_header("Location", "/target")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Drop the socket without announcing it, like an idle timeout would
+        self.close_connection = type(self).close_after_response
+
+    def log_message(self, *args):
+        pass
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(request.create_connection)
+        patcher = patch.object(request, "open_connections", self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.pool.close_all)
+
+    def test_reuses_socket(self):
+        with LocalServer(KeepAliveHandler) as server:
+            self.assertEqual(make_http_request("127.0.0.1", server.port, "/a", "http"), "/a")
+            self.assertEqual(make_http_request("127.0.0.1", server.port, "/b", "http"), "/b")
+        self.assertEqual(self.pool.stats()["created"], 1)
+        self.assertEqual(self.pool.stats()["reused"], 1)
+
+    def test_same_origin_redirect_reuses_socket(self):
+        with LocalServer(KeepAliveHandler) as server:
+            content = make_http_request("127.0.0.1", server.port, "/redirect", "http")
+        self.assertEqual(content, "/target")
+        self.assertEqual(self.pool.stats()["created"], 1)
+
+    def test_dead_socket_is_replaced(self):
+        with patch.object(KeepAliveHandler, "close_after_response", True), \
+                LocalServer(KeepAliveHandler) as server:
+            make_http_request("127.0.0.1", server.port, "/a", "http")
+            time.sleep(0.05)
+            self.assertEqual(make_http_request("127.0.0.1", server.port, "/b", "http"), "/b")
+        self.assertEqual(self.pool.stats()["created"], 2)
+        self.assertEqual(self.pool.stats()["dead"], 1)
+
+    def test_idle_timeout(self):
+        pool = ConnectionPool(lambda host, port, scheme: socket.socketpair()[0], idle_timeout=0)
+        pool.release(pool.acquire("h", 80, "http"))
+        pool.prune()
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(pool.stats()["expired"], 1)
+
+    def test_idle_timeout_applies_to_other_hosts(self):
+        pool = ConnectionPool(lambda host, port, scheme: socket.socketpair()[0], idle_timeout=0)
+        pool.release(pool.acquire("a", 80, "http"))
+        conn = pool.acquire("b", 80, "http")
+        self.assertEqual(pool.stats()["expired"], 1)
+        pool.release(pool.acquire("c", 80, "http"))
+        pool.release(conn)
+        self.assertEqual(pool.stats()["expired"], 2)
+        self.assertEqual(len(pool), 1)
+        pool.close_all()
+
+    def test_per_host_limit(self):
+        pool = ConnectionPool(lambda host, port, scheme: socket.socketpair()[0],
+                              max_per_host=1, acquire_timeout=0.05)
+        conn = pool.acquire("h", 80, "http")
+        with self.assertRaises(TimeoutError):
+            pool.acquire("h", 80, "http")
+        pool.discard(conn)
+        pool.discard(pool.acquire("h", 80, "http"))
+class ChunkedGzipHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = gzip.compress(("page " + self.path).encode())
+        self.send_response(200)
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(0, len(body), 7):
+            piece = body[i:i + 7]
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(piece), piece))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args):
+        pass
+
+
+class TestAsyncFetch(unittest.TestCase):
+    def test_fetch_many_keeps_order(self):
+        with LocalServer(ChunkedGzipHandler) as server:
+            urls = [f"http://127.0.0.1:{server.port}/{i}" for i in range(5)]
+            results = fetch_many_sync(urls, concurrency=3)
+        self.assertEqual(results, [f"page /{i}" for i in range(5)])
+
+    def test_redirect(self):
+        with LocalServer(KeepAliveHandler) as server:
+            content = fetch_sync(f"http://127.0.0.1:{server.port}/redirect")
+        self.assertEqual(content, "/target")
+
+    def test_url_request_sync_wrapper(self):
+        with LocalServer(ChunkedGzipHandler) as server:
+            content = URL(f"http://127.0.0.1:{server.port}/x").request(use_async=True)
+        self.assertEqual(content, "page /x")
+
+    def test_connects_through_shared_resolver(self):
+        request.resolver.pin("async.test", ["127.0.0.1"])
+        self.addCleanup(request.resolver.pinned.pop, "async.test")
+        with LocalServer(ChunkedGzipHandler) as server:
+            content = fetch_sync(f"http://async.test:{server.port}/pinned")
+        self.assertEqual(content, "page /pinned")
+
+    def test_retry_on_closed_stream(self):
+        async def closed_stream(connection_key, fresh=False):
+            reader = asyncio.StreamReader()
+            reader.feed_eof()
+            writer = Mock()
+            writer.drain = AsyncMock()
+            return reader, writer, not fresh
+
+        fetcher = AsyncFetcher()
+        with patch.object(fetcher, "open", side_effect=closed_stream) as mock_open:
+            with self.assertRaises(ConnectionResetError):
+                asyncio.run(fetcher.send_request(("h", 80, "http"), b"GET / HTTP/1.1\r\n\r\n"))
+        self.assertEqual(mock_open.call_count, 2)
+class TestStreaming(unittest.TestCase):
+    def test_stream_chunked_gzip(self):
+        with LocalServer(ChunkedGzipHandler) as server:
+            pieces = list(stream_http_request("127.0.0.1", server.port, "/s", "http", chunk_size=4))
+        self.assertEqual("".join(pieces), "page /s")
+
+    def test_stream_times_each_phase(self):
+        open_connections.close_all()
+        with LocalServer(ChunkedGzipHandler) as server, navigation("timed") as timing:
+            pieces = stream_http_request("127.0.0.1", server.port, "/timed", "http", chunk_size=4)
+            for _ in pieces:
+                # Time spent by the consumer is not download time
+                time.sleep(0.05)
+        self.assertLessEqual({"connect", "ttfb", "download", "gunzip", "decode"},
+                             set(timing.phases))
+        self.assertLess(timing.phases["download"], 0.05)
+
+    def test_url_stream(self):
+        with LocalServer(KeepAliveHandler) as server:
+            pieces = list(URL(f"http://127.0.0.1:{server.port}/redirect").stream())
+        self.assertEqual("".join(pieces), "/target")
+
+    def test_decoder_handles_split_utf8(self):
+        body = gzip.compress("héllo wörld".encode("utf8"))
+        decoder = BodyDecoder({"content-encoding": "gzip"})
+        text = "".join(decoder.decode(decoder.decompress(body[i:i + 1])) for i in range(len(body)))
+        text += decoder.decode(decoder.flush_bytes(), final=True)
+        self.assertEqual(text, "héllo wörld")
+
+    def test_stream_stops_early(self):
+        pool = ConnectionPool(request.create_connection)
+        with LocalServer(ChunkedGzipHandler) as server, \
+                patch.object(request, "open_connections", pool):
+            stream = stream_http_request("127.0.0.1", server.port, "/s", "http", chunk_size=1)
+            next(stream)
+            stream.close()
+        self.assertEqual(len(pool), 0)
+class TestBodyReader(unittest.TestCase):
+    def reader(self, raw):
+        return BodyReader(io.BufferedReader(io.BytesIO(raw)), size_hint=4)
+
+    def test_chunked_with_extensions_and_trailers(self):
+        body = self.reader(b"5;name=value\r\nHello\r\n7\r\n, World\r\n0\r\nExpires: never\r\n\r\nNEXT")
+        self.assertEqual(body.read_chunked(), bytearray(b"Hello, World"))
+        self.assertEqual(body.trailers, {"expires": "never"})
+        self.assertEqual(body.reader.read(), b"NEXT")
+
+    def test_invalid_chunk_size(self):
+        with self.assertRaises(ValueError):
+            self.reader(b"zz\r\nHello\r\n0\r\n\r\n").read_chunked()
+        with self.assertRaises(ValueError):
+            self.reader(b"5\r\nHelloX\r\n0\r\n\r\n").read_chunked()
+
+    def test_truncated_body(self):
+        with self.assertRaises(ConnectionResetError):
+            self.reader(b"a\r\nHello").read_chunked()
+        with self.assertRaises(ConnectionResetError):
+            self.reader(b"Hello").read_content_length(10)
+class TestLex(unittest.TestCase):
+    def test_entities(self):
+        self.assertEqual(lex("&lt;div&gt;Hello&lt;/div&gt;"), "<div>Hello</div>")
+        self.assertEqual(lex("Hello &unknown; world"), "Hello &unknown; world")
+        self.assertEqual(lex("caf&eacute; &#169; &#x263A; &amp;"), "café © ☺ &")
+
+    def test_tags_and_literal_angle_brackets(self):
+        self.assertEqual(lex('<p class="a>b">x < y</p>'), "x < y")
+        self.assertEqual(lex("<!DOCTYPE html><html><body>Hi</body></html>"), "Hi")
+
+    def test_skips_script_style_and_comments(self):
+        body = "a<script>if (x < 1) {}</script>b<STYLE>p {}</style >c<!-- <p>d</p> -->e"
+        self.assertEqual(lex(body), "abce")
+
+    def test_text_after_last_tag(self):
+        self.assertEqual(lex("<p>a</p> b < c &amp; <d"), "a b < c & <d")
+        self.assertEqual(lex("<p>a</p> b <!-- <c"), "a b ")
+        self.assertEqual(lex("a<!-- b > c <d"), "a")
+        self.assertEqual(lex("a<script>x > y</style> <z"), "a")
+        self.assertEqual(lex("a<script>x</script> <z"), "a <z")
+
+    def test_split_reads_past_last_tag(self):
+        # A quoted value may end after the last ">", and an unclosed
+        # comment or <script> takes the text after it
+        for body in ('<p =">"=">"<', '<p>a<!-- b > <c', "<script>x > <y", "a > <b <!-- c"):
+            self.assertEqual(split_markup(body), MARKUP_SPLIT_RE.split(body), body)
+        self.assertEqual(lex('<p =">"=">"<'), '"=">"<')
+
+    def test_unclosed_tags_are_linear(self):
+        body = "<a x" * 40000
+        start = time.perf_counter()
+        self.assertEqual(lex(body), body)
+        self.assertEqual("".join(iter_lex([body])), body)
+        self.assertLess(time.perf_counter() - start, 2)
+class TestIncrementalLexer(unittest.TestCase):
+    DOCUMENT = (
+        '<!DOCTYPE html><p class="a>b">caf&eacute; &amp; &#x263A; x < y</p>'
+        "<script>if (a < b) {}</script><!-- <p>hidden</p> --><style>p {}</style>"
+        "<a title=it's>link</a> &notit; done"
+    )
+
+    def test_matches_lex_for_every_split(self):
+        expected = lex(self.DOCUMENT)
+        for cut in range(len(self.DOCUMENT) + 1):
+            chunks = [self.DOCUMENT[:cut], self.DOCUMENT[cut:]]
+            self.assertEqual("".join(iter_lex(chunks)), expected, cut)
+        self.assertEqual("".join(iter_lex(self.DOCUMENT)), expected)
+
+    def test_long_tags_match_lex(self):
+        # Quoted values holding ">" that close in a later chunk, and a
+        # quote that never closes
+        for body in ('<a b="c>d" ' * 10000 + ">after", '<p>a<a b="c>d' + "x" * 100000 + ">b <i>c</i>"):
+            chunks = [body[i:i + 4096] for i in range(0, len(body), 4096)]
+            start = time.perf_counter()
+            self.assertEqual("".join(iter_lex(chunks)), lex(body))
+            self.assertLess(time.perf_counter() - start, 1)
+
+    def test_pending_state_stays_small(self):
+        lexer = IncrementalLexer()
+        lexer.feed("<script>" + "x" * 100000)
+        lexer.feed("y" * 100000 + "</scr")
+        self.assertLessEqual(len(lexer.pending), len("</scr"))
+        self.assertEqual(lexer.feed("ipt>after") + lexer.close(), ["after"])
+class TestDisplayList(unittest.TestCase):
+    def test_columns_and_glyph_table(self):
+        display_list = DisplayList()
+        image = object()
+        for x, y, glyph in [(13, 18, "a"), (26, 18, "b"), (13, 36, "a"), (26, 54, image)]:
+            display_list.append(x, y, glyph)
+        self.assertEqual(len(display_list), 4)
+        self.assertEqual(display_list[2], (13, 36, "a"))
+        self.assertEqual(list(display_list)[3], (26, 54, image))
+        self.assertEqual(display_list.glyphs, ["a", "b", image])
+        self.assertEqual(display_list.max_y, 54)
+
+    def test_rows(self):
+        display_list = DisplayList()
+        for row in range(10):
+            for col in range(3):
+                display_list.append(col, row * 10, str(row))
+        self.assertEqual(display_list.row_range(20, 40), (6, 15))
+        self.assertEqual({c for _, _, c in display_list.rows(15, 35)}, {"2", "3"})
+
+    def test_layout_builds_display_list(self):
+        display_list = layout("ab\ncd", 800, 600)
+        self.assertEqual(list(display_list), [(13, 18, "ab"), (13, 54, "cd")])
+        self.assertEqual(display_list.max_y, 54)
+class TestDocumentLayout(unittest.TestCase):
+    TEXT = "\n".join(["word " * 40, "short line"] * 50)
+
+    def test_split_paragraphs_keeps_codes_together(self):
+        self.assertEqual(split_paragraphs("a\nb :x\ny: c\n"), ["a", "b :x\ny: c", ""])
+
+    def test_lazy_layout_matches_full_layout(self):
+        document = DocumentLayout(self.TEXT, 300)
+        partial = len(document.ensure(200))
+        self.assertFalse(document.complete)
+        self.assertLess(partial, len(layout(self.TEXT, 300, 600)))
+        self.assertEqual(list(document.finish()), list(layout(self.TEXT, 300, 600)))
+
+    def test_cache_reuses_paragraphs(self):
+        cache = LayoutCache()
+        DocumentLayout(self.TEXT, 300, cache=cache).finish()
+        self.assertEqual(cache.misses, 2)
+        wider = DocumentLayout(self.TEXT, 500, cache=cache).finish()
+        # Only the wrapped paragraph needs a new layout at the new width
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(list(wider), list(layout(self.TEXT, 500, 600)))
+
+    def test_documents_own_their_glyphs(self):
+        cache = LayoutCache(max_glyphs=100)
+        first = DocumentLayout("\n".join(f"line {i}" for i in range(1000)), 300, cache=cache)
+        first.finish()
+        second = DocumentLayout("other\nline 999", 300, cache=cache)
+        second.finish()
+        self.assertEqual(second.display_list.glyphs, ["other", "line 999"])
+        self.assertEqual(len(first.display_list.glyphs), 1000)
+        # Evicted layouts take their glyphs with them
+        self.assertLessEqual(sum(len(entry[0].glyphs) for entry in cache.entries.values()), 100)
+
+    def test_iter_paragraphs_matches_split_paragraphs(self):
+        for text in ["", "\n", "a\nb :x\ny: c\n", "odd: colon\nnever\nclosed", self.TEXT]:
+            for size in (1, 2, 7, 1000):
+                pieces = [text[i:i + size] for i in range(0, len(text), size)]
+                self.assertEqual(list(iter_paragraphs(pieces)), split_paragraphs(text))
+
+    def test_layout_of_pieces_reads_only_what_it_needs(self):
+        read = []
+
+        def pieces():
+            for i in range(0, len(self.TEXT), 100):
+                read.append(i)
+                yield self.TEXT[i:i + 100]
+        document = DocumentLayout(pieces(), 300)
+        document.ensure(200)
+        self.assertLess(len(read), len(self.TEXT) // 100 // 2)
+        self.assertEqual(list(document.finish()), list(layout(self.TEXT, 300, 600)))
+class TestCanvasViewport(unittest.TestCase):
+    def setUp(self):
+        self.canvas = Mock()
+        self.canvas.create_text.side_effect = range(1, 100000)
+        self.display_list = layout("abcdefghij" * 200, 100, 600)
+        self.viewport = CanvasViewport(self.canvas)
+
+    def test_draws_only_visible_rows(self):
+        self.viewport.draw(self.display_list, 0, 100)
+        start, end = self.display_list.row_range(-VSTEP, 100)
+        self.assertEqual(self.canvas.create_text.call_count, end - start)
+        self.canvas.delete.assert_not_called()
+
+    def test_scroll_moves_and_reuses_items(self):
+        self.viewport.draw(self.display_list, 0, 100)
+        self.viewport.draw(self.display_list, 90, 100)
+        self.canvas.move.assert_called_once_with(CONTENT_TAG, 0, -90)
+        # The rows that scrolled off supply items for the new rows
+        self.assertGreater(self.viewport.reused, 0)
+        self.assertEqual(self.canvas.create_text.call_count,
+                         len(self.viewport.items) + len(self.viewport.free_text))
+        self.canvas.delete.assert_not_called()
+        shown = {self.display_list[i][1] for i in self.viewport.items}
+        self.assertEqual(min(shown), 90 - VSTEP)
+
+    def test_new_display_list_hides_old_items(self):
+        self.viewport.draw(self.display_list, 0, 100)
+        shown = len(self.viewport.items)
+        self.viewport.draw(layout("", 100, 600), 0, 100)
+        self.assertEqual(self.viewport.items, {})
+        self.assertEqual(len(self.viewport.free_text), shown)
+        self.canvas.itemconfigure.assert_called_with(self.viewport.free_text[-1], state="hidden")
+class TestTextRuns(unittest.TestCase):
+    def test_runs_wrap_per_line(self):
+        display_list = layout("abcdefghij", 13 * 6, 600)
+        self.assertEqual(list(display_list), [(13, 18, "abcd"), (13, 36, "efgh"), (13, 54, "ij")])
+
+    def test_emoji_split_runs(self):
+        image = object()
+        display_list = layout("ab:1F600:cd", 800, 600, {"1F600": image})
+        self.assertEqual(list(display_list), [(13, 18, "ab"), (70, 18, image), (101, 18, "cd")])
+
+    def test_font_metrics_are_memoized(self):
+        font = Mock()
+        font.measure.side_effect = lambda c: 20 if c == "m" else 5
+        metrics = FontMetrics(font)
+        display_list = layout("mim mim", 800, 600, metrics=metrics)
+        self.assertEqual(list(display_list), [(13, 18, "mim mim")])
+        self.assertEqual(font.measure.call_count, 3)
+        self.assertEqual(metrics.widths, {"m": 20, "i": 5, " ": 5})
+        # Proportional widths decide where lines wrap
+        self.assertEqual([run for _, _, run in layout("mmmiii", 60, 600, metrics=metrics)],
+                         ["mm", "miii"])
+class TestEmojiStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name in ["1F600.png", "1F44D-1F3FD.png", "002D.png", "00A9.png", "notes.txt"]:
+            open(os.path.join(self.directory, name), "wb").close()
+        self.load_image = Mock(side_effect=lambda path: ("image", os.path.basename(path)))
+
+    def test_manifest_maps_sequences_to_files(self):
+        self.assertEqual(build_manifest(self.directory), {
+            "\U0001F600": "1F600.png",
+            "\U0001F44D\U0001F3FD": "1F44D-1F3FD.png",
+            "-": "002D.png",
+            "©": "00A9.png",
+        })
+
+    def test_mapping_decodes_nothing_up_front(self):
+        store = EmojiStore(self.directory, self.load_image)
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.mapping["\U0001F600"], Emoji("1F600"))
+        self.assertEqual(store.mapping["1F44D-1F3FD"], Emoji("1F44D-1F3FD"))
+        # Text-presentation characters stay text unless written as :CODE:
+        self.assertNotIn("-", store.mapping)
+        self.assertNotIn("©", store.mapping)
+        self.load_image.assert_not_called()
+
+    def test_images_decoded_once_and_evicted(self):
+        store = EmojiStore(self.directory, self.load_image, max_images=2)
+        for name in ["1F600", "1F600", "002D", "00A9", "1F600"]:
+            self.assertEqual(store.image(Emoji(name)), ("image", name + ".png"))
+        self.assertEqual(store.loads, 4)
+        self.assertEqual(store.evictions, 2)
+        self.assertIsNone(store.image(Emoji("FFFF")))
+
+    def test_prebuilt_manifest_is_used(self):
+        write_manifest(self.directory)
+        os.remove(os.path.join(self.directory, "002D.png"))
+        os.utime(os.path.join(self.directory, MANIFEST_NAME), (time.time() + 10, time.time() + 10))
+        self.assertIn("-", EmojiStore(self.directory).manifest)
+
+    def test_viewport_draws_emoji_images(self):
+        store = EmojiStore(self.directory, self.load_image)
+        canvas = Mock()
+        display_list = layout("hi :1F600:", 800, 600, store.mapping)
+        CanvasViewport(canvas, emoji_store=store).draw(display_list, 0, 100)
+        canvas.create_image.assert_called_once_with(13 * 3 + 13 + 31, 18, image=("image", "1F600.png"), tags=CONTENT_TAG)
+class TestEmojiTrie(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name in ["1F935.png", "1F935-1F3FF.png", "1F935-1F3FF-200D-2640-FE0F.png", "2640-FE0F.png",
+                     "0023-FE0F-20E3.png"]:
+            open(os.path.join(self.directory, name), "wb").close()
+        self.mapping = EmojiStore(self.directory).mapping
+
+    def test_longest_match(self):
+        trie = self.mapping.trie
+        text = "\U0001F935\U0001F3FF‍♀️!"
+        self.assertEqual(trie.match(text, 0), (5, Emoji("1F935-1F3FF-200D-2640-FE0F")))
+        self.assertEqual(trie.match("\U0001F935\U0001F3FF‍", 0), (2, Emoji("1F935-1F3FF")))
+        self.assertIsNone(trie.match("#1", 0))
+        self.assertIsNone(trie.match("♀", 0))
+
+    def test_sequences_without_selectors_match(self):
+        self.assertIn("\U0001F935\U0001F3FF‍♀", self.mapping.trie)
+        self.assertIn("#⃣", self.mapping.trie)
+
+    def test_layout_places_one_image_per_sequence(self):
+        text = "hi \U0001F935\U0001F3FF‍♀️\U0001F935 #1 #️⃣"
+        glyphs = [glyph for _, _, glyph in layout(text, 800, 600, self.mapping)]
+        self.assertEqual(glyphs, ["hi ", Emoji("1F935-1F3FF-200D-2640-FE0F"), Emoji("1F935"),
+                                  " #1 ", Emoji("0023-FE0F-20E3")])
+
+    def test_codes_still_work(self):
+        glyphs = [glyph for _, _, glyph in layout("a:1F935-1F3FF:b:nope:c", 800, 600, self.mapping)]
+        self.assertEqual(glyphs, ["a", Emoji("1F935-1F3FF"), "b", "c"])
+
+    def test_default_presentation(self):
+        for name in ["231A.png", "2B50.png", "00A9.png", "1F321.png"]:
+            open(os.path.join(self.directory, name), "wb").close()
+        trie = EmojiStore(self.directory).mapping.trie
+        # Watch and star are emoji on their own; copyright and thermometer need U+FE0F
+        self.assertIn("⌚", trie)
+        self.assertIn("⭐", trie)
+        self.assertNotIn("©", trie)
+        self.assertNotIn("\U0001F321", trie)
+class TestHeadless(unittest.TestCase):
+    def setUp(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".html", delete=False) as f:
+            f.write("<p>Hello &amp; welcome</p>\n" * 200)
+        self.path = f.name
+        self.addCleanup(os.remove, self.path)
+
+    def test_run_pipeline_times_each_stage(self):
+        result = headless.run_pipeline(URL("file://" + os.path.relpath(self.path)), 300, 100)
+        self.assertEqual(list(result["stages"]),
+                         ["fetch", "lex", "layout_first_screen", "layout_remaining"])
+        self.assertEqual(result["entries"], len(layout("Hello & welcome\n" * 200, 300, 100)))
+        self.assertLess(result["first_screen_entries"], result["entries"])
+        self.assertGreater(result["stages"]["lex"]["peak_bytes"], 0)
+
+    def test_bench_prints_json(self):
+        with patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            headless.main(["--bench", "--repeat", "2", "file://" + os.path.relpath(self.path)])
+        result = json.loads(stdout.getvalue())
+        self.assertEqual(result["repeat"], 2)
+        self.assertIn("peak_bytes", result["stages"]["layout_remaining"])
+
+    def test_prints_text(self):
+        with patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            headless.main(["data:text/html,<b>hi</b> &amp; bye"])
+        self.assertEqual(stdout.getvalue(), "hi & bye\n")
+class TestLoadTiming(unittest.TestCase):
+    def test_http_phases(self):
+        with LocalServer(ChunkedGzipHandler) as server:
+            with navigation("page") as timing:
+                content = URL(f"http://127.0.0.1:{server.port}/timed").request()
+        self.assertEqual(content, "page /timed")
+        phases = timing.as_dict()["phases"]
+        self.assertEqual(list(phases), ["cache", "dns", "connect", "request_sent", "ttfb",
+                                        "download", "gunzip", "decode"])
+        self.assertGreaterEqual(timing.total, sum(phases.values()))
+
+    def test_pipeline_phases_and_hook(self):
+        seen = []
+        add_timing_hook(seen.append)
+        self.addCleanup(remove_timing_hook, seen.append)
+        result = headless.run_pipeline(URL("data:text/html,<b>hi</b>"), trace_memory=False)
+        self.assertEqual(list(result["phases"]), ["read", "lex", "layout"])
+        self.assertEqual(len(seen), 1)
+        self.assertEqual(seen[0].url, "data:text/html,<b>hi</b>")
+
+    def test_no_navigation_records_nothing(self):
+        self.assertIsNone(current_timing())
+        with phase("lex"):
+            lex("<p>untimed</p>")
+        self.assertIsNone(current_timing())
+
+    def test_format(self):
+        timing = LoadTiming("x")
+        timing.add("ttfb", 0.25)
+        timing.add("dns", 0.001)
+        timing.add("ttfb", 0.25)
+        timing.finish()
+        lines = timing.format().splitlines()
+        self.assertEqual(lines[0].split(), ["dns", "1.0", "ms"])
+        self.assertEqual(lines[1].split(), ["ttfb", "500.0", "ms"])
+        self.assertEqual(lines[2].split()[0], "total")
+class SlowChunkedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    chunks_sent = 0
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for _ in range(50):
+                self.wfile.write(b"6\r\nchunk \r\n")
+                self.wfile.flush()
+                type(self).chunks_sent += 1
+                time.sleep(0.02)
+            self.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class TestNavigator(unittest.TestCase):
+    def setUp(self):
+        self.navigator = Navigator()
+        self.addCleanup(self.navigator.shutdown)
+        self.done = []
+
+    def wait(self, timeout=5):
+        deadline = time.time() + timeout
+        while self.navigator.poll():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_result_delivered_by_poll(self):
+        self.navigator.start(URL("data:text/html,hi"), lambda navigation: navigation.url.request(),
+                             lambda navigation, result: self.done.append(result), None)
+        self.assertEqual(self.done, [])
+        self.wait()
+        self.assertEqual(self.done, ["hi"])
+
+    def test_new_navigation_cancels_previous(self):
+        release = threading.Event()
+
+        def slow(navigation):
+            release.wait(5)
+            navigation.check()
+            return "slow"
+        first = self.navigator.start(URL("data:text/html,a"), slow,
+                                     lambda navigation, result: self.done.append(result), None)
+        self.navigator.start(URL("data:text/html,b"), lambda navigation: "fast",
+                             lambda navigation, result: self.done.append(result), None)
+        self.assertTrue(first.cancelled.is_set())
+        self.wait()
+        release.set()
+        time.sleep(0.05)
+        self.navigator.poll()
+        self.assertEqual(self.done, ["fast"])
+
+    def test_errors_reach_on_error(self):
+        def fail(navigation):
+            raise ValueError("bad page")
+        self.navigator.start(URL("data:text/html,a"), fail, None,
+                             lambda navigation, e: self.done.append(str(e)))
+        self.wait()
+        self.assertEqual(self.done, ["bad page"])
+
+    def test_cancel_aborts_connection_to_silent_server(self):
+        navigator = Navigator(max_workers=1)
+        self.addCleanup(navigator.shutdown)
+        silent = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(silent.close)
+        url = URL(f"http://127.0.0.1:{silent.getsockname()[1]}/never")
+        stuck = navigator.start(url, lambda navigation: list(navigation.url.stream()),
+                                lambda navigation, result: self.done.append("stuck"), None)
+        deadline = time.time() + 5
+        while not stuck.connections:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        # The only worker must come free for the next load
+        navigator.start(URL("data:text/html,next"), lambda navigation: navigation.url.request(),
+                        lambda navigation, result: self.done.append(result), None)
+        while navigator.poll():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(self.done, ["next"])
+        # The aborted connection was released, not left in the pool
+        self.assertEqual(stuck.connections, set())
+
+    def test_silent_server_times_out(self):
+        silent = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(silent.close)
+        with patch("resolver.READ_TIMEOUT", 0.2):
+            with self.assertRaises(TimeoutError):
+                make_http_request("127.0.0.1", silent.getsockname()[1], "/never", "http")
+
+    def test_cancel_stops_streaming_download(self):
+        SlowChunkedHandler.chunks_sent = 0
+
+        def stream(navigation):
+            for piece in navigation.url.stream():
+                navigation.check()
+            return "finished"
+        with LocalServer(SlowChunkedHandler) as server:
+            self.navigator.start(URL(f"http://127.0.0.1:{server.port}/slow"), stream,
+                                 lambda navigation, result: self.done.append(result), None)
+            time.sleep(0.1)
+            self.navigator.cancel()
+            time.sleep(0.3)
+        self.assertFalse(self.navigator.poll())
+        self.assertEqual(self.done, [])
+        self.assertLess(SlowChunkedHandler.chunks_sent, 50)
+class TestResolver(unittest.TestCase):
+    """Tests for the DNS cache and the Happy-Eyeballs connect."""
+    def fake_getaddrinfo(self, answers):
+        calls = []
+
+        def getaddrinfo(host, port, type=0):
+            calls.append(host)
+            if host not in answers:
+                raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+            return [(family, socket.SOCK_STREAM, 6, "", sockaddr) for family, sockaddr in answers[host]]
+        return getaddrinfo, calls
+
+    def test_caches_until_ttl_expires(self):
+        getaddrinfo, calls = self.fake_getaddrinfo({"a.test": [(socket.AF_INET, ("10.0.0.1", 0))]})
+        resolver = DNSCache(ttl=60, getaddrinfo=getaddrinfo)
+        with patch("resolver.time.monotonic", return_value=100.0):
+            self.assertEqual(resolver.resolve("a.test", 80), [(socket.AF_INET, ("10.0.0.1", 80))])
+            self.assertEqual(resolver.resolve("a.test", 443), [(socket.AF_INET, ("10.0.0.1", 443))])
+        self.assertEqual(calls, ["a.test"])
+        with patch("resolver.time.monotonic", return_value=161.0):
+            resolver.resolve("a.test", 80)
+        self.assertEqual(calls, ["a.test", "a.test"])
+        stats = resolver.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["expirations"]), (1, 2, 1))
+        self.assertAlmostEqual(stats["hit_rate"], 1 / 3)
+
+    def test_negative_caching(self):
+        getaddrinfo, calls = self.fake_getaddrinfo({})
+        resolver = DNSCache(negative_ttl=30, getaddrinfo=getaddrinfo)
+        for _ in range(3):
+            with self.assertRaises(socket.gaierror):
+                resolver.resolve("missing.test", 80)
+        self.assertEqual(calls, ["missing.test"])
+        self.assertEqual(resolver.stats()["negative_hits"], 2)
+
+    def test_pinned_hosts_skip_the_resolver(self):
+        getaddrinfo, calls = self.fake_getaddrinfo({})
+        resolver = DNSCache(getaddrinfo=getaddrinfo)
+        resolver.pin("pinned.test", ["::1", "127.0.0.1"])
+        self.assertEqual(resolver.resolve("pinned.test", 8080), [
+            (socket.AF_INET6, ("::1", 8080, 0, 0)),
+            (socket.AF_INET, ("127.0.0.1", 8080)),
+        ])
+        self.assertEqual(calls, [])
+
+    def test_interleave_families(self):
+        v6 = [(socket.AF_INET6, (f"::{i}", 80, 0, 0)) for i in range(3)]
+        v4 = [(socket.AF_INET, (f"10.0.0.{i}", 80)) for i in range(2)]
+        self.assertEqual(interleave_families(v6 + v4), [v6[0], v4[0], v6[1], v4[1], v6[2]])
+
+    def test_connect_skips_refusing_address(self):
+        unused = socket.socket()
+        unused.bind(("127.0.0.1", 0))
+        refused_port = unused.getsockname()[1]
+        unused.close()
+        with LocalServer(KeepAliveHandler) as server:
+            s = happy_eyeballs_connect([
+                (socket.AF_INET, ("127.0.0.1", refused_port)),
+                (socket.AF_INET, ("127.0.0.1", server.port)),
+            ], timeout=5, stagger=1)
+            try:
+                self.assertEqual(s.getpeername()[1], server.port)
+            finally:
+                s.close()
+
+    def test_connect_timeout(self):
+        late = []
+
+        def slow_connect(family, sockaddr, timeout):
+            time.sleep(0.5)
+            late.append(Mock())
+            return late[-1]
+        start = time.monotonic()
+        with patch("resolver.connect_to", side_effect=slow_connect):
+            with self.assertRaises(TimeoutError):
+                happy_eyeballs_connect([(socket.AF_INET, ("10.0.0.1", 80)),
+                                        (socket.AF_INET, ("10.0.0.2", 80))],
+                                       timeout=0.2, stagger=0.05)
+            self.assertLess(time.monotonic() - start, 0.5)
+            time.sleep(0.5)
+        # Connections made after the deadline are closed, not leaked
+        self.assertEqual(len(late), 2)
+        for s in late:
+            s.close.assert_called_once()
+
+    def test_failed_handshake_closes_socket(self):
+        sock = Mock()
+        sessions = Mock()
+        sessions.wrap.side_effect = OSError("handshake failed")
+        with patch("request.open_tcp", return_value=sock), \
+                patch("request.tls_sessions", sessions):
+            with self.assertRaises(OSError):
+                request.open_socket("example.com", 443, "https")
+        sock.close.assert_called_once()
+
+@unittest.skipUnless(shutil.which("openssl"), "needs the openssl tool to make a test CA")
+class TestTLSSessionCache(unittest.TestCase):
+    """Tests for the shared TLS context and session resumption."""
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.ca_cert, cert, key = make_test_ca(cls.directory.name)
+        cls.server = serve_tls(cert, key)
+        cls.port = cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.directory.cleanup()
+
+    def test_reconnect_resumes_session(self):
+        sessions = TLSSessionCache(cafile=self.ca_cert)
+        first, _ = tls_fetch(self.port, lambda sock: sessions.wrap(sock, "localhost", self.port))
+        sessions.save("localhost", self.port, first)
+        second, _ = tls_fetch(self.port, lambda sock: sessions.wrap(sock, "localhost", self.port))
+        self.assertFalse(first.session_reused)
+        self.assertTrue(second.session_reused)
+        stats = sessions.stats()
+        self.assertEqual((stats["contexts_created"], stats["handshakes"], stats["resumed"]), (1, 2, 1))
+
+    def test_requests_share_context_and_sessions(self):
+        sessions = TLSSessionCache(cafile=self.ca_cert)
+        with patch("request.tls_sessions", sessions):
+            for path in ("/delay/0/a", "/delay/0/b"):
+                make_http_request("localhost", self.port, path, "https")
+                # Force a new connection for the next request
+                request.open_connections.close_all()
+        self.assertEqual(sessions.stats()["contexts_created"], 1)
+        self.assertEqual(sessions.stats()["resumed"], 1)
+class TestMappedFile(unittest.TestCase):
+    """Tests for memory-mapped, windowed and cached file loading."""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # File URLs are relative to the working directory
+        self.path = os.path.relpath(os.path.join(self.directory.name, "page.html"))
+        file_cache.clear()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, data):
+        with open(self.path, "wb") as f:
+            f.write(data)
+
+    def test_windows_split_between_characters(self):
+        text = "héllo wörld 😀 ünïcode\r\nline two\rthree\n" * 50
+        self.write(text.encode("utf8"))
+        with open(self.path, encoding="utf8") as f:
+            expected = f.read()
+        for window_bytes in (1, 2, 3, 5, 64):
+            mapped = MappedFile(self.path, FileCache(), window_bytes)
+            windows = list(mapped)
+            self.assertGreater(len(windows), 1)
+            self.assertEqual("".join(windows), expected)
+            mapped.close()
+
+    def test_cache_is_keyed_on_mtime_and_size(self):
+        self.write(b"<p>first</p>")
+        self.assertEqual(handle_file_url(self.path), "<p>first</p>")
+        with patch("file_handler.MappedFile") as mapped:
+            self.assertEqual(handle_file_url(self.path), "<p>first</p>")
+            mapped.assert_not_called()
+        self.write(b"<p>second, longer</p>")
+        self.assertEqual(handle_file_url(self.path), "<p>second, longer</p>")
+
+    def test_truncated_file_stops_reading(self):
+        self.write(b"x" * 4096)
+        mapped = MappedFile(self.path, FileCache(), 1024)
+        self.addCleanup(mapped.close)
+        windows = iter(mapped)
+        self.assertEqual(next(windows), "x" * 1024)
+        # Reading the mapping past the new end would raise SIGBUS
+        self.write(b"x" * 10)
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            self.assertEqual(list(windows), [])
+        self.assertIn("changed while being read", fake_out.getvalue())
+
+    def test_empty_file(self):
+        self.write(b"")
+        self.assertEqual(handle_file_url(self.path), "")
+        self.assertEqual(list(MappedFile(self.path)), [])
+
+    def test_large_file_is_read_lazily(self):
+        paragraph = "<p>" + "word " * 40 + "</p>\n"
+        self.write(paragraph.encode("utf8") * 2000)
+        url = URL("file://" + self.path)
+        with patch("file_handler.LARGE_FILE_BYTES", 1024), \
+                patch("file_handler.WINDOW_BYTES", 4096):
+            body = url.source()
+            self.assertIsInstance(body, MappedFile)
+            document = DocumentLayout(LexedText(body), 300)
+            document.ensure(500)
+            # Only the first windows were decoded
+            self.assertLess(len(file_cache.entries), 5)
+            self.assertEqual(list(document.finish()),
+                             list(layout(lex(paragraph * 2000), 300, 600)))
+            # view-source prints the windows without joining them
+            with patch("sys.stdout", new_callable=StringIO) as out:
+                headless.main(["view-source:file://" + self.path])
+            self.assertEqual(out.getvalue(), paragraph * 2000 + "\n")
+class TestDataURL(unittest.TestCase):
+    """Tests for data: URL parsing and decoding."""
+    def setUp(self):
+        data_cache.clear()
+        data_cache.hits = data_cache.misses = 0
+
+    def test_media_type(self):
+        media_type, is_base64, _ = parse_data_url('Text/HTML; charset="utf-8" ;base64,')
+        self.assertEqual(media_type, MediaType("text/html", {"charset": "utf-8"}))
+        self.assertTrue(is_base64)
+        self.assertEqual(parse_data_url(";base64,")[0].essence, "text/plain")
+        self.assertEqual(parse_data_url("not a type,")[0], parse_media_type(DEFAULT_MEDIA_TYPE))
+        with self.assertRaises(ValueError):
+            parse_data_url("text/plain")
+
+    def test_percent_and_base64_decoding(self):
+        self.assertEqual(URL("data:text/html,%3Cb%3Ehi%3C/b%3E%zz").request(), "<b>hi</b>%zz")
+        self.assertEqual(URL("data:text/plain;base64,aGVs bG8=").request(), "hello")
+        self.assertEqual(URL("data:text/plain;charset=latin-1,caf%E9").request(), "café")
+        for bad in ("data:;base64,aGVsbG8===", "data:;base64,a", "data:;base64,aG=Vs"):
+            with self.assertRaises(ValueError):
+                URL(bad).request()
+
+    def test_chunks_match_whole_decode(self):
+        payload = "héllo wörld 😀 <p>&amp;</p>\n" * 200
+        encoded = base64.b64encode(payload.encode("utf8")).decode("ascii")
+        percent = "".join(f"%{byte:02X}" for byte in payload.encode("utf8"))
+        for data in ("text/plain;base64," + encoded, "text/plain," + percent):
+            for chunk_chars in (1, 2, 3, 5, 7, 1000):
+                with self.subTest(data=data[:12], chunk_chars=chunk_chars):
+                    self.assertEqual("".join(iter_data_url(data, 0, chunk_chars)), payload)
+
+    def test_repeated_loads_are_cached(self):
+        url = "data:text/plain;base64," + base64.b64encode(b"cached").decode("ascii")
+        self.assertEqual(URL(url).request(), "cached")
+        with patch("data_handler.iter_data_url") as decode:
+            self.assertEqual(URL("view-source:" + url).request(), "cached")
+            decode.assert_not_called()
+        self.assertEqual((data_cache.hits, len(data_cache.entries)), (1, 1))
+class PrefetchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    paths_seen = []
+
+    def do_GET(self):
+        type(self).paths_seen.append(self.path)
+        headers = {}
+        body = f"<p>{self.path}</p>".encode("utf8")
+        if self.path == "/no-store":
+            headers["Cache-Control"] = "no-store"
+        elif self.path == "/big":
+            body = b"x" * 4096
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPrefetcher(unittest.TestCase):
+    """Tests for speculative link prefetching."""
+    def test_extract_links_in_document_order(self):
+        body = """<a href="/b">b</a> <A class=x HREF='c?x=1&amp;y=2#top'>c</A>
+                  <a href="/b#again">b</a> <a href="mailto:me@example.com">mail</a>
+                  <a href=#self>top</a> <a href="https://other.example/d">d</a>"""
+        self.assertEqual(extract_links(body, "http://example.com/dir/page"), [
+            "http://example.com/b",
+            "http://example.com/dir/c?x=1&y=2",
+            "https://other.example/d",
+        ])
+        self.assertEqual(len(extract_links(body, "http://example.com/", limit=2)), 2)
+
+    def test_prefetched_link_is_a_cache_hit(self):
+        PrefetchHandler.paths_seen = []
+        with LocalServer(PrefetchHandler) as server:
+            base = f"http://127.0.0.1:{server.port}"
+            page = '<a href="/a">a</a><a href="/no-store">n</a><a href="/big">big</a>'
+            prefetcher = Prefetcher(max_links=3, max_bytes=1024)
+            self.assertEqual(len(prefetcher.start(base + "/", page)), 3)
+            prefetcher.wait(5)
+            stats = prefetcher.stats()
+            self.assertEqual((stats["cached"], stats["not_cacheable"], stats["too_large"]), (1, 1, 1))
+
+            prefetcher.record_navigation(base + "/a")
+            with patch("sys.stdout", new=StringIO()):
+                self.assertEqual(make_http_request("127.0.0.1", server.port, "/a", "http"), "<p>/a</p>")
+            self.assertEqual(PrefetchHandler.paths_seen.count("/a"), 1)
+            prefetcher.record_navigation(base + "/no-store")
+            stats = prefetcher.stats()
+            self.assertEqual((stats["used"], stats["navigations"]), (1, 2))
+            self.assertEqual(stats["hit_rate"], 1.0)
+            self.assertEqual(stats["navigation_hit_rate"], 0.5)
+
+    def test_navigation_cancels_pending_prefetches(self):
+        prefetcher = Prefetcher(max_links=2, concurrency=1)
+        with patch("prefetch.AsyncFetcher.request") as request_mock:
+            prefetcher.cancel()
+            cancelled = threading.Event()
+            cancelled.set()
+            asyncio.run(prefetcher.run(["http://example.com/x"], cancelled))
+            request_mock.assert_not_called()
+        self.assertEqual(prefetcher.stats()["started"], 0)
+class TestHistory(unittest.TestCase):
+    def entry(self, name, size=1000):
+        text = lex(f"{name} " * size)
+        document = DocumentLayout(text, 300)
+        document.finish()
+        return HistoryEntry(name, text, document)
+
+    def test_back_forward_and_new_visit_drops_forward_list(self):
+        history = History()
+        for name in "abc":
+            history.visit(self.entry(name))
+        self.assertFalse(history.can_go(1))
+        self.assertEqual(history.go(-1).url, "b")
+        self.assertEqual(history.go(-1).url, "a")
+        self.assertIsNone(history.go(-1))
+        self.assertEqual(history.go(1).url, "b")
+        history.visit(self.entry("d"))
+        self.assertEqual([entry.url for entry in history.entries], ["a", "b", "d"])
+        self.assertFalse(history.can_go(1))
+        self.assertEqual(history.stats()["restored"], 3)
+
+    def test_save_keeps_scroll_and_layout_of_current_page(self):
+        history = History()
+        first = self.entry("a")
+        history.visit(first)
+        document = DocumentLayout(first.text, 500)
+        history.save(first.text, 240, document)
+        self.assertEqual((first.scroll, first.document), (240, document))
+        # An error page's state is not saved into the entry
+        history.save("", 0, None)
+        self.assertEqual((first.scroll, first.document), (240, document))
+
+    def test_layouts_are_evicted_before_text_furthest_first(self):
+        entries = [self.entry(name) for name in "abcd"]
+        size = entries[0].text_bytes + entries[0].layout_bytes
+        history = History(budget_bytes=2 * size + entries[0].text_bytes)
+        for entry in entries:
+            history.visit(entry)
+        self.assertLessEqual(history.cached_bytes, history.budget_bytes)
+        a, b, c, d = entries
+        self.assertIsNone(a.document)
+        self.assertIsNotNone(a.text)
+        self.assertIsNotNone(b.document)
+        self.assertIsNotNone(c.document)
+
+        history.budget_bytes = b.text_bytes + c.text_bytes
+        history.enforce_budget()
+        self.assertEqual([e.document is None for e in entries], [True, True, True, False])
+        self.assertEqual([e.text is None for e in entries], [True, False, False, False])
+        # The current page is never evicted, whatever the budget
+        history.budget_bytes = 0
+        history.enforce_budget()
+        self.assertIsNotNone(d.document)
+        history.go(-3)
+        history.go(1)
+        stats = history.stats()
+        self.assertEqual((stats["refetched"], stats["relaid"]), (2, 0))
+        self.assertEqual(stats["texts_evicted"], 4)
+
+    def test_layout_bytes_count_glyph_strings(self):
+        entry = self.entry("word")
+        display_list = entry.document.display_list
+        columns = display_list.memory_size()
+        glyphs = sum(sys.getsizeof(glyph) for glyph in display_list.glyphs)
+        self.assertGreaterEqual(entry.layout_bytes, columns + glyphs)
+        # A new layout is measured afresh
+        entry.document = DocumentLayout("x", 300)
+        entry.document.finish()
+        self.assertLess(entry.layout_bytes, glyphs)
+
+    def test_dropped_entries_unmap_their_files(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        mapped = []
+        for name in "abc":
+            path = os.path.join(directory, name)
+            with open(path, "w") as f:
+                f.write(f"<p>{name}</p>")
+            mapped.append(MappedFile(path))
+        history = History(max_entries=2)
+        for name, source in zip("abc", mapped):
+            history.visit(HistoryEntry(name, LexedText(source)))
+        # "a" fell off the end of the history
+        self.assertEqual([source.closed for source in mapped], [True, False, False])
+        history.go(-1)
+        history.visit(self.entry("d"))
+        # "c" was in the forward list the new visit dropped
+        self.assertEqual([source.closed for source in mapped], [True, False, True])
+        history.visit(self.entry("e"))
+        self.assertEqual([source.closed for source in mapped], [True, True, True])
+
+    def test_stats_count_how_pages_were_restored(self):
+        history = History()
+        for name in "ab":
+            history.visit(self.entry(name))
+        history.entries[0].document = None
+        history.go(-1)
+        history.go(1)
+        stats = history.stats()
+        self.assertEqual((stats["restored"], stats["relaid"], stats["refetched"]), (1, 1, 0))
+        self.assertEqual(stats["hit_rate"], 1.0)
+class EOFHandler(BaseHTTPRequestHandler):
+    """Send a body delimited by closing the connection."""
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(("eof " + self.path).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        request.cache.clear()
+        patcher = patch.object(request, "disk_cache", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(request.cache.clear)
+        self.archive = os.path.join(tempfile.mkdtemp(), "pages.replay")
+
+    def record(self, handler, paths):
+        recorder = Recorder()
+        contents = []
+        with LocalServer(handler) as server, recorder:
+            for path in paths:
+                url = f"http://127.0.0.1:{server.port}{path}"
+                contents.append(make_http_request(*request.parse_url(url)))
+                recorder.pages.append(url)
+        recorder.save(self.archive)
+        request.cache.clear()
+        return contents
+
+    def replay_all(self, **kwargs):
+        with ReplayServer.from_archive(self.archive, **kwargs) as replay:
+            contents = [make_http_request(*request.parse_url(page)) for page in replay.pages]
+            return contents, replay.stats()
+
+    def test_async_fetches_record_and_replay(self):
+        recorder = Recorder()
+        with LocalServer(ChunkedGzipHandler) as server, recorder:
+            urls = [f"http://127.0.0.1:{server.port}/{i}" for i in range(3)]
+            contents = fetch_many_sync(urls)
+        recorder.pages.extend(urls)
+        recorder.save(self.archive)
+        request.cache.clear()
+        self.assertEqual(contents, [f"page /{i}" for i in range(3)])
+        # Recorded asynchronously, replayed to both engines
+        self.assertEqual(self.replay_all()[0], contents)
+        request.cache.clear()
+        with ReplayServer.from_archive(self.archive) as replay:
+            self.assertEqual(fetch_many_sync(replay.pages), contents)
+            self.assertEqual(replay.stats()["misses"], 0)
+
+    def test_archive_round_trip(self):
+        exchanges = [Exchange("http://h:80", b"GET / HTTP/1.1\r\n\r\n", b"\x00\xffraw", True)]
+        save_archive(self.archive, exchanges, ["http://h/"])
+        self.assertEqual(load_archive(self.archive), (["http://h/"], exchanges))
+
+    def test_replays_chunked_gzip_and_keep_alive(self):
+        contents = self.record(ChunkedGzipHandler, ["/a", "/b"])
+        self.assertEqual(self.replay_all(), (contents, {"origins": 1, "hits": 2, "misses": 0,
+                                                        "bytes_sent": ANY}))
+
+    def test_replays_redirects_and_bodies_read_to_eof(self):
+        self.assertEqual(self.record(KeepAliveHandler, ["/redirect"]), ["/target"])
+        self.assertEqual(self.replay_all()[0], ["/target"])
+        contents = self.record(EOFHandler, ["/x", "/y"])
+        self.assertEqual(contents, ["eof /x", "eof /y"])
+        _, exchanges = load_archive(self.archive)
+        self.assertTrue(all(exchange.closed for exchange in exchanges))
+        self.assertEqual(self.replay_all()[0], contents)
+
+    def test_replay_is_byte_exact(self):
+        self.record(ChunkedGzipHandler, ["/exact"])
+        _, [exchange] = load_archive(self.archive)
+        self.assertIn(b"Transfer-Encoding: chunked", exchange.response)
+        with ReplayServer([exchange]) as replay:
+            with socket.create_connection(replay.servers[exchange.origin].server_address) as s:
+                s.sendall(exchange.request)
+                received = b""
+                while len(received) < len(exchange.response):
+                    received += s.recv(65536)
+        self.assertEqual(received, exchange.response)
+
+    def test_unrecorded_request_is_a_miss(self):
+        self.record(KeepAliveHandler, ["/a"])
+        with ReplayServer.from_archive(self.archive) as replay:
+            origin = replay.pages[0].rsplit("/", 1)[0]
+            content = make_http_request(*request.parse_url(origin + "/b"))
+            self.assertEqual(content, "")
+            self.assertEqual(replay.stats()["misses"], 1)
+
+    def test_bandwidth_paces_response(self):
+        body = b"x" * 20000
+        response = b"HTTP/1.1 200 OK\r\nContent-Length: 20000\r\n\r\n" + body
+        exchange = Exchange("http://paced:80", b"GET / HTTP/1.1\r\n\r\n", response, False)
+        with ReplayServer([exchange], bandwidth=100000, slice_bytes=4096) as replay:
+            start = time.perf_counter()
+            content = make_http_request("paced", 80, "/", "http")
+            elapsed = time.perf_counter() - start
+        self.assertEqual(content, "x" * 20000)
+        self.assertGreaterEqual(elapsed, len(response) / 100000)
+        self.assertEqual(replay.stats()["bytes_sent"], len(response))
+class TestParallel(unittest.TestCase):
+    BODY = "".join(
+        f'<div class="post" id="p{i}">\n<h2>Title {i} &amp; more</h2>\n'
+        f"<p>Text :1F600: with &eacute;t&eacute; and a < b</p>\n"
+        "<!-- a comment\n<p>hidden</p>\n-->\n"
+        "<script>if (a < b) {\n<div>not text</div>\n}</script>\n</div>\n"
+        for i in range(300))
+
+    @classmethod
+    def tearDownClass(cls):
+        parallel.shutdown_pool()
+
+    def test_lex_parallel_matches_lex(self):
+        for workers in (2, 3, 7):
+            self.assertEqual(parallel.lex_parallel(self.BODY, workers), lex(self.BODY))
+
+    def test_cuts_start_tags_at_line_starts(self):
+        cuts = parallel.lex_boundaries(self.BODY, 4)
+        self.assertEqual(len(cuts), 3)
+        for cut in cuts:
+            self.assertEqual(self.BODY[cut - 1], "\n")
+            self.assertRegex(self.BODY[cut:cut + 2], "<[a-z/]")
+
+    def test_minified_body_is_cut_between_tags(self):
+        body = self.BODY.replace("\n", "")
+        cuts = parallel.lex_boundaries(body, 4)
+        self.assertEqual(len(cuts), 3)
+        for cut in cuts:
+            self.assertEqual(body[cut - 1], ">")
+            self.assertRegex(body[cut:cut + 2], "<[a-z/]")
+        self.assertEqual(parallel.lex_parallel(body, 4), lex(body))
+
+    def test_serial_fallback_is_not_timed_twice(self):
+        # No place to cut, and a cut inside an unclosed comment
+        for body, timed in (("plain text " * 10, 1), ("<p>a</p>\n" * 100 + "<!--\n<p>b</p>\n" * 100, 2)):
+            expected = lex(body)
+            with navigation("lex") as timing, patch.object(timing, "add", wraps=timing.add) as add:
+                self.assertEqual(parallel.lex_parallel(body, 4), expected)
+            # A refused parallel attempt and the serial lex are timed apart
+            self.assertEqual([call.args[0] for call in add.call_args_list], ["lex"] * timed)
+
+    def test_cut_inside_markup_is_refused(self):
+        body = "<p>one</p>\n<!-- open\n<p>two</p>\n--> three"
+        cut = body.index("<p>two")
+        self.assertIsNone(parallel.lex_chunk(body[:cut], body[cut:]))
+        cut = body.index("<!--")
+        self.assertEqual(parallel.lex_chunk(body[:cut], body[cut:]), "one\n")
+        # An unclosed comment near the end falls back to the serial lexer
+        body = "<p>a</p>\n" * 100 + "<!--\n<p>b</p>\n" * 100
+        self.assertEqual(parallel.lex_parallel(body, 4), lex(body))
+
+    def test_unclosed_tags_in_lookahead_are_linear(self):
+        start = time.perf_counter()
+        self.assertEqual(parallel.lex_chunk("<p>a</p>", "<a x" * 40000), "a")
+        self.assertLess(time.perf_counter() - start, 2)
+
+    def test_finish_parallel_matches_serial_layout(self):
+        text = lex(self.BODY) + "\nsplit :1F\n600: code\n" + "word " * 500
+        mapping = EmojiMapping({"1F600": Emoji("1F600"), "1F\n600": Emoji("1F600")})
+        expected = DocumentLayout(text, 300, mapping).finish()
+        for workers in (2, 5):
+            document = DocumentLayout(text, 300, mapping)
+            document.ensure(400)
+            display_list = parallel.finish_parallel(document, workers)
+            self.assertTrue(document.complete)
+            self.assertEqual(list(display_list), list(expected))
+            self.assertEqual(display_list.max_y, expected.max_y)
+
+    def test_finish_parallel_measures_glyphs_up_front(self):
+        font = Mock()
+        font.measure.side_effect = lambda c: 5 + ord(c) % 7
+        text = lex(self.BODY)
+        expected = DocumentLayout(text, 400, metrics=FontMetrics(font)).finish()
+        metrics = FontMetrics(font)
+        display_list = parallel.finish_parallel(DocumentLayout(text, 400, metrics=metrics), 3)
+        self.assertEqual(list(display_list), list(expected))
+        self.assertLessEqual(set(text) - {"\n"}, set(metrics.widths))
 if __name__ == "__main__":
     unittest.main()
 
@@ -0,0 +1,141 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# The phases of a navigation, in the order they happen
+PHASES = [
+    "cache", "read", "dns", "connect", "tls", "request_sent", "ttfb", "download",
+    "gunzip", "decode", "lex", "layout", "first_draw",
+]
+
+# Callables given every finished LoadTiming, e.g. to forward it to metrics
+timing_hooks = []
+
+_local = threading.local()
+
+
+class LoadTiming:
+    """
+    The time spent in each phase of loading one page.
+
+    Phases that happen more than once, such as the requests of a redirect
+    chain, add up.
+    """
+    def __init__(self, url):
+        """
+        Start timing a navigation.
+
+        Args:
+            url (str): The URL being loaded.
+        """
+        self.url = url
+        self.phases = {}
+        self.started = time.perf_counter()
+        self.total = None
+
+    def add(self, name, seconds):
+        """Add `seconds` to the phase `name`."""
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def finish(self):
+        """Stop the clock of the whole navigation."""
+        self.total = time.perf_counter() - self.started
+
+    def as_dict(self):
+        """Return the breakdown as plain data, phases in PHASES order."""
+        order = {name: i for i, name in enumerate(PHASES)}
+        return {
+            "url": self.url,
+            "phases": dict(sorted(self.phases.items(), key=lambda item: order.get(item[0], len(order)))),
+            "total": self.total,
+        }
+
+    def format(self):
+        """Return the breakdown as lines of text for display."""
+        data = self.as_dict()
+        lines = [f"{name:<13}{seconds * 1000:9.1f} ms" for name, seconds in data["phases"].items()]
+        if self.total is not None:
+            lines.append(f"{'total':<13}{self.total * 1000:9.1f} ms")
+        return "\n".join(lines)
+
+
+def current_timing():
+    """Return the LoadTiming of the navigation running on this thread, if any."""
+    return getattr(_local, "timing", None)
+
+
+def record(name, seconds):
+    """Add time to a phase of the current navigation, if there is one."""
+    timing = current_timing()
+    if timing is not None:
+        timing.add(name, seconds)
+
+
+@contextmanager
+def phase(name):
+    """Time the enclosed block as the phase `name` of the current navigation."""
+    timing = current_timing()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - start)
+
+
+@contextmanager
+def recording(timing):
+    """
+    Make an existing LoadTiming current on this thread for the enclosed
+    block, e.g. to continue a navigation's timing on another thread.
+    """
+    previous = current_timing()
+    _local.timing = timing
+    try:
+        yield timing
+    finally:
+        _local.timing = previous
+
+
+def finish_navigation(timing):
+    """Stop a navigation's clock and pass its timing to every hook."""
+    timing.finish()
+    for hook in list(timing_hooks):
+        try:
+            hook(timing)
+        except Exception as e:
+            print(f"Error in timing hook: {e}")
+
+
+@contextmanager
+def navigation(url):
+    """
+    Record the phases of the enclosed page load into a new LoadTiming.
+
+    Every function in timing_hooks is called with the finished timing,
+    even if the load failed.
+
+    Args:
+        url (str): The URL being loaded.
+
+    Yields:
+        LoadTiming: The breakdown being recorded.
+    """
+    timing = LoadTiming(url)
+    try:
+        with recording(timing):
+            yield timing
+    finally:
+        finish_navigation(timing)
+
+
+def add_timing_hook(hook):
+    """Call `hook(timing)` after every navigation."""
+    timing_hooks.append(hook)
+
+
+def remove_timing_hook(hook):
+    """Stop calling a hook added with add_timing_hook."""
+    timing_hooks.remove(hook)
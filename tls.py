@@ -0,0 +1,108 @@
+import os
+import ssl
+import threading
+from collections import OrderedDict
+
+# Extra CA certificates to trust, e.g. a local test CA
+TLS_CA_FILE = os.environ.get("CREATOR_CA_FILE")
+
+
+class TLSSessionCache:
+    """
+    One TLS context for every HTTPS connection, plus the last session of
+    each (host, port) so reconnects can resume it.
+
+    Loading the system CA store is the slow part of creating a context, so
+    it happens once, on first use. A resumed session skips the certificate
+    exchange and verification and saves a round trip on TLS 1.2.
+
+    Sessions must come from the same context they are offered to, which
+    is another reason the context is shared.
+    """
+    def __init__(self, context=None, cafile=None, max_sessions=256):
+        """
+        Initialize an empty session cache.
+
+        Args:
+            context (ssl.SSLContext): The context to use; a default one,
+                                      created lazily, if None.
+            cafile (str): Extra CA certificates for the default context.
+            max_sessions (int): Most sessions kept, least recently used first out.
+        """
+        self._context = context
+        self.cafile = cafile
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.contexts_created = 0
+        self.handshakes = 0
+        self.resumed = 0
+
+    @property
+    def context(self):
+        """The shared SSLContext, created on first use."""
+        if self._context is None:
+            with self.lock:
+                if self._context is None:
+                    context = ssl.create_default_context()
+                    if self.cafile:
+                        context.load_verify_locations(self.cafile)
+                    self.contexts_created += 1
+                    self._context = context
+        return self._context
+
+    def wrap(self, sock, host, port):
+        """
+        Start TLS on a connected socket, resuming the host's last session.
+
+        Args:
+            sock (socket.socket): The connected TCP socket.
+            host (str): The server name to verify and send via SNI.
+            port (int): The port, which together with host keys the session.
+
+        Returns:
+            ssl.SSLSocket: The socket after the handshake.
+        """
+        with self.lock:
+            session = self.sessions.get((host, port))
+        s = self.context.wrap_socket(sock, server_hostname=host, session=session)
+        with self.lock:
+            self.handshakes += 1
+            if s.session_reused:
+                self.resumed += 1
+        self.save(host, port, s)
+        return s
+
+    def save(self, host, port, sock):
+        """
+        Remember the session of a TLS socket for the next connection.
+
+        TLS 1.3 servers send their session tickets after the handshake, so
+        this is worth calling again once a response has been read.
+        """
+        session = getattr(sock, "session", None)
+        if session is None or not (session.has_ticket or session.id):
+            return
+        key = (host, port)
+        with self.lock:
+            self.sessions[key] = session
+            self.sessions.move_to_end(key)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    def forget(self, host, port):
+        """Drop the session of a host, e.g. after the server rejected it."""
+        with self.lock:
+            self.sessions.pop((host, port), None)
+
+    def stats(self):
+        """Return the handshake counters."""
+        with self.lock:
+            return {
+                "contexts_created": self.contexts_created,
+                "handshakes": self.handshakes,
+                "resumed": self.resumed,
+                "full": self.handshakes - self.resumed,
+                "resumption_rate": self.resumed / self.handshakes if self.handshakes else 0.0,
+                "sessions": len(self.sessions),
+            }
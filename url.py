@@ -1,8 +1,11 @@
 import ssl
 import socket
-from file_handler import handle_file_url
+from file_handler import handle_file_url, open_file_url, is_large_file
 from data_handler import handle_data_url
 from request import make_http_request
+from async_request import fetch_sync
+from response_stream import stream_http_request
+from timing import phase
 class URL:
     """A class to parse and handle different types of URLs."""
     def __init__(self, url):
@@ -23,14 +26,17 @@ class URL:
             self.is_blank = False
             try:
                 self.view_source = False
+                start = 0
                 if url.startswith("view-source:"):
                     self.view_source = True
-                    url = url[len("view-source:"):]
-                if url.startswith("data:"):
-                    # Handle data URLs separately
+                    start = len("view-source:")
+                if url.startswith("data:", start):
+                    # Handle data URLs separately, without copying what
+                    # may be megabytes of inline data
                     self.scheme = "data"
-                    self.data = url[len("data:"):]
+                    self.data_start = start + len("data:")
                 else:
+                    url = url[start:]
                     # Add file scheme if no scheme is provided
                     if "://" not in url:
                         url = "file://" + url
@@ -58,10 +64,18 @@ class URL:
             except ValueError:
                 # If URL parsing fails, treat it as about:blank
                 self.is_blank = True 
-    def request(self):
+    @property
+    def data(self):
+        """The part of a data URL after "data:"."""
+        return self.url[self.data_start:]
+
+    def request(self, use_async=False):
         """
         Send a request based on the URL scheme and return the response content.
         
+        Args:
+            use_async (bool): Fetch http(s) URLs through the asyncio engine.
+        
         Returns:
             str: The content of the response.
         """
@@ -69,9 +83,13 @@ class URL:
             return ""  # Return an empty page for about:blank
         content = ""
         if self.scheme == "file":
-            content =  handle_file_url(self.path)
+            with phase("read"):
+                content =  handle_file_url(self.path)
         elif self.scheme == "data":
-            content =  handle_data_url(self.data)
+            with phase("read"):
+                content =  handle_data_url(self.url, self.data_start)
+        elif use_async:
+            content = fetch_sync(f"{self.scheme}://{self.host}:{self.port}{self.path}")
         else:
             content  = make_http_request(self.host, self.port, self.path, self.scheme)
         if self.view_source:
@@ -79,6 +97,45 @@ class URL:
         else: 
             return self.render_content(content)
 
+    def source(self):
+        """
+        Return the content like request(), except that a file larger than
+        LARGE_FILE_BYTES is returned as its MappedFile, to be decoded a
+        window at a time as it is read.
+        
+        Returns:
+            str or MappedFile: The content of the response.
+        """
+        if not self.is_blank and self.scheme == "file" and is_large_file(self.path):
+            with phase("read"):
+                return open_file_url(self.path)
+        return self.request()
+
+    def stream(self):
+        """
+        Yield the response content in decoded pieces as it arrives.
+        
+        http(s) bodies are streamed from the network and large files a
+        window at a time; other content is produced as a single piece.
+        
+        Yields:
+            str: Pieces of the response content.
+        """
+        if self.is_blank:
+            return
+        if self.scheme in ("http", "https"):
+            yield from stream_http_request(self.host, self.port, self.path, self.scheme)
+        elif self.scheme == "file" and is_large_file(self.path):
+            mapped = open_file_url(self.path)
+            try:
+                yield from mapped
+            finally:
+                mapped.close()
+        else:
+            content = self.request()
+            if content:
+                yield content
+
     def render_content(self, content):
         # This method would normally render the HTML content
         # For now, we'll just return the content as is
@@ -1,40 +1,338 @@
+import re
+from html import unescape
+from timing import phase
+
+# Markup that produces no text: comments, <script>/<style> elements with
+# their contents, doctypes and processing instructions, and tags. A "<"
+# only opens a tag when followed by a tag name, "/", "!" or "?", so the
+# "<" in "a < b" stays text. Quoted attribute values may contain ">"; a
+# tag with an unbalanced quote ends at the first ">" instead.
+# The possessive quantifiers, which keep a failed tag match from
+# backtracking through every way of reading its quotes, need Python 3.11.
+MARKUP_RE = re.compile(r"""
+    <!--.*?(?:-->|\Z)
+  | <script(?![^\s/>])(?:=\s*"[^"]*"|=\s*'[^']*'|[^>])*+>.*?(?:</script\s*>|\Z)
+  | <style(?![^\s/>])(?:=\s*"[^"]*"|=\s*'[^']*'|[^>])*+>.*?(?:</style\s*>|\Z)
+  | </?[a-z][^\s/>]*(?:=\s*"[^"]*"|=\s*'[^']*'|[^>])*+>
+  | </?[a-z][^\s/>]*[^>]*>
+  | <[!?][^>]*>
+""", re.DOTALL | re.IGNORECASE | re.VERBOSE)
+# MARKUP_RE keeping the markup, so pieces alternate text and markup
+MARKUP_SPLIT_RE = re.compile("(" + MARKUP_RE.pattern + ")", MARKUP_RE.flags)
+# The same character reference syntax html.unescape recognizes
+CHARREF_RE = re.compile(r"&(#[0-9]+;?|#[xX][0-9a-fA-F]+;?|[^\t\n\f <&#;]{1,32};?)")
+
+
+# Decoded references seen so far; pages reuse a small set of them
+CHARREF_CACHE = {}
+
+
+def replace_charref(match):
+    """Decode one character reference against the HTML5 entity table."""
+    ref = match.group()
+    try:
+        return CHARREF_CACHE[ref]
+    except KeyError:
+        text = CHARREF_CACHE[ref] = unescape(ref)
+        return text
+
+
+def unescape_run(run):
+    """Decode the character references in a run of text."""
+    return CHARREF_RE.sub(replace_charref, run) if "&" in run else run
+
+
 def lex(body):
     """
     Display the body content by filtering out HTML tags and replacing entities.
-    
+
+    The markup is removed with a single regex split, so the text runs are
+    found in C and joined once. Comments and the contents of <script> and
+    <style> are skipped, and every HTML5 named and numeric character
+    reference is decoded.
+
     Args:
         body (str): The body content to display.
+
+    Returns:
+        str: The text content of the body.
     """
-    in_tag = False
-    text=""
-    entity_buffer = ""
-    for c in body:
-        if c == "<":
-            in_tag = True
-        elif c == ">":
-            in_tag = False
-        elif not in_tag:
-            if c == "&":
-                entity_buffer = "&"
-            elif entity_buffer:
-                entity_buffer += c
-                if entity_buffer == "&lt;":
-                    text+="<"
-                    # print("<", end="")
-                    entity_buffer = ""
-                elif entity_buffer == "&gt;":
-                    text+=">"
-                    # print(">", end="")
-                    entity_buffer = ""
-                elif entity_buffer[-1] == ";":
-                    # If we encounter an unknown entity, print it as is
-                    text+=entity_buffer
-                    # print(entity_buffer, end="")
-                    entity_buffer = ""
+    with phase("lex"):
+        if "<" not in body[body.rfind(">") + 1:]:
+            return "".join(map(unescape_run, MARKUP_RE.split(body)))
+        return "".join(map(unescape_run, split_markup(body)[0::2]))
+
+
+def split_markup(body):
+    """
+    Split a body into alternating text and markup, as MARKUP_SPLIT_RE.split
+    does, in time linear in its length.
+
+    Every tag ends with a ">", so one starting after the last ">" would be
+    scanned to the end of the body and fail; with many of them, as in
+    "<a x<a x<a x...", the split takes quadratic time. Only a comment can
+    start there, so the "<"s after the last ">" are masked for the split
+    and the first comment among them is cut off afterwards. The masked
+    text is still read by markup before it, e.g. a quoted attribute value
+    that ends there.
+
+    Args:
+        body (str): The page source.
+
+    Returns:
+        list: Text and markup pieces, starting and ending with text.
+    """
+    end = body.rfind(">") + 1
+    tail = body[end:]
+    if "<" not in tail:
+        return MARKUP_SPLIT_RE.split(body)
+    pieces = MARKUP_SPLIT_RE.split(body[:end] + tail.replace("<", "\0"))
+    # Markup before the tail can only take it by running to the end
+    if not pieces[-1]:
+        pieces[-2] = pieces[-2][:len(pieces[-2]) - len(tail)] + tail
+        return pieces
+    text = pieces[-1][:len(pieces[-1]) - len(tail)]
+    comment = tail.find("<!--")
+    if comment < 0:
+        pieces[-1] = text + tail
+    else:
+        pieces[-1] = text + tail[:comment]
+        pieces += [tail[comment:], ""]
+    return pieces
+
+
+# Pieces of the markup grammar above, for the incremental lexer
+TAG_RE = re.compile(r"""</?([a-z][^\s/>]*)(?:=\s*"[^"]*"|=\s*'[^']*'|[^>])*+>""", re.IGNORECASE)
+LOOSE_TAG_RE = re.compile(r"</?[a-z][^\s/>]*[^>]*>", re.IGNORECASE)
+TAG_NAME_RE = re.compile(r"</?[a-z][^\s/>]*", re.IGNORECASE)
+# Where a tag can end or a quoted value start; anything else is skipped
+TAG_STOP_RE = re.compile(r"[>=]")
+DECLARATION_RE = re.compile(r"<[!?][^>]*>")
+MARKUP_START_RE = re.compile(r"</?[a-z]|<[!?]", re.IGNORECASE)
+QUOTED_VALUE_RE = re.compile(r"""=\s*(["'])""")
+OPEN_VALUE_RE = re.compile(r"=\s*\Z")
+COMMENT_END_RE = re.compile(r"-->")
+RAW_TEXT_END_RE = {
+    "script": re.compile(r"</script\s*>", re.IGNORECASE),
+    "style": re.compile(r"</style\s*>", re.IGNORECASE),
+}
+# A character reference that the next chunk could still extend
+PARTIAL_CHARREF_RE = re.compile(r"&(?:#[xX]?[0-9a-fA-F]*|[^\t\n\f <&#;]{0,32})\Z")
+
+
+class IncrementalLexer:
+    """
+    Lex a document that arrives in chunks, producing the same text as lex.
+
+    Tags, comments and character references that are cut by a chunk
+    boundary are held back until the rest of them arrives, and the
+    contents of comments, <script> and <style> are dropped as they are
+    scanned, so memory grows with the chunk size rather than the document.
+    The exception is a tag with a quoted value that is still open: whether
+    the value ends at a later quote or, if none follows, the quote is read
+    as an ordinary character depends on the rest of the document, so the
+    tag is held until its quote closes or the document ends.
+    """
+    # The longest partial raw-text end marker kept between chunks
+    MAX_PENDING = 64 * 1024
+
+    def __init__(self):
+        self.pending = ""
+        # The end marker being searched for inside a comment or raw-text element
+        self.skip_until = None
+        # Where the scan of the tag at the start of `pending` stopped, and
+        # where to look for the closing quote of its open value, if any
+        self.tag_scan = None
+
+    def feed(self, chunk):
+        """
+        Lex the next chunk of the document.
+
+        Args:
+            chunk (str): The next piece of the document.
+
+        Returns:
+            list: The runs of text that are now complete.
+        """
+        data, self.pending = self.pending + chunk, ""
+        return self._scan(data, final=False)
+
+    def close(self):
+        """
+        Lex whatever is still held back at the end of the document.
+
+        Returns:
+            list: The remaining runs of text.
+        """
+        data, self.pending = self.pending, ""
+        runs = self._scan(data, final=True)
+        self.skip_until = None
+        self.tag_scan = None
+        return runs
+
+    def _scan(self, data, final):
+        runs = []
+        pos = 0
+        length = len(data)
+        # At the end of the document, no tag starts after the last ">"
+        last_gt = data.rfind(">") if final else length
+        last_quote = min(data.rfind('"'), data.rfind("'"))
+        while pos < length:
+            if self.skip_until is not None:
+                end = self.skip_until.search(data, pos)
+                if end is None:
+                    if not final:
+                        self.pending = self._skip_tail(data, pos)
+                    return runs
+                pos = end.end()
+                self.skip_until = None
+                continue
+
+            lt = data.find("<", pos)
+            if lt < 0:
+                run = data[pos:]
+                if not final:
+                    partial = PARTIAL_CHARREF_RE.search(run, max(0, len(run) - 40))
+                    if partial is not None:
+                        self.pending = run[partial.start():]
+                        run = run[:partial.start()]
+                if run:
+                    runs.append(unescape_run(run))
+                return runs
+            if lt > pos:
+                runs.append(unescape_run(data[pos:lt]))
+
+            if data.startswith("<!--", lt):
+                self.skip_until = COMMENT_END_RE
+                pos = lt + 4
+                continue
+            if not final and "<!--".startswith(data[lt:lt + 4]) and length - lt < 4:
+                self.pending = data[lt:]
+                return runs
+            if MARKUP_START_RE.match(data, lt) is None:
+                if not final and lt + 2 >= length and "</".startswith(data[lt:]):
+                    # "<" or "</" at the end could still start a tag
+                    self.pending = data[lt:]
+                    return runs
+                runs.append("<")
+                pos = lt + 1
+                continue
+
+            if lt >= last_gt:
+                match = None
+            elif data[lt + 1] in "!?":
+                match = DECLARATION_RE.match(data, lt)
+            elif final:
+                match = TAG_RE.match(data, lt) or LOOSE_TAG_RE.match(data, lt)
             else:
-                text+= str(c)
-                # print(c, end="")
+                match = self._match_tag(data, lt, last_quote)
+            if match is None:
+                if not final:
+                    self.pending = data[lt:]
+                    return runs
+                runs.append("<")
+                pos = lt + 1
+                continue
+            pos = match.end()
+            if match.re is TAG_RE and data[lt + 1] != "/":
+                self.skip_until = RAW_TEXT_END_RE.get(match.group(1).lower())
+        return runs
+
+    def _match_tag(self, data, lt, last_quote):
+        """
+        Match the tag at `lt` as TAG_RE would in the whole document, or
+        return None if that depends on text still to come.
+        """
+        if self.tag_scan is None:
+            match = TAG_RE.match(data, lt)
+            # With both kinds of quote still to come, every quoted value in
+            # the tag was read to its closing quote
+            if match is not None and match.end() <= last_quote:
+                return match
+        if self._tag_end(data, lt) is None:
+            return None
+        return TAG_RE.match(data, lt)
+
+    def _tag_end(self, data, lt):
+        """
+        Find where the tag at `lt` ends as TAG_RE reads it in the whole
+        document, or return None if that depends on text still to come.
+
+        Each quoted value is skipped to its closing quote; one that is not
+        closed yet stops the scan, which resumes from there on the next
+        chunk rather than going over the tag again.
+        """
+        if self.tag_scan is None:
+            pos, quote_from = TAG_NAME_RE.match(data, lt).end(), None
+            if pos == len(data):
+                # The name may go on in the next chunk
+                return None
         else:
-            # Print the contents inside tags as is
-            entity_buffer = ""
-    return text
+            pos, quote_from = self.tag_scan
+            pos += lt
+            if quote_from is not None:
+                quote_from += lt
+        self.tag_scan = None
+        while True:
+            stop = TAG_STOP_RE.search(data, pos)
+            if stop is None:
+                self.tag_scan = (len(data) - lt, None)
+                return None
+            pos = stop.start()
+            if data[pos] == ">":
+                return pos + 1
+            value = QUOTED_VALUE_RE.match(data, pos)
+            if value is not None:
+                close = data.find(value.group(1), max(value.end(), quote_from or 0))
+                if close < 0:
+                    self.tag_scan = (pos - lt, len(data) - lt)
+                    return None
+                pos, quote_from = close + 1, None
+            elif OPEN_VALUE_RE.match(data, pos):
+                # A quote may still follow the "="
+                self.tag_scan = (pos - lt, None)
+                return None
+            else:
+                pos += 1
+
+    def _skip_tail(self, data, pos):
+        """Keep only what could be the start of the end marker being skipped."""
+        if self.skip_until is COMMENT_END_RE:
+            return data[max(pos, len(data) - 2):]
+        lt = data.rfind("<", pos)
+        if lt < 0 or ">" in data[lt:] or len(data) - lt > self.MAX_PENDING:
+            return ""
+        return data[lt:]
+
+
+def iter_lex(chunks):
+    """
+    Lex a document given as an iterable of text chunks.
+
+    Args:
+        chunks (iterable): Pieces of the document, e.g. URL.stream().
+
+    Yields:
+        str: Runs of text, in document order.
+    """
+    lexer = IncrementalLexer()
+    for chunk in chunks:
+        yield from lexer.feed(chunk)
+    yield from lexer.close()
+
+
+class LexedText:
+    """
+    The lexed text of a document that can be read more than once in
+    pieces, e.g. a MappedFile, lexed again each time it is iterated so
+    the whole text never has to be held at once.
+    """
+    def __init__(self, source):
+        """
+        Args:
+            source (iterable): Re-iterable pieces of the document.
+        """
+        self.source = source
+
+    def __iter__(self):
+        return iter_lex(self.source)
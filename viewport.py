@@ -0,0 +1,115 @@
+from layout import VSTEP
+from emoji_store import Emoji
+
+# Tag shared by every canvas item showing page content
+CONTENT_TAG = "content"
+
+
+class CanvasViewport:
+    """
+    Keep the canvas items for the visible part of a display list.
+
+    Each text run of the display list is one canvas text item and each
+    emoji one image item.
+
+    The display list's sorted y column is searched with bisect, so a frame
+    only looks at the rows on screen. Items that stay visible across a
+    scroll are shifted together with one canvas.move; items that scroll
+    off are kept in a free list, and new rows reuse them via
+    coords/itemconfigure instead of creating fresh items; only items left
+    over are hidden.
+    """
+    def __init__(self, canvas, font=None, emoji_store=None):
+        """
+        Initialize a viewport.
+
+        Args:
+            canvas: The tkinter Canvas to draw on.
+            font: The tkinter.font.Font text runs were measured with.
+            emoji_store (EmojiStore): Decodes the images of Emoji glyphs.
+        """
+        self.canvas = canvas
+        self.emoji_store = emoji_store
+        # Runs start at their x, so text is anchored on its left edge
+        self.text_options = {"anchor": "w", "tags": CONTENT_TAG}
+        if font is not None:
+            self.text_options["font"] = font
+        self.display_list = None
+        self.scroll = 0
+        # Display list index -> (canvas item, is_text, image) for the rows
+        # currently shown; holding the image keeps Tk from freeing it while
+        # it is on screen, even if the emoji store has evicted it
+        self.items = {}
+        self.start = self.end = 0
+        self.free_text = []
+        self.free_images = []
+        self.created = 0
+        self.reused = 0
+
+    def reset(self):
+        """Hide every shown item, e.g. when the display list is replaced."""
+        for i in list(self.items):
+            self.canvas.itemconfigure(self._release(i), state="hidden")
+        self.start = self.end = 0
+
+    def draw(self, display_list, scroll, height):
+        """
+        Show the entries of the display list within the viewport.
+
+        Args:
+            display_list (DisplayList): The laid-out page.
+            scroll (int): The y position at the top of the viewport.
+            height (int): The height of the viewport.
+        """
+        if display_list is not self.display_list:
+            self.reset()
+            self.display_list = display_list
+        elif scroll != self.scroll and self.items:
+            self.canvas.move(CONTENT_TAG, 0, self.scroll - scroll)
+        self.scroll = scroll
+
+        start, end = display_list.row_range(scroll - VSTEP, scroll + height)
+        # Rows that scrolled off are released first so the new rows can take
+        # their items over directly; only the leftovers need hiding
+        released = set()
+        for i in range(self.start, min(self.end, start)):
+            released.add(self._release(i))
+        for i in range(max(self.start, end), self.end):
+            released.add(self._release(i))
+        for i in range(start, end):
+            if i not in self.items:
+                released.discard(self._show(i))
+        for item in released:
+            self.canvas.itemconfigure(item, state="hidden")
+        self.start, self.end = start, end
+
+    def _show(self, i):
+        x, y, glyph = self.display_list[i]
+        y -= self.scroll
+        canvas = self.canvas
+        is_text = isinstance(glyph, str)
+        if isinstance(glyph, Emoji):
+            image = self.emoji_store.image(glyph) if self.emoji_store is not None else None
+            glyph = image if image is not None else ""
+        free = self.free_text if is_text else self.free_images
+        if free:
+            item = free.pop()
+            canvas.coords(item, x, y)
+            if is_text:
+                canvas.itemconfigure(item, text=glyph, state="normal")
+            else:
+                canvas.itemconfigure(item, image=glyph, state="normal")
+            self.reused += 1
+        elif is_text:
+            item = canvas.create_text(x, y, text=glyph, **self.text_options)
+            self.created += 1
+        else:
+            item = canvas.create_image(x, y, image=glyph, tags=CONTENT_TAG)
+            self.created += 1
+        self.items[i] = (item, is_text, None if is_text else glyph)
+        return item
+
+    def _release(self, i):
+        item, is_text, _ = self.items.pop(i)
+        (self.free_text if is_text else self.free_images).append(item)
+        return item